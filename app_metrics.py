@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+@brief lightweight timing/counter metrics for the pow tracker
+@author: Graham Riches
+@date: Sun Oct 18 10:38:44 2026
+@description
+    Process-wide counters and latency histograms rendered in the Prometheus
+    text format. Metrics are on by default; set POW_METRICS=0 (or call
+    disable) to turn them off, in which case the instrumented code paths
+    only pay for one flag check.
+"""
+
+import os
+import time
+import bisect
+import functools
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+_enabled = os.environ.get('POW_METRICS', '1') != '0'
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def format_labels(labels, extra=()):
+    """ format a sorted label tuple as {name="value",...} """
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in pairs) + '}'
+
+
+class Counter:
+    """ monotonically increasing value per label set """
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        with self._lock:
+            return ['{}{} {}'.format(self.name, format_labels(key), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """ bucketed distribution of observed values per label set """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # the extra bucket on the end counts values over the last bound
+            counts, total = self._values.get(key, ([0] * (len(self._buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, total = self._values.get(tuple(sorted(labels.items())), ([], 0.0))
+        return sum(counts)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, format_labels(key, [('le', bound)]), cumulative))
+                cumulative += counts[-1]
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(key, [('le', '+Inf')]), cumulative))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(key), total))
+                lines.append('{}_count{} {}'.format(self.name, format_labels(key), cumulative))
+        return lines
+
+
+def register(metric):
+    """ add a metric to the process-wide registry """
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, documentation):
+    """ create and register a counter """
+    return register(Counter(name, documentation))
+
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    """ create and register a histogram """
+    return register(Histogram(name, documentation, buckets))
+
+
+def render_metrics():
+    """ render every registered metric in the Prometheus text format """
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Timer:
+    """ context manager recording the elapsed time into a histogram """
+    def __init__(self, histogram, **labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter() if _enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._start is not None:
+            self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+def timed(histogram, **labels):
+    """ decorator recording the run time of a function into a histogram """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
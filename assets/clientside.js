@@ -0,0 +1,36 @@
+/*
+ * clientside callbacks for the pow tracker pages (loaded by dash from assets/)
+ *
+ * poll_versions asks the server which components changed (a tiny, usually
+ * 304 response) so the server callbacks only run when there is something new
+ */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    pow: {
+        /*
+         * n --> interval count (only used as the trigger)
+         * names --> list of /versions keys, one per output store
+         * known --> the values currently in the output stores
+         * returns one value per store, no_update for anything unchanged
+         */
+        poll_versions: async function(n, names, ...known) {
+            const no_update = window.dash_clientside.no_update;
+            let versions;
+            try {
+                // no-cache revalidates with the ETag, unchanged versions are a 304
+                const response = await fetch('/versions', {cache: 'no-cache'});
+                if (!response.ok) {
+                    return names.map(() => no_update);
+                }
+                versions = await response.json();
+            } catch (error) {
+                return names.map(() => no_update);
+            }
+            return names.map((name, idx) => {
+                const version = versions[name];
+                return (version === undefined || version === null ||
+                        version === known[idx]) ? no_update : version;
+            });
+        }
+    }
+});
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+@brief structured NWS forecast products for the configured zones
+@author: Graham Riches
+@date: Sun Oct 18 11:08:02 2026
+@description
+    Turns the <pre> text of an NWS forecast product into structured periods
+    (snow level, snow accumulation, wind, temperatures). Two layouts are
+    understood:
+        tabular --> a row of period names followed by labelled rows of
+                    values, one column per period (the avalanche weather
+                    guidance products)
+        narrative --> '.TONIGHT...' paragraphs (zone and area forecasts)
+    Products are cached by issuance time, so each issuance is parsed once and
+    shared with the other server processes. The zones come from the
+    'forecasts' list in config.json, one entry per zone:
+        {"id": "whitefish", "name": "Whitefish Forecast", "url": "..."}
+"""
+
+import re
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from snapshot_store import write_atomic
+from web_scraper import get_forecast
+from process_singleton import per_process
+
+
+ISSUED_PATTERN = re.compile(r'^\s*(\d{3,4}) (AM|PM) ([A-Z]{3,4}) ([A-Z]{3}) ([A-Z]{3}) +'
+                            r'(\d{1,2}) (\d{4})\s*$', re.MULTILINE)
+NARRATIVE_PATTERN = re.compile(r'^\.([A-Z][A-Z ]*?)\.\.\.(.*?)(?=^\.[A-Z]|^\$\$|^&&|\Z)',
+                               re.MULTILINE | re.DOTALL)
+CELL_PATTERN = re.compile(r'\S+(?: \S+)*')  # text separated by two or more spaces
+PERIOD_WORDS = {'TODAY', 'TONIGHT', 'THIS', 'AFTERNOON', 'EVENING', 'REST', 'OF', 'THE',
+                'LATE', 'OVERNIGHT', 'NIGHT', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT',
+                'SUN', 'MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY',
+                'SUNDAY'}
+# structured field: (labels of a tabular row, pattern in a narrative paragraph)
+FIELDS = {
+    'snow_level': (('SNOW LEVEL',),
+                   r'snow levels? (?:[a-z]+ )*?(?:near |around |to |of )?(\d[\d,]* (?:feet|ft))'),
+    'accumulation': (('SNOW AMOUNT', 'SNOW ACCUM', 'NEW SNOW', 'SNOWFALL'),
+                     r'((?:new )?snow accumulations? [^.]*|'
+                     r'(?:little or no|no) (?:new )?snow accumulation)'),
+    'wind': (('WIND',), r'((?:north|south|east|west|light|gusty|variable)[\w ]* winds? [^.]*|'
+                        r'winds? [^.]*mph[^.]*)'),
+    'temps': (('TEMP', 'HIGH', 'LOW'), r'((?:highs?|lows?|temperatures?) [^.]*)'),
+    'precip': (('PRECIP', 'QPF'), r'(chance of (?:precipitation|snow|rain) [^.]*)'),
+}
+
+
+def load_zones(config_path='config.json'):
+    """ get the configured forecast zones (list of id, name, url dicts) """
+    with open(config_path) as config_file:
+        return json.load(config_file).get('forecasts', [])
+
+
+def find_issued(text):
+    """
+    find a product's issuance line
+        returns --> (issuance line, ISO datetime string or None), or
+                    (None, None) if the text has no issuance line
+    """
+    match = ISSUED_PATTERN.search(text)
+    if match is None:
+        return None, None
+    clock, half, zone, weekday, month, day, year = match.groups()
+    try:
+        issued_at = datetime.strptime('{:0>4} {} {} {} {}'.format(clock, half, month, day, year),
+                                      '%I%M %p %b %d %Y').isoformat()
+    except ValueError:
+        issued_at = None
+    return match.group(0).strip(), issued_at
+
+
+def is_period_header(cells):
+    """ check if a row's cells are all period names (i.e. TONIGHT, SUN NIGHT) """
+    return len(cells) >= 2 and all(set(cell.group(0).split()) <= PERIOD_WORDS
+                                   for cell in cells)
+
+
+def parse_tabular(text):
+    """
+    parse a product laid out as a table with a column per period
+        returns --> list of period dicts with the raw rows under 'values',
+                    empty if there is no period header row
+    """
+    periods = []
+    columns = []
+    section = ''
+    for line in text.splitlines():
+        cells = list(CELL_PATTERN.finditer(line))
+        if not cells:
+            continue
+        if is_period_header(cells):
+            columns = [(cell.start() + cell.end()) / 2 for cell in cells]
+            periods.extend({'name': cell.group(0), 'values': {}} for cell in cells)
+            section = ''
+            continue
+        if not columns:
+            continue
+        label_cell = cells[0] if cells[0].start() < min(columns) - 2 else None
+        values = cells[1:] if label_cell is not None else cells
+        label = label_cell.group(0) if label_cell is not None else ''
+        if not values:
+            section = label  # a sub-heading like 'MID SLOPE (6000 FT)'
+            continue
+        label = ' '.join(part for part in (section, label) if part) if section else label
+        first = len(periods) - len(columns)
+        for cell in values:
+            center = (cell.start() + cell.end()) / 2
+            column = min(range(len(columns)), key=lambda idx: abs(columns[idx] - center))
+            periods[first + column]['values'][label] = cell.group(0)
+    for period in periods:
+        for field, (labels, pattern) in FIELDS.items():
+            period[field] = next((value for label, value in period['values'].items()
+                                  if any(name in label.upper() for name in labels)), None)
+    return periods
+
+
+def parse_narrative(text):
+    """ parse '.PERIOD...text' paragraphs into period dicts """
+    periods = []
+    for name, body in NARRATIVE_PATTERN.findall(text):
+        body = ' '.join(body.split())
+        period = {'name': name.strip(), 'text': body}
+        for field, (labels, pattern) in FIELDS.items():
+            match = re.search(pattern, body, re.IGNORECASE)
+            period[field] = match.group(1).strip() if match else None
+        periods.append(period)
+    return periods
+
+
+def parse_product(text):
+    """
+    parse the text of an NWS forecast product
+        text --> product text (the contents of the page's <pre> tag)
+        returns --> dict with the issuance, title, periods and plain text
+    """
+    issued, issued_at = find_issued(text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    title = next((line for line in lines if not line[0].isdigit() and not line.isdigit()
+                  and len(line) > 12 and line.upper() == line), None)
+    periods = parse_tabular(text) or parse_narrative(text)
+    return {'issued': issued, 'issued_at': issued_at, 'title': title,
+            'periods': periods, 'text': text.strip()}
+
+
+def product_version(issued, text):
+    """
+    identify a product by its issuance line, or by a digest of its text if
+    it doesn't have one
+    """
+    if issued is not None:
+        return issued
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
+
+
+class ForecastProducts:
+    """ class to keep the latest parsed product for each forecast zone """
+    def __init__(self, zones, backend=None, cache_dir='cache/forecasts'):
+        """
+        create a product cache
+            zones --> list of zone dicts (id, name, url), see load_zones
+            backend --> shared cache backend (see shared_cache) so a product
+                        parsed by one server process is used by all of them,
+                        None to keep products in this process only
+            cache_dir --> each new issuance is saved here as <zone id>.json
+                          (None to not save them)
+        """
+        self.zones = {zone['id']: zone for zone in zones}
+        self._backend = backend
+        self._cache_dir = cache_dir
+        self._products = {}
+        self._lock = threading.Lock()
+
+    def shared_key(self, zone_id):
+        return 'forecast-product:' + zone_id
+
+    def latest(self, zone_id):
+        """
+        get a zone's latest parsed product, None if there isn't one yet
+        NOTE: only the small version key is read from the shared backend, the
+              product itself is only loaded when another process saved a
+              different one
+        """
+        product = self._products.get(zone_id)
+        if self._backend is not None:
+            try:
+                shared_version = self._backend.get(self.shared_key(zone_id) + ':version')
+                if shared_version is not None:
+                    shared_version = shared_version.decode('utf-8')
+                if shared_version is not None and (product is None
+                                                   or product['version'] != shared_version):
+                    shared = self._backend.get(self.shared_key(zone_id))
+                    if shared is not None:
+                        product = self._products[zone_id] = dict(json.loads(shared),
+                                                                 version=shared_version)
+            except Exception as caught_exception:
+                logging.exception(caught_exception)
+        return product
+
+    def version(self, zone_id):
+        """ get the version of a zone's latest product (None if there isn't one) """
+        product = self.latest(zone_id)
+        return None if product is None else product['version']
+
+    def refresh(self, zone_id):
+        """
+        check a zone for a new issuance, parsing it only if it's new
+            returns --> the latest product (the previous one if the page
+                        can't be reached)
+        NOTE: the page itself is only downloaded when it changed (see
+              web_scraper.ForecastCache)
+        """
+        zone = self.zones[zone_id]
+        tag = get_forecast(zone['url'])
+        if tag is None:
+            return self.latest(zone_id)
+        text = tag.get_text()
+        version = product_version(find_issued(text)[0], text)
+        with self._lock:
+            product = self.latest(zone_id)
+            if product is not None and product['version'] == version:
+                return product  # same issuance, already parsed
+            product = dict(parse_product(text), zone=zone_id, name=zone['name'],
+                           version=version)
+            self._products[zone_id] = product
+            self.save(zone_id, product)
+            return product
+
+    def save(self, zone_id, product):
+        """ share a newly parsed product and keep a copy on disk """
+        try:
+            if self._backend is not None:
+                self._backend.set(self.shared_key(zone_id), json.dumps(product).encode('utf-8'))
+                self._backend.set(self.shared_key(zone_id) + ':version',
+                                  product['version'].encode('utf-8'))
+            if self._cache_dir is not None:
+                write_atomic(os.path.join(self._cache_dir, zone_id + '.json'),
+                             lambda product_file: json.dump(product, product_file, indent=2))
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+
+    def refresh_all(self):
+        """ refresh every zone """
+        for zone_id in self.zones:
+            try:
+                self.refresh(zone_id)
+            except Exception as caught_exception:
+                logging.exception(caught_exception)
+
+
+@per_process
+def get_products():
+    """ get the process-wide products for the configured zones """
+    from shared_cache import get_backend
+    return ForecastProducts(load_zones(), get_backend())
@@ -14,7 +14,7 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 
 from pow_app import app
-from pages import summary_page
+from pages import summary_page, region_page
 
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
@@ -26,6 +26,8 @@ app.layout = html.Div([
 def display_page(pathname):
     if pathname == '/pages/summary_page':
         return summary_page.layout
+    elif pathname == '/region':
+        return region_page.layout
     else:
         return summary_page.layout
 
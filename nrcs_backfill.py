@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+@brief chunked streaming downloads of long historical ranges
+@author: Graham Riches
+@date: Sun Oct 18 10:44:48 2026
+@description
+    Splits a long [begin, end] range into right-sized requests and streams
+    the decoded chunks back one at a time (or straight into the local store),
+    so memory stays flat no matter how many years are requested. Backfills
+    into the store extend the synced range chunk by chunk, so an interrupted
+    backfill picks up from the last completed chunk.
+"""
+
+from itertools import islice
+
+from nrcs_store import iter_chunks, fetch_range, latest_complete
+
+
+def stream_series(service, triplet, element, duration, begin, end,
+                  chunk_size=None, concurrent=False, reverse=False):
+    """
+    stream a series from NRCS one chunk at a time
+        service --> NRCSService object
+        triplet, element --> series to fetch
+        duration --> DAILY or HOURLY
+        begin, end --> inclusive datetime range
+        chunk_size --> timedelta of each request, defaults to CHUNK_SIZES
+        concurrent --> fetch up to max_workers chunks at a time
+        reverse --> stream the newest chunk first
+        yields --> (chunk begin, chunk end, datetime64 array, float64 array)
+    NOTE: at most one window of chunks (max_workers if concurrent, otherwise
+          one) is held in memory at a time
+    """
+    chunks = iter_chunks(begin, end, duration, chunk_size)
+    if reverse:
+        chunks = reversed(list(chunks))
+    window = service.max_workers if concurrent else 1
+
+    def fetch(chunk):
+        return fetch_range(service, triplet, element, duration, *chunk, output='arrays')
+
+    while True:
+        batch = list(islice(chunks, window))
+        if not batch:
+            return
+        for chunk, result in zip(batch, service.run_concurrent(fetch, batch)):
+            if result is None:
+                raise IOError('could not fetch {} {} from {} to {}'.format(
+                    triplet, element, *chunk))
+            yield (chunk[0], chunk[1]) + tuple(result)
+
+
+def backfill(service, store, triplet, elements, duration, begin, end,
+             chunk_size=None, concurrent=False):
+    """
+    download a long range into the local store, chunk by chunk
+        service --> NRCSService object
+        store --> SnotelStore object
+        triplet --> station triplet
+        elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+        duration --> DAILY or HOURLY
+        begin, end --> inclusive datetime range
+        chunk_size --> timedelta of each request, defaults to CHUNK_SIZES
+        concurrent --> fetch up to max_workers chunks at a time
+        returns --> number of chunks written
+    NOTE: only data missing from the store is fetched, and each chunk is
+          marked synced as soon as it's written, so re-running an interrupted
+          backfill resumes from the last completed chunk
+    """
+    end = min(end, latest_complete(duration))
+    written = 0
+    for element in elements:
+        synced = store.synced_range(triplet, element, duration)
+        for fetch_begin, fetch_end in store.missing_ranges(triplet, element, duration,
+                                                           begin, end):
+            backwards = synced is not None and fetch_end < synced[0]
+            for chunk_begin, chunk_end, timestamps, values in stream_series(
+                    service, triplet, element, duration, fetch_begin, fetch_end,
+                    chunk_size, concurrent, reverse=backwards):
+                store.write_chunk(triplet, element, duration, (chunk_begin, chunk_end),
+                                  timestamps, values)
+                written += 1
+    return written
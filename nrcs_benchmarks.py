@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+@brief benchmarks for the NRCS data handling hot paths
+@author: Graham Riches
+@date: Sun Oct 18 10:35:09 2026
+@description
+    Times the data handling code against the offline AWDB stand-in
+    (nrcs_fake_service) and synthetic responses, so results don't depend on
+    the network and can be compared across commits. Run directly:
+        python nrcs_benchmarks.py [--latency 0.05] [--record] [--check]
+    --record appends the results (tagged with the git commit) to
+    cache/benchmark_history.jsonl, --check fails if a module takes longer
+    to import than its IMPORT_BUDGETS entry or a benchmark runs over its
+    RUNTIME_BUDGETS entry
+"""
+
+import os
+import sys
+import json
+import timeit
+import tempfile
+import argparse
+import subprocess
+import numpy as np
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from nrcs_service import NRCSService, decode_hourly_data, decode_hourly_arrays
+from nrcs_fake_service import FakeAWDBTransport
+from nrcs_qc import qc_series
+
+
+HISTORY_PATH = 'cache/benchmark_history.jsonl'
+# cumulative -X importtime budgets in seconds for the modules scripts start
+# from (heavy dependencies like zeep are only imported on first use, and
+# pandas by the pages' refresh jobs rather than at server start, dash itself
+# takes about a second)
+IMPORT_BUDGETS = {'nrcs_service': 0.3, 'nrcs_store': 0.3, 'nrcs_backfill': 0.3,
+                  'web_scraper': 0.15, 'index': 1.6, 'pages.summary_page': 1.6}
+# seconds, benchmarks with a hard limit
+RUNTIME_BUDGETS = {'qc_season_all_sites': 1.0}
+QC_ELEMENTS = ['SNWD', 'WTEQ', 'TOBS']
+
+
+def make_hourly_record(years=10, missing_every=97):
+    """
+    build a synthetic getHourlyData record
+        years --> length of the hourly record
+        missing_every --> every nth value is None, like real sensor gaps
+    """
+    start = datetime(2009, 10, 1)
+    values = []
+    for hour in range(years * 365 * 24):
+        stamp = start + timedelta(hours=hour)
+        value = None if hour % missing_every == 0 else Decimal(hour % 120)
+        values.append({'dateTime': stamp.strftime('%Y-%m-%d %H:%M'),
+                       'value': value, 'flag': 'V'})
+    return {'stationTriplet': '787:MT:SNTL', 'values': values}
+
+
+def make_raw_season(seed=0, hours=365 * 24):
+    """
+    build a year of raw hourly data for one element the way AWDB returns it:
+    sensor noise, depth sensor spikes, missing values and a few repeated
+    timestamps
+        returns --> (datetime64[ns] timestamps, float64 values)
+    """
+    generator = np.random.default_rng(seed)
+    timestamps = (np.datetime64('2018-10-01T00', 'ns')
+                  + np.arange(hours) * np.timedelta64(1, 'h'))
+    values = 60 * np.sin(np.linspace(0, np.pi, hours)) + generator.normal(0, 0.5, hours)
+    spikes = generator.choice(hours, hours // 200, replace=False)
+    values[spikes] += (generator.choice([-1, 1], len(spikes))
+                       * generator.uniform(10, 80, len(spikes)))
+    values[generator.choice(hours, hours // 50, replace=False)] = np.nan
+    repeats = generator.choice(hours, hours // 500, replace=False)
+    return (np.concatenate([timestamps, timestamps[repeats]]),
+            np.concatenate([values, values[repeats]]))
+
+
+def time_function(function, *args, repeat=3):
+    """ best of repeat wall times in seconds """
+    return min(timeit.repeat(lambda: function(*args), number=1, repeat=repeat))
+
+
+def fake_service(latency=0.0, max_workers=4, **kwargs):
+    """ get an NRCSService talking to the offline AWDB stand-in """
+    return NRCSService('test.log', max_workers=max_workers,
+                       transport=FakeAWDBTransport(latency=latency, **kwargs))
+
+
+def benchmark_hourly_decode(latency):
+    """ compare list and array decoding of a 10 year hourly response """
+    record = make_hourly_record()
+    return {'decode_hourly_lists': time_function(decode_hourly_data, record),
+            'decode_hourly_arrays': time_function(decode_hourly_arrays, record)}
+
+
+def benchmark_hourly_query(latency):
+    """ full zeep parse + decode of a 1 year hourly response """
+    service = fake_service(latency)
+    request_data = {'stationTriplets': '787:MT:SNTL', 'elementCd': 'SNWD',
+                    'ordinal': '1', 'beginDate': '2018-10-01',
+                    'endDate': '2019-09-30'}
+    return {'hourly_query_1yr': time_function(service.get_station_hourly_data,
+                                              request_data, 'arrays', repeat=1)}
+
+
+def benchmark_get_stations(latency):
+    """ getStations + per-station metadata fan-out, serial vs pooled """
+    request_data = {'stateCds': 'MT', 'networkCds': 'SNTL', 'logicalAnd': 'true'}
+    results = {}
+    for workers in (1, 8):
+        service = fake_service(latency, max_workers=workers, station_count=50)
+        results['get_stations_50_workers_{}'.format(workers)] = time_function(
+            service.get_stations, request_data, repeat=1)
+    return results
+
+
+def benchmark_refresh(latency):
+    """
+    summary refresh (run_query) and the summary callback
+    NOTE: the catalog, store and event log are temporary copies so the fake
+          stations never reach the real cache, and each run gets an empty
+          hourly window so every run is a full (cold) refresh
+    """
+    from pages import summary_page
+    import nrcs_get_data
+    from snapshot_store import SnapshotStore
+    from nrcs_hourly_window import HourlyWindow
+    from nrcs_station_catalog import StationCatalog
+    from nrcs_store import SnotelStore
+    from nrcs_storm_events import EventLog
+    service = fake_service(latency)
+    snapshots = SnapshotStore(summary_page.build_summary_figure)
+
+    def cold_refresh():
+        with mock.patch.object(summary_page, 'hourly_window', HourlyWindow()):
+            summary_page.run_query()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        catalog = StationCatalog(os.path.join(cache_dir, 'stations.db'))
+        store = SnotelStore(os.path.join(cache_dir, 'snotel.db'))
+        event_log = EventLog(os.path.join(cache_dir, 'events.db'))
+        try:
+            with mock.patch.object(summary_page, 'get_service', return_value=service), \
+                    mock.patch.object(summary_page, 'get_catalog', return_value=catalog), \
+                    mock.patch.object(summary_page, 'get_event_log', return_value=event_log), \
+                    mock.patch.object(nrcs_get_data, 'get_store', return_value=store), \
+                    mock.patch.object(summary_page, 'summary_snapshots', snapshots):
+                results = {'run_query': time_function(cold_refresh)}
+                results['summary_callback'] = time_function(summary_page.get_overnight_stats,
+                                                            0, None)
+        finally:
+            catalog.close()
+            store.close()
+            event_log.close()
+    return results
+
+
+def benchmark_qc(latency):
+    """ QC a year of hourly data for every configured site and element """
+    with open('config.json') as config_file:
+        sites = json.load(config_file)['sites']
+    series = [(make_raw_season(seed), element) for seed, element in
+              enumerate(element for site in sites for element in QC_ELEMENTS)]
+
+    def run_qc():
+        for (timestamps, values), element in series:
+            qc_series(timestamps, values, element)
+    return {'qc_season_all_sites': time_function(run_qc)}
+
+
+def import_time(module):
+    """ cumulative import time of a module in a fresh interpreter, in seconds """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    for line in reversed(output.splitlines()):
+        fields = [field.strip() for field in line.split('|')]
+        if fields[-1] == module:
+            return int(fields[1]) / 1e6
+    return None
+
+
+def benchmark_startup(latency):
+    """ import times of the entry point modules (see IMPORT_BUDGETS) """
+    return {'import_' + module: import_time(module) for module in IMPORT_BUDGETS}
+
+
+def over_budget(results):
+    """ get the imports and benchmarks that are over budget """
+    budgets = {'import_' + module: budget for module, budget in IMPORT_BUDGETS.items()}
+    budgets.update(RUNTIME_BUDGETS)
+    return [name for name, budget in budgets.items() if results.get(name, 0) > budget]
+
+
+BENCHMARKS = [benchmark_startup, benchmark_hourly_decode, benchmark_hourly_query,
+              benchmark_get_stations, benchmark_refresh, benchmark_qc]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       universal_newlines=True).strip()
+    except Exception:
+        return None
+
+
+def record_results(results, latency):
+    """ append a run to the benchmark history """
+    os.makedirs(os.path.dirname(HISTORY_PATH), exist_ok=True)
+    with open(HISTORY_PATH, 'a') as history:
+        history.write(json.dumps({'commit': git_commit(),
+                                  'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                  'latency': latency, 'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NRCS hot path benchmarks')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated AWDB round trip time in seconds')
+    parser.add_argument('--record', action='store_true',
+                        help='append results to {}'.format(HISTORY_PATH))
+    parser.add_argument('--check', action='store_true',
+                        help='exit with an error if an import is over budget')
+    args = parser.parse_args()
+    results = {}
+    for benchmark in BENCHMARKS:
+        results.update(benchmark(args.latency))
+    for name, seconds in results.items():
+        print('{:<32} {:8.3f} s'.format(name, seconds))
+    if args.record:
+        record_results(results, args.latency)
+    if args.check and over_budget(results):
+        sys.exit('over budget: {}'.format(', '.join(over_budget(results))))
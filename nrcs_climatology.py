@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+@brief precomputed per-station climatology and season statistics
+@author: Graham Riches
+@date: Sun Oct 18 10:48:47 2026
+@description
+    Day-of-season percentiles, min/max, peak SWE dates and storm (new snow and
+    settlement) statistics for a station, computed once from the aligned
+    season arrays (see nrcs_seasons) and saved as a small npz artifact. The
+    history is only rebuilt when another season completes, so comparing
+    today's snowpack to history (i.e. percent of median) is a table lookup.
+    The season in progress is kept in the same artifact under current_* keys
+    and refolded once a day, which only touches that one season.
+"""
+
+import os
+import warnings
+import numpy as np
+from datetime import datetime
+
+from nrcs_seasons import load_seasons, season_dates, season_complete
+from snapshot_store import write_atomic
+
+
+PERCENTILES = np.array([10, 25, 50, 75, 90])
+CLIMATOLOGY_SEASONS = 30  # most recent complete seasons, like the NRCS normals
+CLIMATOLOGY_ELEMENTS = ['SNWD', 'WTEQ']
+# window lengths in steps of the series (daily here, use hours for hourly data)
+STORM_WINDOWS = {'24h': 1, '48h': 2, '7d': 7}
+
+
+def season_year(date):
+    """ get the season a date belongs to (i.e. 2019 for Dec 2018) """
+    return date.year + 1 if date.month >= 11 else date.year
+
+
+def day_of_season(date):
+    """ get the day-of-season column for a date, None outside the season """
+    dates = season_dates(season_year(date))
+    day = np.searchsorted(dates, np.datetime64(date.strftime('%Y-%m-%d')))
+    if day >= len(dates) or dates[day] != np.datetime64(date.strftime('%Y-%m-%d')):
+        return None
+    return int(day)
+
+
+def window_sums(changes, window):
+    """
+    trailing rolling sums along the last axis
+        changes --> array of per-step changes (NaN counts as no change)
+        window --> number of steps to sum
+        returns --> array of the same shape, NaN where the window isn't full
+    """
+    changes = np.nan_to_num(changes)
+    sums = np.full(changes.shape, np.nan)
+    if window > changes.shape[-1]:
+        return sums
+    totals = np.cumsum(changes, axis=-1)
+    sums[..., window - 1] = totals[..., window - 1]
+    sums[..., window:] = totals[..., window:] - totals[..., :-window]
+    return sums
+
+
+def storm_metrics(depth, swe, windows=STORM_WINDOWS):
+    """
+    new snow and settlement over trailing windows
+        depth, swe --> regular snow depth and SWE series (1D, or 2D with one
+                       season per row)
+        windows --> dict of name: window length in steps
+        returns --> dict of 'new_<name>' and 'settlement_<name>' arrays
+                    aligned with the input (the first window is NaN)
+    NOTE: new snow is the sum of depth increases, settlement is the sum of
+          depth decreases on steps where SWE didn't drop (i.e. compaction
+          rather than melt)
+    """
+    depth_change = np.diff(depth, axis=-1)
+    swe_change = np.diff(swe, axis=-1)
+    new_snow = np.where(depth_change > 0, depth_change, 0.0)
+    settlement = np.where((depth_change < 0) & ~(swe_change < 0), -depth_change, 0.0)
+    pad = [(0, 0)] * (np.ndim(depth) - 1) + [(1, 0)]
+    metrics = {}
+    for name, window in windows.items():
+        for metric, changes in (('new', new_snow), ('settlement', settlement)):
+            sums = np.pad(window_sums(changes, window), pad, constant_values=np.nan)
+            metrics['{}_{}'.format(metric, name)] = sums
+    return metrics
+
+
+def season_statistics(seasons):
+    """
+    per season peak and storm statistics
+        seasons --> SeasonData object
+        returns --> dict of per season arrays
+            peak_day, peak_swe --> day index (-1 if no data) and value of peak SWE
+            max_new_<window> --> biggest new snow total
+            max_settlement_<window> --> biggest settlement
+    """
+    stats = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all NaN seasons
+        if 'WTEQ' in seasons.elements:
+            swe = seasons['WTEQ']
+            has_data = ~np.all(np.isnan(swe), axis=1)
+            peak_day = np.argmax(np.nan_to_num(swe, nan=-np.inf), axis=1)
+            stats['peak_day'] = np.where(has_data, peak_day, -1).astype(np.int16)
+            stats['peak_swe'] = np.where(has_data, np.nanmax(swe, axis=1), np.nan)
+        if 'SNWD' in seasons.elements and 'WTEQ' in seasons.elements:
+            metrics = storm_metrics(seasons['SNWD'], seasons['WTEQ'])
+            for name in STORM_WINDOWS:
+                for metric in ('new', 'settlement'):
+                    key = '{}_{}'.format(metric, name)
+                    stats['max_' + key] = np.nanmax(metrics[key], axis=1)
+    return stats
+
+
+class Climatology:
+    """ precomputed statistics for a station's seasons """
+    def __init__(self, site_triplet, years, stats):
+        """
+        create a climatology
+            years --> the complete seasons the statistics cover
+            stats --> dict of statistic name: array (see from_seasons)
+        """
+        self.site_triplet = site_triplet
+        self.years = np.asarray(years, dtype=np.int32)
+        self.stats = stats
+
+    def __getitem__(self, name):
+        return self.stats[name]
+
+    @classmethod
+    def from_seasons(cls, seasons):
+        """
+        compute the statistics from a SeasonData object
+            <element>_percentiles --> (len(PERCENTILES), SEASON_DAYS) array
+            <element>_min, <element>_max --> SEASON_DAYS arrays
+            <element>_count --> seasons with data for each day
+            peak_day, peak_swe, max_new_<window>, max_settlement_<window>
+                --> one value per season, see season_statistics
+        """
+        stats = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all NaN days
+            for element, data in seasons.elements.items():
+                stats[element + '_percentiles'] = np.nanpercentile(
+                    data, PERCENTILES, axis=0).astype(np.float32)
+                stats[element + '_min'] = np.nanmin(data, axis=0)
+                stats[element + '_max'] = np.nanmax(data, axis=0)
+                stats[element + '_count'] = np.sum(~np.isnan(data), axis=0).astype(np.int16)
+        stats.update(season_statistics(seasons))
+        return cls(seasons.site_triplet, seasons.years, stats)
+
+    def fold_current(self, seasons, day):
+        """
+        replace the statistics of the season in progress
+            seasons --> SeasonData holding only the current season
+            day --> day-of-season the data runs through
+        NOTE: stored as current_<statistic> (see season_statistics) plus
+              current_year and current_day, the history isn't touched
+        """
+        stats = {key: value for key, value in self.stats.items()
+                 if not key.startswith('current_')}
+        stats.update({'current_' + key: value
+                      for key, value in season_statistics(seasons).items()})
+        stats['current_year'] = np.asarray(seasons.years[:1], dtype=np.int32)
+        stats['current_day'] = np.asarray([day], dtype=np.int16)
+        self.stats = stats
+
+    def current(self, name):
+        """ get a statistic of the season in progress, None if it isn't folded in """
+        value = self.stats.get('current_' + name)
+        return None if value is None or not len(value) else value[0].item()
+
+    def median(self, element):
+        return self.stats[element + '_percentiles'][list(PERCENTILES).index(50)]
+
+    def percent_of_median(self, element, value, date):
+        """
+        compare a value to the day-of-season median
+            date --> datetime of the value
+            returns --> percent of median, None if there is no median to
+                        compare to (outside the season or no history)
+        """
+        day = day_of_season(date)
+        if day is None or value is None:
+            return None
+        median = self.median(element)[day]
+        if np.isnan(median) or median <= 0:
+            return None
+        return 100.0 * float(value) / float(median)
+
+    def median_peak_date(self):
+        """ get the median day of peak SWE as a 'Mon DD' label """
+        peak_day = self.stats['peak_day']
+        peak_day = peak_day[peak_day >= 0]
+        if not len(peak_day):
+            return None
+        labels = season_dates(2019)
+        return labels[int(np.median(peak_day))].astype(datetime).strftime('%b %d')
+
+    def save(self, path):
+        """ save the artifact (atomically, other processes may be reading it) """
+        write_atomic(path, lambda artifact: np.savez_compressed(
+            artifact, years=self.years, **self.stats), mode='wb')
+
+    @classmethod
+    def load(cls, path, site_triplet):
+        """ read a saved climatology, None if there isn't one """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            stats = {key: saved[key] for key in saved.files if key != 'years'}
+            return cls(site_triplet, saved['years'], stats)
+
+
+_read_climatologies = {}  # artifact path: (modified time, Climatology)
+
+
+def climatology_path(site_triplet, cache_dir):
+    return os.path.join(cache_dir, 'climatology_{}.npz'.format(site_triplet.replace(':', '_')))
+
+
+def load_climatology(site_triplet, elements=CLIMATOLOGY_ELEMENTS,
+                     seasons=CLIMATOLOGY_SEASONS, cache_dir='cache', today=None):
+    """
+    get a station's climatology, building it if another season has completed
+    and folding in the season in progress once a day
+        site_triplet --> station triplet
+        elements --> element codes to cover (SNWD and WTEQ give storm stats)
+        seasons --> number of complete seasons to cover
+        cache_dir --> directory for the artifact (and the memoized seasons)
+        returns --> Climatology object
+    NOTE: the season arrays are memoized by load_seasons, so a rebuild only
+          downloads the newly completed season, and the season in progress
+          comes from the incrementally synced store
+    """
+    today = datetime.now() if today is None else today
+    last_complete = today.year if season_complete(today.year, today) else today.year - 1
+    years = list(range(last_complete - seasons + 1, last_complete + 1))
+    path = climatology_path(site_triplet, cache_dir)
+    climatology = Climatology.load(path, site_triplet)
+    if (climatology is None or list(climatology.years) != years
+            or not all(element + '_percentiles' in climatology.stats for element in elements)):
+        climatology = Climatology.from_seasons(load_seasons(site_triplet, years, elements,
+                                                            cache_dir))
+        climatology.save(path)
+    day = day_of_season(today)
+    year = season_year(today)
+    if day is not None and (climatology.current('year') != year
+                            or climatology.current('day') != day):
+        climatology.fold_current(load_seasons(site_triplet, [year], elements, cache_dir), day)
+        climatology.save(path)
+    return climatology
+
+
+def read_climatology(site_triplet, cache_dir='cache'):
+    """
+    get a station's saved climatology without building it
+        returns --> Climatology object, None if it hasn't been built yet
+    NOTE: the artifact is only re-read when it changes, so a rebuild by
+          another server process is picked up on the next call
+    """
+    path = climatology_path(site_triplet, cache_dir)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _read_climatologies.get(path)
+    if cached is None or cached[0] != modified:
+        cached = (modified, Climatology.load(path, site_triplet))
+        _read_climatologies[path] = cached
+    return cached[1]
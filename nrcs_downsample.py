@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@brief downsampling of long time series for plotting
+@author: Graham Riches
+@date: Sun Oct 18 10:47:08 2026
+@description
+    Reduces a series to about as many points as the plot has pixels before it
+    goes into a figure, so multi-year hourly plots stay a few thousand points
+    no matter how long the history is. Two methods:
+        minmax --> keeps the min and max of each bucket (fast, keeps peaks)
+        lttb --> largest triangle three buckets (smoother visual shape)
+    The visible x range comes from a graph's relayoutData, so zooming in
+    re-samples the zoomed window at full detail.
+"""
+
+import numpy as np
+
+
+PLOT_WIDTH = 1000  # pixels, used when the graph width isn't known
+POINTS_PER_PIXEL = 2
+MAX_POINTS = 5000
+
+
+def to_numeric(x):
+    """ get x as float64 (datetimes as ns since the epoch) for the math """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def minmax_indices(y, n_out):
+    """
+    indices of the min and max of each bucket, in order
+        y --> float array (NaN values are ignored)
+        n_out --> rough number of points to keep (two per bucket)
+    """
+    n_buckets = max(n_out // 2, 1)
+    edges = np.linspace(0, len(y), n_buckets + 1).astype(np.int64)
+    filled = np.where(np.isnan(y), np.inf, y)
+    lowest = np.minimum.reduceat(filled, edges[:-1])
+    filled = np.where(np.isnan(y), -np.inf, y)
+    highest = np.maximum.reduceat(filled, edges[:-1])
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    # first index in each bucket hitting the bucket min/max
+    low_index = np.flatnonzero(y == lowest[bucket])
+    high_index = np.flatnonzero(y == highest[bucket])
+    low_index = low_index[np.unique(bucket[low_index], return_index=True)[1]]
+    high_index = high_index[np.unique(bucket[high_index], return_index=True)[1]]
+    return np.unique(np.concatenate([[0, len(y) - 1], low_index, high_index]))
+
+
+def lttb_indices(x, y, n_out):
+    """
+    indices picked by the largest triangle three buckets algorithm
+        x, y --> float arrays, x sorted (NaN y values are never picked)
+        n_out --> number of points to keep, including the first and last
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    x, y = x[valid], y[valid]
+    edges = np.linspace(1, len(y) - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, len(y) - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[edges[bucket + 1]:edges[bucket + 2]].mean()
+            next_y = y[edges[bucket + 1]:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        picked[bucket + 1] = previous
+    return valid[picked]
+
+
+def downsample(x, y, n_out, method='minmax'):
+    """
+    reduce a series to about n_out points
+        x --> sorted datetime64 or numeric array
+        y --> values (None/NaN for missing)
+        method --> 'minmax' or 'lttb'
+        returns --> (x, y) arrays, unchanged if already short enough
+    """
+    import pandas as pd
+    x = np.asarray(x)
+    y = pd.to_numeric(pd.Series(y), errors='coerce').to_numpy(dtype=np.float64)
+    if len(y) <= n_out or n_out < 3:
+        return x, y
+    if method == 'lttb':
+        keep = lttb_indices(to_numeric(x), y, n_out)
+    else:
+        keep = minmax_indices(y, n_out)
+    return x[keep], y[keep]
+
+
+def visible_range(relayout_data):
+    """
+    get the zoomed x range from a graph's relayoutData
+        returns --> (start, end) strings/numbers, or None for the full range
+    """
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    return None
+
+
+def plot_points(width=None):
+    """ number of points to send for a plot width in pixels """
+    width = PLOT_WIDTH if width is None else width
+    return min(int(width * POINTS_PER_PIXEL), MAX_POINTS)
+
+
+def downsample_range(x, y, x_range=None, width=None, method='minmax'):
+    """
+    cut a series to the visible range and downsample it for a plot
+        x, y --> full resolution series, x sorted
+        x_range --> (start, end) from visible_range, None for everything
+        width --> plot width in pixels
+        returns --> (x, y) arrays
+    NOTE: one point either side of the range is kept so lines run to the
+          plot edges
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x_range is not None:
+        start, end = x_range
+        if np.issubdtype(x.dtype, np.datetime64):
+            import pandas as pd
+            start, end = np.datetime64(pd.Timestamp(start)), np.datetime64(pd.Timestamp(end))
+        first = max(np.searchsorted(x, start, side='left') - 1, 0)
+        last = np.searchsorted(x, end, side='right') + 1
+        x, y = x[first:last], y[first:last]
+    return downsample(x, y, plot_points(width), method)
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+@brief offline stand-in for the NRCS AWDB SOAP service
+@author: Graham Riches
+@date: Sun Oct 18 10:40:56 2026
+@description
+    A zeep transport that serves a trimmed down AWDB WSDL and answers
+    getData, getHourlyData, getStationMetadata, getStationMetadataMultiple and
+    getStations requests with synthetic data, so the service code can be
+    tested and benchmarked without the network. Requests still go through
+    zeep's full serialize/parse path, so timings are representative of the
+    real client side cost.
+
+    Usage:
+        transport = FakeAWDBTransport(latency=0.05)
+        service = NRCSService('test.log', transport=transport)
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+import requests
+from lxml import etree
+from zeep.transports import Transport
+
+
+AWDB_NS = 'http://www.wcc.nrcs.usda.gov/ns/awdbWebService'
+SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+AWDB_WSDL = '''<?xml version="1.0" encoding="UTF-8"?>
+<wsdl:definitions name="AwdbWebService" targetNamespace="{ns}"
+    xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:tns="{ns}">
+  <wsdl:types>
+    <xsd:schema targetNamespace="{ns}" elementFormDefault="unqualified">
+      <xsd:complexType name="data">
+        <xsd:sequence>
+          <xsd:element name="beginDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="collectionDates" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+          <xsd:element name="duration" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="endDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="flags" type="xsd:string" minOccurs="0" maxOccurs="unbounded" nillable="true"/>
+          <xsd:element name="stationTriplet" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="values" type="xsd:decimal" minOccurs="0" maxOccurs="unbounded" nillable="true"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="hourlyDataValue">
+        <xsd:sequence>
+          <xsd:element name="dateTime" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="flag" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="value" type="xsd:decimal" minOccurs="0"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="hourlyData">
+        <xsd:sequence>
+          <xsd:element name="beginDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="endDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="stationTriplet" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="values" type="tns:hourlyDataValue" minOccurs="0" maxOccurs="unbounded" nillable="true"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="stationMetaData">
+        <xsd:sequence>
+          <xsd:element name="actonId" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="beginDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="countyName" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="elevation" type="xsd:decimal" minOccurs="0"/>
+          <xsd:element name="endDate" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="fipsCountryCd" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="fipsCountyCd" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="fipsStateNumber" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="huc" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="hud" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="latitude" type="xsd:decimal" minOccurs="0"/>
+          <xsd:element name="longitude" type="xsd:decimal" minOccurs="0"/>
+          <xsd:element name="name" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="shefId" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="stationDataTimeZone" type="xsd:decimal" minOccurs="0"/>
+          <xsd:element name="stationTimeZone" type="xsd:decimal" minOccurs="0"/>
+          <xsd:element name="stationTriplet" type="xsd:string" minOccurs="0"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:element name="getData">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="stationTriplets" type="xsd:string" maxOccurs="unbounded"/>
+            <xsd:element name="elementCd" type="xsd:string"/>
+            <xsd:element name="ordinal" type="xsd:int"/>
+            <xsd:element name="heightDepth" type="xsd:string" minOccurs="0"/>
+            <xsd:element name="duration" type="xsd:string"/>
+            <xsd:element name="getFlags" type="xsd:boolean"/>
+            <xsd:element name="beginDate" type="xsd:string"/>
+            <xsd:element name="endDate" type="xsd:string"/>
+            <xsd:element name="alwaysReturnDailyFeb29" type="xsd:boolean" minOccurs="0"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getDataResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="tns:data" minOccurs="0" maxOccurs="unbounded"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getHourlyData">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="stationTriplets" type="xsd:string" maxOccurs="unbounded"/>
+            <xsd:element name="elementCd" type="xsd:string"/>
+            <xsd:element name="ordinal" type="xsd:int"/>
+            <xsd:element name="heightDepth" type="xsd:string" minOccurs="0"/>
+            <xsd:element name="beginDate" type="xsd:string"/>
+            <xsd:element name="endDate" type="xsd:string"/>
+            <xsd:element name="beginHour" type="xsd:int" minOccurs="0"/>
+            <xsd:element name="endHour" type="xsd:int" minOccurs="0"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getHourlyDataResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="tns:hourlyData" minOccurs="0" maxOccurs="unbounded"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStationMetadata">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="stationTriplet" type="xsd:string"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStationMetadataResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="tns:stationMetaData" minOccurs="0"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStationMetadataMultiple">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="stationTriplets" type="xsd:string" maxOccurs="unbounded"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStationMetadataMultipleResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="tns:stationMetaData" minOccurs="0" maxOccurs="unbounded"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStations">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="stationIds" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="stateCds" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="networkCds" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="hucs" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="countyNames" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="minLatitude" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="maxLatitude" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="minLongitude" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="maxLongitude" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="minElevation" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="maxElevation" type="xsd:decimal" minOccurs="0"/>
+            <xsd:element name="elementCds" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="ordinals" type="xsd:int" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="heightDepths" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+            <xsd:element name="logicalAnd" type="xsd:boolean"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getStationsResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="xsd:string" minOccurs="0" maxOccurs="unbounded"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </wsdl:types>
+  <wsdl:message name="getData"><wsdl:part name="parameters" element="tns:getData"/></wsdl:message>
+  <wsdl:message name="getDataResponse"><wsdl:part name="parameters" element="tns:getDataResponse"/></wsdl:message>
+  <wsdl:message name="getHourlyData"><wsdl:part name="parameters" element="tns:getHourlyData"/></wsdl:message>
+  <wsdl:message name="getHourlyDataResponse"><wsdl:part name="parameters" element="tns:getHourlyDataResponse"/></wsdl:message>
+  <wsdl:message name="getStationMetadata"><wsdl:part name="parameters" element="tns:getStationMetadata"/></wsdl:message>
+  <wsdl:message name="getStationMetadataResponse"><wsdl:part name="parameters" element="tns:getStationMetadataResponse"/></wsdl:message>
+  <wsdl:message name="getStationMetadataMultiple"><wsdl:part name="parameters" element="tns:getStationMetadataMultiple"/></wsdl:message>
+  <wsdl:message name="getStationMetadataMultipleResponse"><wsdl:part name="parameters" element="tns:getStationMetadataMultipleResponse"/></wsdl:message>
+  <wsdl:message name="getStations"><wsdl:part name="parameters" element="tns:getStations"/></wsdl:message>
+  <wsdl:message name="getStationsResponse"><wsdl:part name="parameters" element="tns:getStationsResponse"/></wsdl:message>
+  <wsdl:portType name="AwdbWebService">
+    <wsdl:operation name="getData"><wsdl:input message="tns:getData"/><wsdl:output message="tns:getDataResponse"/></wsdl:operation>
+    <wsdl:operation name="getHourlyData"><wsdl:input message="tns:getHourlyData"/><wsdl:output message="tns:getHourlyDataResponse"/></wsdl:operation>
+    <wsdl:operation name="getStationMetadata"><wsdl:input message="tns:getStationMetadata"/><wsdl:output message="tns:getStationMetadataResponse"/></wsdl:operation>
+    <wsdl:operation name="getStationMetadataMultiple"><wsdl:input message="tns:getStationMetadataMultiple"/><wsdl:output message="tns:getStationMetadataMultipleResponse"/></wsdl:operation>
+    <wsdl:operation name="getStations"><wsdl:input message="tns:getStations"/><wsdl:output message="tns:getStationsResponse"/></wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="AwdbWebServiceSoapBinding" type="tns:AwdbWebService">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="getData"><soap:operation soapAction=""/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>
+    <wsdl:operation name="getHourlyData"><soap:operation soapAction=""/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>
+    <wsdl:operation name="getStationMetadata"><soap:operation soapAction=""/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>
+    <wsdl:operation name="getStationMetadataMultiple"><soap:operation soapAction=""/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>
+    <wsdl:operation name="getStations"><soap:operation soapAction=""/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="AwdbWebService">
+    <wsdl:port name="AwdbWebServiceImplPort" binding="tns:AwdbWebServiceSoapBinding">
+      <soap:address location="https://wcc.sc.egov.usda.gov/awdbWebService/services"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+'''.format(ns=AWDB_NS)
+
+
+def station_number(triplet):
+    """ get the numeric station id from a triplet (used to seed fake data) """
+    return int(triplet.split(':')[0])
+
+
+def fake_value(triplet, element, stamp):
+    """ make up a plausible, repeatable value for a station/element/time """
+    seed = station_number(triplet) % 97
+    day_of_season = (stamp - datetime(stamp.year if stamp.month >= 10 else stamp.year - 1,
+                                      10, 1)).days
+    if element == 'TOBS':
+        return round(20 + 15 * ((stamp.hour - 12) / 12.0) - (seed % 10), 1)
+    base = max(day_of_season - 30, 0) * (0.4 if element == 'SNWD' else 0.12)
+    return round(base + seed / 10.0 + stamp.hour / 100.0, 1)
+
+
+def element_text(tag, value):
+    if value is None:
+        return '<{0} xsi:nil="true"/>'.format(tag)
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(value)))
+
+
+class FakeAWDBTransport(Transport):
+    """
+    zeep transport answering AWDB requests with synthetic data
+        latency --> seconds added to every request (simulated round trip)
+        station_count --> number of stations returned by getStations
+        missing_every --> every nth value is missing (None)
+    set fail_requests to make the next n requests fail with a connection
+    error (for testing retries), and fail_loads to do the same to the next n
+    WSDL loads (an unreachable service)
+    NOTE: the response size follows the requested stations and date range,
+          i.e. a 10 year getHourlyData request returns ~87k values
+    """
+    def __init__(self, latency=0.0, station_count=50, missing_every=0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.station_count = station_count
+        self.missing_every = missing_every
+        self.fail_requests = 0
+        self.fail_loads = 0
+        self.loads = 0
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def load(self, url):
+        with self._lock:
+            self.loads += 1
+            if self.fail_loads > 0:
+                self.fail_loads -= 1
+                raise requests.exceptions.ConnectionError('fake AWDB WSDL failure')
+        return AWDB_WSDL.encode('utf-8')
+
+    def post(self, address, message, headers):
+        body = etree.fromstring(message if isinstance(message, bytes) else message.encode('utf-8'))
+        request = body.find('{%s}Body' % SOAP_NS)[0]
+        operation = etree.QName(request).localname
+        arguments = {}
+        for child in request:
+            arguments.setdefault(etree.QName(child).localname, []).append(child.text)
+        with self._lock:
+            self.requests.append((operation, arguments))
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                raise requests.exceptions.ConnectionError('fake AWDB failure')
+        if self.latency:
+            time.sleep(self.latency)
+        content = getattr(self, 'respond_' + operation)(arguments)
+        return self.make_response(operation, content)
+
+    def make_response(self, operation, content):
+        envelope = ('<soap:Envelope xmlns:soap="{soap}" '
+                    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+                    '<soap:Body><ns2:{op}Response xmlns:ns2="{ns}">{content}'
+                    '</ns2:{op}Response></soap:Body></soap:Envelope>').format(
+                        soap=SOAP_NS, ns=AWDB_NS, op=operation, content=content)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/xml;charset=UTF-8'
+        response._content = envelope.encode('utf-8')
+        return response
+
+    def is_missing(self, index):
+        return self.missing_every and index % self.missing_every == 0
+
+    def respond_getData(self, arguments):
+        element = arguments['elementCd'][0]
+        begin = datetime.strptime(arguments['beginDate'][0][:10], '%Y-%m-%d')
+        end = datetime.strptime(arguments['endDate'][0][:10], '%Y-%m-%d')
+        days = [begin + timedelta(days=i) for i in range((end - begin).days + 1)]
+        records = []
+        for triplet in arguments['stationTriplets']:
+            values = ''.join(element_text('values', None if self.is_missing(i)
+                                          else fake_value(triplet, element, day))
+                             for i, day in enumerate(days))
+            records.append('<return><beginDate>{} 00:00:00</beginDate>'
+                           '<duration>DAILY</duration>'
+                           '<endDate>{} 00:00:00</endDate>'
+                           '<stationTriplet>{}</stationTriplet>{}</return>'.format(
+                               begin.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'),
+                               triplet, values))
+        return ''.join(records)
+
+    def respond_getHourlyData(self, arguments):
+        element = arguments['elementCd'][0]
+        begin = datetime.strptime(arguments['beginDate'][0][:10], '%Y-%m-%d')
+        end = datetime.strptime(arguments['endDate'][0][:10], '%Y-%m-%d')
+        begin += timedelta(hours=int(arguments.get('beginHour', [0])[0]))
+        end += timedelta(hours=int(arguments.get('endHour', [23])[0]))
+        hours = int((end - begin).total_seconds() // 3600) + 1
+        stamps = [begin + timedelta(hours=i) for i in range(max(hours, 0))]
+        records = []
+        for triplet in arguments['stationTriplets']:
+            values = ''.join('<values><dateTime>{}</dateTime><flag>V</flag>{}</values>'.format(
+                                 stamp.strftime('%Y-%m-%d %H:%M'),
+                                 '' if self.is_missing(i) else
+                                 element_text('value', fake_value(triplet, element, stamp)))
+                             for i, stamp in enumerate(stamps))
+            records.append('<return><beginDate>{}</beginDate><endDate>{}</endDate>'
+                           '<stationTriplet>{}</stationTriplet>{}</return>'.format(
+                               begin.strftime('%Y-%m-%d %H:%M'), end.strftime('%Y-%m-%d %H:%M'),
+                               triplet, values))
+        return ''.join(records)
+
+    def station_metadata(self, triplet):
+        number = station_number(triplet)
+        return ('<return><countyName>{county}</countyName><elevation>{elev}</elevation>'
+                '<latitude>{lat}</latitude><longitude>{lon}</longitude>'
+                '<name>Fake Site {number}</name><stationTriplet>{triplet}</stationTriplet>'
+                '</return>').format(county='Lincoln' if number % 2 else 'Flathead',
+                                    elev=4000 + (number * 37) % 4000,
+                                    lat=round(45.0 + (number % 300) / 100.0, 4),
+                                    lon=round(-116.0 + (number % 500) / 100.0, 4),
+                                    number=number, triplet=escape(triplet))
+
+    def respond_getStationMetadata(self, arguments):
+        return self.station_metadata(arguments['stationTriplet'][0])
+
+    def respond_getStationMetadataMultiple(self, arguments):
+        return ''.join(self.station_metadata(triplet) for triplet in arguments['stationTriplets'])
+
+    def respond_getStations(self, arguments):
+        state = (arguments.get('stateCds') or ['MT'])[0]
+        network = (arguments.get('networkCds') or ['SNTL'])[0]
+        return ''.join('<return>{}:{}:{}</return>'.format(1000 + i, state, network)
+                       for i in range(self.station_count))
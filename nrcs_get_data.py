@@ -8,11 +8,41 @@
 """
 
 
-import pandas as pd
-import plotly.graph_objs as go
-import plotly.offline as pyo
+import numpy as np
 from datetime import datetime, timedelta
-from nrcs_service import NRCSService
+from nrcs_service import get_service
+from nrcs_store import get_store, to_datetime, DAILY, HOURLY
+from nrcs_qc import qc_series
+
+
+def get_store_data(site_triplet, elements, duration, start_date, end_date, qc=False):
+    """
+    get a station's data from the local store, with the network only filling
+    in whatever isn't stored yet
+        qc --> run the hourly series through nrcs_qc.qc_series, which adds a
+               '<element>_flag' column per element
+        returns --> dataframe with a column per element and a date column
+    """
+    import pandas as pd
+    nrcs_service = get_service('test.log')
+    store = get_store()
+    store.sync(nrcs_service, site_triplet, elements, duration, start_date, end_date)
+    df = pd.DataFrame(columns=['date'])
+    columns = list(elements)
+    for element in elements:
+        timestamps, data = store.read_series(site_triplet, element, duration,
+                                             start_date, end_date)
+        if qc:
+            timestamps, data, flags = qc_series(np.array(timestamps, dtype='datetime64[ns]'),
+                                                np.array(data, dtype=np.float64), element)
+            series = pd.DataFrame({'date': timestamps, element: data,
+                                   element + '_flag': flags})
+            columns.append(element + '_flag')
+        else:
+            series = pd.DataFrame({'date': timestamps, element: data})
+        df = df.merge(series, on='date', how='outer')
+    df = df.sort_values(by='date', ascending=True).reset_index(drop=True)
+    return df[columns + ['date']]
 
 
 def get_yearly_snotel_data(year, site_triplet, elements):
@@ -21,25 +51,10 @@ def get_yearly_snotel_data(year, site_triplet, elements):
         NOTE: this takes the calendar year given in year plus
         the preceeding winter months from year-1
     """
-    # get a NRCS object
-    nrcs_service = NRCSService('test.log')
-
     # gets data from nov 15 to may 15 for winter 'year'
     start_date = datetime(year=int(year)-1, month=11, day=1)
     end_date = datetime(year=int(year), month=5, day=15)
-    raw_data = []
-    for element in elements:
-        request_data = {'stationTriplets': site_triplet, 'elementCd': element,
-                        'ordinal': '1', 'duration': 'DAILY',
-                        'getFlags': 'False',
-                        'beginDate': datetime.strftime(start_date, '%Y-%m-%d'),
-                        'endDate': datetime.strftime(end_date, '%Y-%m-%d'),
-                        'alwaysReturnDailyFeb29': 'false'}
-        datelist, data = nrcs_service.get_station_data(request_data)
-        raw_data.append(data)
-    df = pd.DataFrame(data=raw_data).transpose()
-    df.columns = elements
-    df['date'] = datelist
+    df = get_store_data(site_triplet, elements, DAILY, start_date, end_date)
     df['year'] = [value.year for value in df['date']]
     df['month'] = [value.month for value in df['date']]
     df['day'] = [value.day for value in df['date']]
@@ -48,60 +63,44 @@ def get_yearly_snotel_data(year, site_triplet, elements):
 
 def get_hourly_snotel_data(start_date, end_date, station_triplet, elements):
     """
-    get hourly snotel data from a site
+    get quality controlled hourly snotel data from a site
+        start_date, end_date --> date strings (i.e. '2019-12-19'), inclusive
+        returns --> dataframe with a value and a QC flag column per element
+                    (see nrcs_qc), one row per hour
     """
-    # get a NRCS object
-    nrcs_service = NRCSService('test.log')
-    raw_data = []
-    for element in elements:
-        request_data = {'stationTriplets': station_triplet, 'elementCd': element,
-                        'ordinal': '1', 'beginDate': start_date,
-                        'endDate': end_date}
-        timestamps, data = nrcs_service.get_station_hourly_data(request_data)
-        raw_data.append(data)        
-    df = pd.DataFrame(data=raw_data).transpose()
-    df.columns = elements
-    df['date'] = timestamps
-    return df
+    end_date = to_datetime(end_date) + timedelta(hours=23)
+    return get_store_data(station_triplet, elements, HOURLY,
+                          to_datetime(start_date), end_date, qc=True)
+
 
 def get_hourly_snotel_temps(start_date, end_date, station_triplet):
     """
     separate function for temperature data because it's weird
+    NOTE: duplicate readings are dropped, out of range values and spikes
+          removed and short gaps filled by the QC stage
     """
-    # get a NRCS object
-    nrcs_service = NRCSService('test.log')
-    request_data = {'stationTriplets': station_triplet, 'elementCd': 'TOBS',
-                    'ordinal': '1', 'beginDate': start_date,
-                    'endDate': end_date}
-    timestamps, data = nrcs_service.get_station_hourly_data(request_data)
-    df = pd.DataFrame(data=data).transpose()
-    df.columns = ['TOBS']
-    df['date'] = timestamps
-    df.drop_duplicates('date', keep='first', inplace=True)
-    df = df.sort_values(by='date', ascending=True)
-    return df
+    return get_hourly_snotel_data(start_date, end_date, station_triplet,
+                                  ['TOBS'])
 
 
 if __name__ == '__main__':
+    import plotly.graph_objs as go
+    import plotly.offline as pyo
+    from nrcs_seasons import load_seasons
+    from nrcs_downsample import downsample, plot_points
+
     site = '787:MT:SNTL'
-    year = '2019'
     years = list(range(2005, 2019))
+    seasons = load_seasons(site, years, ['SNWD', 'WTEQ'])
     data = []
-    for idx, year in enumerate(years):
-        elements = ['SNWD', 'WTEQ']
-        df = get_yearly_snotel_data(year, site, elements)
-        # drop leap year
-        try:
-            leap = df.loc[(df['month'] == 2) & (df['day'] == 29)]
-            df.drop(leap.index)
-        except:
-            print('could not drop leap year')
-        df['date'] = pd.to_datetime(df['date'])
-        data.append(go.Scatter(x=df.index, y=df['SNWD'],
-                               mode='lines', name=year, hovertext=df['date']))
-        df.to_csv(path_or_buf='data/snow_data_{}.csv'.format(year))
-    layout = go.Layout(title='Stahl Peak Yearly Snow Depth'.format(year),
-                       xaxis=dict(title='Season Date Index'),
+    for idx, year in enumerate(seasons.years):
+        data.append(go.Scatter(x=seasons.labels, y=seasons['SNWD'][idx],
+                               mode='lines', name=str(year)))
+    median = seasons.percentiles('SNWD', 50)
+    data.append(go.Scatter(x=seasons.labels, y=median, mode='lines',
+                           name='median', line=dict(color='black', width=4)))
+    layout = go.Layout(title='Stahl Peak Yearly Snow Depth',
+                       xaxis=dict(title='Season Date'),
                        yaxis=dict(title='Snow Depth (in)'),
                        hovermode='closest')
     figure = go.Figure(data=data, layout=layout)
@@ -111,7 +110,8 @@ if __name__ == '__main__':
     elements = ['SNWD', 'WTEQ']
     hourly = get_hourly_snotel_data('2019-12-19', '2019-12-21', '787:MT:SNTL',
                                     elements)
-    data = [go.Scatter(x=hourly['date'], y=hourly['SNWD'], mode='lines')]
+    dates, depth = downsample(hourly['date'].values, hourly['SNWD'], plot_points())
+    data = [go.Scatter(x=dates, y=depth, mode='lines')]
     layout = go.Layout(title='Hourly Snotel Data',
                        xaxis={'title': 'Time'},
                        yaxis={'title': 'Snow Depth (in)'})
@@ -120,7 +120,9 @@ if __name__ == '__main__':
     
     temperature = get_hourly_snotel_temps('2019-12-19', '2019-12-21',
                                           '787:MT:SNTL')
-    data = [go.Scatter(x=temperature['date'], y=temperature['TOBS'], mode='lines')]
+    dates, temps = downsample(temperature['date'].values, temperature['TOBS'],
+                              plot_points(), method='lttb')
+    data = [go.Scatter(x=dates, y=temps, mode='lines')]
     layout = go.Layout(title='Hourly Snotel Temperature',
                        xaxis={'title': 'Time'},
                        yaxis={'title': 'Temperature (F)'})
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+@brief rolling window of recent hourly observations
+@author: Graham Riches
+@date: Sun Oct 18 10:45:54 2026
+@description
+    Keeps the last day or so of hourly data for a set of stations in memory
+    and refreshes it with delta queries: only the hours after the last
+    observed timestamp are requested, so a refresh downloads one or two values
+    per series instead of every hour since midnight, and the latest values
+    carry over across day boundaries.
+"""
+
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+
+from nrcs_service import empty_arrays
+
+
+HOURLY_WINDOW = timedelta(hours=24)
+HOUR = timedelta(hours=1)
+
+
+class HourlyWindow:
+    """ class to hold a rolling window of hourly series """
+    def __init__(self, window=HOURLY_WINDOW):
+        """
+        create an empty window
+            window --> how far back observations are kept, this is also how far
+                       back the first refresh (or a stale station) looks
+        """
+        self._window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def series(self, triplet, element):
+        """ get the (datetime64 array, float64 array) window for a series """
+        with self._lock:
+            return self._series.get((triplet, element), empty_arrays())
+
+    def last_observed(self, triplet, element):
+        """ get the datetime of the newest observation, None if there are none """
+        timestamps, values = self.series(triplet, element)
+        if not len(timestamps):
+            return None
+        return timestamps[-1].astype('datetime64[us]').astype(datetime)
+
+    def latest(self, triplet, element):
+        """ get the newest observed value, None if there are none """
+        timestamps, values = self.series(triplet, element)
+        return float(values[-1]) if len(values) else None
+
+    def request_begin(self, triplets, elements, now):
+        """
+        get the first hour a delta query has to ask for
+        NOTE: clamped to the window so one station that stopped reporting
+              doesn't drag every refresh back to its last observation
+        """
+        oldest = now - self._window
+        begins = []
+        for triplet in triplets:
+            for element in elements:
+                last = self.last_observed(triplet, element)
+                begins.append(oldest if last is None else max(last + HOUR, oldest))
+        return min(begins)
+
+    def append(self, triplet, element, timestamps, values, now):
+        """
+        add newly fetched observations to a series and drop expired ones
+            timestamps --> datetime64[ns] array
+            values --> float64 array, NaN values (not reported yet) are skipped
+            now --> datetime the window ends at
+        """
+        keep = ~np.isnan(values) & ~np.isnat(timestamps)
+        with self._lock:
+            old_timestamps, old_values = self._series.get((triplet, element),
+                                                          empty_arrays())
+            if len(old_timestamps):
+                keep &= timestamps > old_timestamps[-1]
+            timestamps = np.concatenate([old_timestamps, timestamps[keep]])
+            values = np.concatenate([old_values, values[keep]])
+            recent = timestamps >= np.datetime64(now - self._window, 'ns')
+            self._series[(triplet, element)] = (timestamps[recent], values[recent])
+
+    def refresh(self, service, triplets, elements, now=None):
+        """
+        fetch the hours each series is missing
+            service --> NRCSService object
+            triplets --> list of station triplets
+            elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+            now --> datetime to refresh up to, defaults to the current hour
+            returns --> True if the window is up to date, False if the query
+                        failed (the previous observations are kept)
+        """
+        now = datetime.now() if now is None else now
+        now = now.replace(minute=0, second=0, microsecond=0)
+        begin = self.request_begin(triplets, elements, now)
+        if begin > now:
+            return True  # already have the current hour for everything
+        request_data = {'ordinal': '1',
+                        'beginDate': begin.strftime('%Y-%m-%d'),
+                        'endDate': now.strftime('%Y-%m-%d'),
+                        'beginHour': begin.hour, 'endHour': now.hour}
+        hourly_data = service.get_batch_station_hourly_data(triplets, elements,
+                                                            request_data, 'arrays')
+        if hourly_data is None:
+            return False
+        for (triplet, element), (timestamps, values) in hourly_data.items():
+            self.append(triplet, element, timestamps, values, now)
+        return True
@@ -4,11 +4,44 @@
 @author: Graham Riches
 @date: Sun Dec  8 09:25:21 2019
 @description functions to attach new logging handlers
+
+    By default records are handed to a queue and written (formatted, to
+    rotating log files and the console) by one background thread, so logging
+    from a Dash callback never waits on disk. Set POW_LOG_ASYNC=0 (or call
+    configure) to write synchronously, and POW_LOG_JSON=1 for one JSON object
+    per line, including any extra fields such as per-call timings.
 """
 
+import os
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
 from datetime import datetime
 
+from process_singleton import per_process
+
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+# at most EXCEPTION_BURST of the same exception per EXCEPTION_PERIOD seconds
+EXCEPTION_BURST = 5
+EXCEPTION_PERIOD = 60.0
+
+# attributes every LogRecord has, anything else came in through extra=
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_async = os.environ.get('POW_LOG_ASYNC', '1') != '0'
+_json = os.environ.get('POW_LOG_JSON', '0') == '1'
+TRACEBACK_FORMATTER = logging.Formatter()
+_file_handlers = {}
+_root_attached = False
+_lock = threading.Lock()
+
 
 class AppLogger:
     """ parent class to manage logging from multiple classes """
@@ -17,12 +50,10 @@ class AppLogger:
         self.print_log_header()
         self._logger = logging.getLogger()
         self._logger.setLevel(logging.INFO)
-        self._fh = logging.FileHandler(_logpath)
-        self._fh.setLevel(logging.INFO)
-        self._sh = logging.StreamHandler(logging.INFO)
 
     def print_log_header(self):
-        with open(self._logpath, 'w') as logfile:
+        """ add a header for this run (the existing log is kept) """
+        with open(self._logpath, 'a') as logfile:
             block = '*******************************************************************\n'
             desc = '                POW TRACKER LOG\n'
             date = 'Date: {}\n'.format(datetime.now())
@@ -34,17 +65,208 @@ class AppLogger:
             logfile.writelines(block)
 
 
+class JsonFormatter(logging.Formatter):
+    """ format records as one JSON object per line """
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'name': record.name.strip(),
+                 'level': record.levelname, 'message': record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items()
+                      if key not in RECORD_FIELDS and key != 'logfile'})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text  # rendered before it was queued
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    drop repeats of the same exception beyond a burst per period
+    NOTE: the next record let through says how many were dropped
+    """
+    def __init__(self, burst=EXCEPTION_BURST, period=EXCEPTION_PERIOD):
+        super().__init__()
+        self._burst = burst
+        self._period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not record.exc_info:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.exc_info[0])
+        now = time.monotonic()
+        with self._lock:
+            started, count, dropped = self._windows.get(key, (now, 0, 0))
+            if now - started >= self._period:
+                started, count = now, 0
+            if count >= self._burst:
+                self._windows[key] = (started, count, dropped + 1)
+                return False
+            self._windows[key] = (started, count + 1, 0)
+        if dropped:
+            record.msg = '{} ({} similar exceptions suppressed)'.format(record.msg, dropped)
+        return True
+
+
+class LogfileFilter(logging.Filter):
+    """ tag records with the file they're going to """
+    def __init__(self, logfile):
+        super().__init__()
+        self._logfile = logfile
+
+    def filter(self, record):
+        record.logfile = self._logfile
+        return True
+
+
+class LogfileRouter(logging.Handler):
+    """ hand queued records to the file handler they were tagged with """
+    def emit(self, record):
+        handler = _file_handlers.get(getattr(record, 'logfile', None))
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    queue handler that leaves the formatting to the writer thread
+    NOTE: tracebacks are the exception, they're rendered by the thread that
+          logged them. The traceback holds that thread's frames, and
+          formatting it in the writer thread races with other threads
+          parsing source (python 3.11 parses each line to place the ^^^
+          markers, and that parser isn't thread safe)
+    """
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        get_queue().put_nowait(record)  # restarts the writer after a fork
+
+
+def create_formatter():
+    return JsonFormatter() if _json else logging.Formatter(LOG_FORMAT)
+
+
+def configure(async_mode=None, json_format=None):
+    """
+    set the logging mode for loggers attached from now on
+        async_mode --> write from a background thread
+        json_format --> write JSON records instead of text
+    """
+    global _async, _json
+    if async_mode is not None:
+        _async = async_mode
+    if json_format is not None:
+        _json = json_format
+
+
+def file_handler(_logfile, _log_level):
+    """ get the rotating handler for a log file (one per file, shared) """
+    with _lock:
+        handler = _file_handlers.get(_logfile)
+        if handler is None:
+            handler = logging.handlers.RotatingFileHandler(
+                _logfile, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, delay=True)
+            handler.setFormatter(create_formatter())
+            _file_handlers[_logfile] = handler
+        handler.setLevel(min(handler.level or _log_level, _log_level))
+        return handler
+
+
+@per_process
+def get_writer():
+    """
+    get the log queue and its writer thread, starting them on first use
+        returns --> (queue, listener)
+    NOTE: a forked process gets its own queue and writer thread
+    """
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(create_formatter())
+    listener = logging.handlers.QueueListener(log_queue, LogfileRouter(), console,
+                                              respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def get_queue():
+    """ get the log queue, starting the writer thread on first use """
+    return get_writer()[0]
+
+
+def stop_logging():
+    """ write out any queued records and stop the writer thread """
+    writer = get_writer.reset()
+    if writer is not None:
+        writer[1].stop()
+
+
+atexit.register(stop_logging)
+
+
+def create_handlers(_logfile, _log_level):
+    """
+    get the handlers writing a logger's records to a log file and the console
+        returns --> list of handlers, a single queue handler when logging is
+                    asynchronous
+    """
+    if _async:
+        handler = LogQueueHandler(get_queue())
+        handler.addFilter(LogfileFilter(_logfile))
+        handler.setLevel(_log_level)
+        file_handler(_logfile, _log_level)
+        return [handler]
+    console = logging.StreamHandler()
+    console.setFormatter(create_formatter())
+    console.setLevel(_log_level)
+    return [console, file_handler(_logfile, _log_level)]
+
+
 def attach_logger(_logfile, _handler, _log_level):
+    """
+    get a logger that writes to a log file and the console
+        _logfile --> log file path (rotated at LOG_MAX_BYTES)
+        _handler --> logger name
+        _log_level --> minimum level logged
+    NOTE: a logger is only set up once, later calls just return it. Its
+          records don't also go to the root logger (see attach_root_logger),
+          which would write them twice.
+    """
     logger = logging.getLogger(_handler)
     logger.setLevel(_log_level)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh = logging.FileHandler(_logfile)
-    fh.setLevel(_log_level)
-    sh = logging.StreamHandler()
-    sh.setLevel(_log_level)
-    sh.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    if not (len(logger.handlers)):
-        logger.addHandler(sh)
-        logger.addHandler(fh)
+    if logger.handlers:
+        return logger
+    logger.propagate = False
+    logger.addFilter(RateLimitFilter())
+    for handler in create_handlers(_logfile, _log_level):
+        logger.addHandler(handler)
     return logger
+
+
+def attach_root_logger(_logfile, _log_level=logging.INFO):
+    """
+    send the root logger (logging.exception(...) and any module logger
+    without its own handlers) through the same rate limit and writer thread
+        _logfile --> log file path (rotated at LOG_MAX_BYTES)
+        _log_level --> minimum level logged
+    NOTE: the rate limit sits on the handlers, since logger filters don't
+          see records propagated up from child loggers
+    """
+    global _root_attached
+    root = logging.getLogger()
+    with _lock:
+        if _root_attached:
+            return root
+        _root_attached = True
+    root.setLevel(_log_level)
+    for handler in create_handlers(_logfile, _log_level):
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+    return root
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+@brief sensor quality control and gap filling for station series
+@author: Graham Riches
+@date: Sun Oct 18 11:05:10 2026
+@description
+    Cleans a decoded series in a few vectorized passes: sort and drop
+    duplicate timestamps, put the values on a regular grid, reject values
+    outside the element's physical range, despike against a rolling median,
+    reject changes faster than the element can change, then linearly fill
+    short gaps. Every sample gets a flag (bits below, 0 is a good reading) so
+    plots and statistics can tell measured, rejected and filled values apart.
+    The raw values stay in the store, so the limits can be tuned without
+    refetching.
+"""
+
+import warnings
+import numpy as np
+
+
+QC_RANGE = 1  # outside the element's physical limits
+QC_RATE = 2  # changed faster than the element can
+QC_SPIKE = 4  # too far from the rolling median
+QC_MISSING = 8  # not reported (or rejected) and not filled
+QC_FILLED = 16  # interpolated across a short gap
+QC_REJECTED = QC_RANGE | QC_RATE | QC_SPIKE
+
+# (min, max, max change per hour, max distance from the rolling median)
+QC_LIMITS = {'SNWD': (0.0, 400.0, 10.0, 6.0),  # in
+             'WTEQ': (0.0, 200.0, 2.0, 1.0),  # in
+             'PREC': (0.0, 300.0, 2.0, 1.0),  # in
+             'TOBS': (-60.0, 120.0, 20.0, 15.0)}  # deg F
+MEDIAN_WINDOW = 5  # samples, centered
+MAX_GAP = 6  # samples, longer gaps are left missing
+HOUR = np.timedelta64(1, 'h')
+
+
+def dedup_sorted(timestamps, values):
+    """
+    sort a series and drop duplicate timestamps
+        returns --> (timestamps, values), NaT timestamps are dropped and a
+                    reported value wins over a missing one for the same time
+    """
+    keep = ~np.isnat(timestamps)
+    timestamps, values = timestamps[keep], values[keep]
+    order = np.lexsort((~np.isnan(values), timestamps))  # missing sorts first
+    timestamps, values = timestamps[order], values[order]
+    last = np.ones(len(timestamps), dtype=bool)
+    last[:-1] = timestamps[1:] != timestamps[:-1]
+    return timestamps[last], values[last]
+
+
+def to_grid(timestamps, values, step):
+    """
+    put a sorted series on a regular grid
+        step --> grid spacing (timedelta64)
+        returns --> (grid timestamps, values with NaN where nothing was reported)
+    """
+    if not len(timestamps):
+        return timestamps, values
+    positions = np.round((timestamps - timestamps[0]) / step).astype(np.int64)
+    grid = timestamps[0] + np.arange(positions[-1] + 1) * step
+    gridded = np.full(len(grid), np.nan)
+    gridded[positions] = values  # rounding collisions keep the later value
+    return grid, gridded
+
+
+def rolling_median(values, window=MEDIAN_WINDOW):
+    """ centered rolling median ignoring NaN (NaN where a window is all NaN) """
+    if len(values) < window:
+        return values.copy()
+    half = window // 2
+    padded = np.pad(values, half, constant_values=np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all NaN windows
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+        return np.nanmedian(windows, axis=1)
+
+
+def fill_gaps(values, max_gap=MAX_GAP):
+    """
+    linearly interpolate NaN runs of up to max_gap samples
+        returns --> (filled values, boolean array of the filled samples)
+    NOTE: gaps at either end are never filled, there's nothing to
+          interpolate towards
+    """
+    missing = np.isnan(values)
+    index = np.arange(len(values))
+    if missing.all() or not missing.any():
+        return values, np.zeros(len(values), dtype=bool)
+    previous = np.maximum.accumulate(np.where(missing, -1, index))
+    following = np.minimum.accumulate(np.where(missing, len(values), index)[::-1])[::-1]
+    fill = (missing & (previous >= 0) & (following < len(values))
+            & (following - previous - 1 <= max_gap))
+    filled = values.copy()
+    filled[fill] = np.interp(index[fill], index[~missing], values[~missing])
+    return filled, fill
+
+
+def qc_series(timestamps, values, element, step=HOUR, window=MEDIAN_WINDOW,
+              max_gap=MAX_GAP):
+    """
+    quality control a decoded series
+        timestamps --> datetime64 array (NaT allowed)
+        values --> float64 array (NaN for missing values)
+        element --> element code for the QC_LIMITS (i.e. 'SNWD'), unknown
+                    elements are only deduplicated, gridded and gap filled
+        step --> grid spacing of the series
+        window --> rolling median window in samples
+        max_gap --> longest gap (in samples) that is interpolated
+        returns --> (grid timestamps, cleaned values, uint8 flags)
+    """
+    timestamps, values = dedup_sorted(np.asarray(timestamps, dtype='datetime64[ns]'),
+                                      np.asarray(values, dtype=np.float64))
+    timestamps, values = to_grid(timestamps, values, step)
+    flags = np.zeros(len(values), dtype=np.uint8)
+    if element in QC_LIMITS and len(values):
+        low, high, rate, spike = QC_LIMITS[element]
+        flags[(values < low) | (values > high)] |= QC_RANGE
+        values = np.where(flags > 0, np.nan, values)
+        flags[np.abs(values - rolling_median(values, window)) > spike] |= QC_SPIKE
+        values = np.where(flags > 0, np.nan, values)
+        # after despiking, so a one sample spike doesn't also flag its neighbour
+        valid = np.flatnonzero(~np.isnan(values))
+        hours = np.diff(timestamps[valid]) / HOUR
+        jumps = np.abs(np.diff(values[valid])) > rate * hours
+        flags[valid[1:][jumps]] |= QC_RATE
+        values = np.where(flags > 0, np.nan, values)
+    values, filled = fill_gaps(values, max_gap)
+    flags[filled] |= QC_FILLED
+    flags[np.isnan(values)] |= QC_MISSING
+    return timestamps, values, flags
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+@brief columnar snapshots of current conditions for a whole region
+@author: Graham Riches
+@date: Sun Oct 18 10:57:34 2026
+@description
+    Builds one frame per refresh with a column (numpy array) per field for
+    every station in a region, and serves it to the dashboard as a map figure
+    (built once per snapshot) and as a table that is filtered, sorted and
+    paged on the server, so a client only ever receives one page of rows no
+    matter how many stations are covered.
+"""
+
+import re
+import numpy as np
+import plotly.graph_objects as go
+
+from nrcs_climatology import read_climatology
+
+
+REGION_ELEMENTS = ['SNWD', 'WTEQ', 'TOBS']
+REGION_COLUMNS = ['triplet', 'name', 'state', 'elevation', 'latitude', 'longitude',
+                  'depth', 'swe', 'temp', 'swe_pct', 'observed']
+NUMERIC_COLUMNS = ['elevation', 'latitude', 'longitude', 'depth', 'swe', 'temp', 'swe_pct']
+# plotly 6 replaced the mapbox traces with the (token free) maplibre ones
+MAP_TRACE, MAP_LAYOUT = (('scattermap', 'map') if hasattr(go, 'Scattermap')
+                         else ('scattermapbox', 'mapbox'))
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'],
+                    ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+
+def region_stations(catalog, service, states, networks):
+    """
+    get the metadata of every station in a region
+        catalog --> StationCatalog object
+        states, networks --> lists of state and network codes
+        returns --> list of metadata dicts sorted by triplet
+    NOTE: each state's station list is fetched from NRCS once per catalog
+          ttl (see StationCatalog.sync_state), otherwise the catalog answers
+          locally. Stations the catalog already had for other reasons (i.e.
+          the summary sites) don't count as a synced state.
+    """
+    stations = []
+    for state in states:
+        for network in networks:
+            catalog.sync_state(service, state, network)
+            stations.extend(catalog.search(state=state, network=network))
+    return sorted(stations, key=lambda meta: meta['stationTriplet'])
+
+
+def build_region_frame(stations, hourly_window, now):
+    """
+    build the columnar current conditions frame for a region
+        stations --> list of station metadata dicts
+        hourly_window --> refreshed HourlyWindow covering the stations
+        now --> datetime of the refresh (for percent of median)
+        returns --> dataframe with REGION_COLUMNS, NaN for missing values
+    """
+    import pandas as pd
+
+    def latest(triplet, element):
+        value = hourly_window.latest(triplet, element)
+        return np.nan if value is None else value
+
+    triplets = [meta['stationTriplet'] for meta in stations]
+    df = pd.DataFrame({
+        'triplet': triplets,
+        'name': [meta['name'] or meta['stationTriplet'] for meta in stations],
+        'state': [triplet.split(':')[1] for triplet in triplets],
+        'elevation': np.array([meta['elevation'] for meta in stations], dtype=np.float64),
+        'latitude': np.array([meta['latitude'] for meta in stations], dtype=np.float64),
+        'longitude': np.array([meta['longitude'] for meta in stations], dtype=np.float64),
+        'depth': np.array([latest(triplet, 'SNWD') for triplet in triplets]),
+        'swe': np.array([latest(triplet, 'WTEQ') for triplet in triplets]),
+        'temp': np.array([latest(triplet, 'TOBS') for triplet in triplets]),
+    })
+    swe_pct = np.full(len(df), np.nan)
+    for idx, (triplet, swe) in enumerate(zip(triplets, df['swe'].values)):
+        climatology = read_climatology(triplet)
+        if climatology is None or np.isnan(swe):
+            continue
+        percent = climatology.percent_of_median('WTEQ', swe, now)
+        swe_pct[idx] = np.nan if percent is None else round(percent)
+    df['swe_pct'] = swe_pct
+    observed = [hourly_window.last_observed(triplet, 'SNWD') for triplet in triplets]
+    df['observed'] = [None if stamp is None else stamp.strftime('%Y-%m-%d %H:%M')
+                      for stamp in observed]
+    return df[REGION_COLUMNS]
+
+
+def build_region_map(df, query_info):
+    """ build the station map figure for a region snapshot """
+    depth = df['depth'].to_numpy(dtype=np.float64)
+    hover = ['{}<br>{:.0f} ft<br>depth {} in, SWE {} in'.format(
+                 name, elevation, 'NA' if np.isnan(d) else d, 'NA' if np.isnan(s) else s)
+             for name, elevation, d, s in zip(df['name'], df['elevation'].fillna(0),
+                                              depth, df['swe'].to_numpy(dtype=np.float64))]
+    center = dict(lat=float(df['latitude'].mean()), lon=float(df['longitude'].mean())) \
+        if len(df) else dict(lat=47.0, lon=-110.0)
+    return {'data': [dict(type=MAP_TRACE,
+                          lat=df['latitude'].tolist(), lon=df['longitude'].tolist(),
+                          mode='markers', text=hover, hoverinfo='text',
+                          marker=dict(size=9, color=np.nan_to_num(depth).tolist(),
+                                      colorscale='Blues', showscale=True,
+                                      colorbar=dict(title=dict(text='Depth (in)'))))],
+            'layout': {'height': 500,
+                       'title': 'Snow Depth - {}'.format(query_info['date']),
+                       MAP_LAYOUT: dict(style='open-street-map', center=center, zoom=5),
+                       'margin': dict(left=20, right=20, top=60, bottom=20),
+                       'paper_bgcolor': 'rgba(9, 99, 159, 0.5)',
+                       'font': dict(color='white', size=18),
+                       'uirevision': 'region'},  # keep the map view across updates
+            }
+
+
+def split_filter_part(filter_part):
+    """
+    split one clause of a DataTable filter_query
+        returns --> (column, operator, value), or [None] * 3 if not understood
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1:name_part.rfind('}')]
+                value_part = value_part.strip()
+                if value_part and value_part[0] == value_part[-1] and value_part[0] in '\'"`':
+                    value = re.sub(r'\\(.)', r'\1', value_part[1:-1])
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+
+def filter_frame(df, filter_query):
+    """ apply a DataTable filter_query (clauses joined with &&) to a frame """
+    if not filter_query:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for filter_part in filter_query.split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df:
+            continue
+        series = df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if column in NUMERIC_COLUMNS:
+                if not isinstance(value, float):
+                    continue
+            else:  # text columns compare as text, like the DataTable does
+                series = series.astype(str)
+                value = value if isinstance(value, str) else '{:g}'.format(value)
+            mask &= getattr(series, operator)(value).to_numpy()
+        elif operator == 'contains':
+            mask &= series.astype(str).str.contains(str(value), case=False,
+                                                    regex=False).to_numpy()
+        elif operator == 'datestartswith':
+            mask &= series.astype(str).str.startswith(str(value)).to_numpy()
+    return df[mask]
+
+
+def query_page(df, page_current=0, page_size=25, sort_by=None, filter_query=''):
+    """
+    filter, sort and page a snapshot frame for a DataTable
+        page_current, page_size --> page to return
+        sort_by --> DataTable sort_by list of {'column_id', 'direction'}
+        filter_query --> DataTable filter_query string
+        returns --> (list of row dicts for the page, number of pages)
+    """
+    df = filter_frame(df, filter_query)
+    if sort_by:
+        df = df.sort_values([column['column_id'] for column in sort_by],
+                            ascending=[column['direction'] == 'asc' for column in sort_by],
+                            na_position='last', kind='mergesort')
+    page_count = max(int(np.ceil(len(df) / page_size)), 1)
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    return page.replace({np.nan: None}).to_dict('records'), page_count
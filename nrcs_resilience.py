@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+@brief retry and circuit breaker policies for web service calls
+@author: Graham Riches
+@date: Sun Oct 18 10:42:38 2026
+@description
+    Bounded exponential backoff retries for idempotent queries and a circuit
+    breaker that fails fast while the upstream service is degraded, so a
+    struggling NRCS endpoint can't stall the refresh indefinitely.
+"""
+
+import time
+import random
+import threading
+
+
+class CircuitOpenError(Exception):
+    """ raised when a call is refused because the circuit is open """
+    pass
+
+
+class ConnectError(Exception):
+    """ raised when the SOAP client can't be set up (i.e. the WSDL fetch failed) """
+    pass
+
+
+def is_retryable(caught_exception):
+    """
+    check if an exception is worth retrying
+    NOTE: connection problems (including a failed connect), timeouts and 5xx
+          responses are retried, SOAP faults and 4xx responses mean the
+          request itself is bad
+    """
+    if isinstance(caught_exception, ConnectError):
+        return True
+    import requests  # already loaded by the time anything has failed
+    from zeep.exceptions import TransportError
+    if isinstance(caught_exception, (requests.exceptions.ConnectionError,
+                                     requests.exceptions.Timeout)):
+        return True
+    if isinstance(caught_exception, TransportError):
+        return caught_exception.status_code is None or caught_exception.status_code >= 500
+    return False
+
+
+class RetryPolicy:
+    """ bounded exponential backoff with jitter """
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=8.0):
+        """
+        create a policy
+            attempts --> total tries per call (1 means no retries)
+            base_delay --> delay before the first retry in seconds
+            max_delay --> cap on any single delay in seconds
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """ get the delay after a failed attempt (0 based), with jitter """
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+
+class CircuitBreaker:
+    """
+    circuit breaker for an upstream service
+        closed --> calls go through, consecutive failures are counted
+        open --> calls are refused until reset_timeout has passed
+        half open --> one trial call is let through, success closes the
+                      circuit and failure opens it again
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        """
+        create a breaker
+            failure_threshold --> consecutive failures before opening
+            reset_timeout --> seconds to stay open before a trial call
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened < self._reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """ check if a call may go through right now """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial_running = False
+
+    def release(self):
+        """ end a call that says nothing about the upstream (i.e. a bad request) """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened is not None or self._failures >= self._failure_threshold:
+                self._opened = time.monotonic()
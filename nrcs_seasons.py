@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@brief multi-season SNOTEL datasets
+@author: Graham Riches
+@date: Sun Oct 18 10:35:49 2026
+@description
+    Loads daily station data for many winters into one aligned structure: a
+    season x day-of-season float32 array per element. Every season runs from
+    Nov 1 to May 15 with Feb 29 dropped, so the same column is the same
+    calendar day in every season. Loaded seasons are memoized on disk so
+    comparing seasons doesn't mean re-reading (or re-downloading) each one.
+"""
+
+import os
+import numpy as np
+from datetime import datetime
+
+from nrcs_get_data import get_yearly_snotel_data
+
+
+SEASON_DAYS = 196  # Nov 1 -> May 15, without Feb 29
+
+
+def season_dates(year):
+    """
+    get the dates of a season as a datetime64[D] array
+        year --> the calendar year the season ends in (i.e. 2019 for 18/19)
+    """
+    import pandas as pd
+    dates = np.arange(np.datetime64('{}-11-01'.format(int(year) - 1)),
+                      np.datetime64('{}-05-16'.format(int(year))),
+                      dtype='datetime64[D]')
+    return dates[pd.DatetimeIndex(dates).strftime('%m-%d') != '02-29']
+
+
+def season_complete(year, today=None):
+    """ check if a season is over (i.e. its data won't change anymore) """
+    today = datetime.now() if today is None else today
+    return today > datetime(int(year), 5, 15)
+
+
+class SeasonData:
+    """ aligned season x day-of-season arrays for a station """
+    def __init__(self, site_triplet, years, elements):
+        """
+        create a dataset
+            site_triplet --> station triplet
+            years --> array of season years, one per row
+            elements --> dict of element code: (seasons x SEASON_DAYS) array
+        """
+        import pandas as pd
+        self.site_triplet = site_triplet
+        self.years = np.asarray(years, dtype=np.int32)
+        self.elements = elements
+        self.labels = pd.DatetimeIndex(season_dates(2019)).strftime('%b %d')
+
+    def __getitem__(self, element):
+        return self.elements[element]
+
+    def season(self, year):
+        """ get the row index of a season """
+        return int(np.flatnonzero(self.years == int(year))[0])
+
+    def percentiles(self, element, q):
+        """
+        get day-of-season percentiles across every season, ignoring gaps
+            q --> percentile or list of percentiles (0-100)
+        """
+        return np.nanpercentile(self.elements[element], q, axis=0)
+
+    def to_frame(self):
+        """ get the data as a dataframe with a (year, day) MultiIndex """
+        import pandas as pd
+        index = pd.MultiIndex.from_product([self.years, np.arange(SEASON_DAYS)],
+                                           names=['year', 'day'])
+        return pd.DataFrame({element: data.ravel() for element, data
+                             in self.elements.items()}, index=index)
+
+
+def load_season(year, site_triplet, elements):
+    """
+    load a single season as a dict of element: float32 array
+    NOTE: Feb 29 is dropped and any missing days are filled with NaN
+    """
+    import pandas as pd
+    df = get_yearly_snotel_data(year, site_triplet, elements)
+    df.index = pd.DatetimeIndex(df['date']).values.astype('datetime64[D]')
+    df = df[~df.index.duplicated()].reindex(season_dates(year))
+    return {element: df[element].to_numpy(dtype=np.float32, na_value=np.nan)
+            for element in elements}
+
+
+def cache_path(site_triplet, cache_dir):
+    return os.path.join(cache_dir, 'seasons_{}.npz'.format(site_triplet.replace(':', '_')))
+
+
+def read_cache(path):
+    """ read memoized seasons as a dict of year: {element: array} """
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as cached:
+        years = cached['years']
+        elements = [key for key in cached.files if key != 'years']
+        return {int(year): {element: cached[element][idx] for element in elements}
+                for idx, year in enumerate(years)}
+
+
+def write_cache(path, seasons):
+    """ memoize complete seasons with every element they share """
+    years = sorted(year for year in seasons if season_complete(year))
+    if not years:
+        return
+    elements = set.intersection(*[set(seasons[year]) for year in years])
+    arrays = {element: np.stack([seasons[year][element] for year in years])
+              for element in elements}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, years=np.asarray(years), **arrays)
+
+
+def load_seasons(site_triplet, years, elements, cache_dir='cache'):
+    """
+    load many seasons of daily data into one aligned dataset
+        site_triplet --> station triplet
+        years --> list of season years (i.e. range(2005, 2019))
+        elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+        cache_dir --> directory for the memoized seasons
+        returns --> SeasonData object
+    NOTE: only seasons that are over get memoized, the current season is
+          always loaded (which is cheap since the store syncs incrementally)
+    """
+    path = cache_path(site_triplet, cache_dir)
+    seasons = read_cache(path)
+    updated = False
+    for year in years:
+        cached = seasons.get(int(year), {})
+        if not all(element in cached for element in elements):
+            seasons[int(year)] = dict(cached, **load_season(year, site_triplet, elements))
+            updated = True
+    if updated:
+        write_cache(path, seasons)
+    years = [int(year) for year in years]
+    arrays = {element: np.stack([seasons[year][element] for year in years])
+              for element in elements}
+    return SeasonData(site_triplet, years, arrays)
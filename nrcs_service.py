@@ -13,75 +13,414 @@
           functionality exists
 """
 
-from zeep import Client
-from zeep.transports import Transport
-from requests import Session
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import threading
 import time
-import urllib3
 import logging
+import numpy as np
 
+import app_metrics
+from nrcs_resilience import (RetryPolicy, CircuitBreaker, CircuitOpenError, ConnectError,
+                             is_retryable)
 from nrcs_logging_utilities import attach_logger, AppLogger
+from process_singleton import per_process
 
-# disable the annoying messages
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# NOTE: zeep, requests and pandas are slow to import and only needed once a
+#       query is made (or a frame is decoded), so they're imported on first use
+
+# the AWDB WSDL practically never changes, so keep parsed copies for a day
+WSDL_CACHE_TTL = 86400
+# number of recent query results kept to serve while NRCS is down
+LAST_GOOD_SIZE = 64
+
+NRCS_REQUEST_SECONDS = app_metrics.histogram('nrcs_request_seconds',
+                                             'AWDB SOAP request latency by operation')
+NRCS_METHOD_SECONDS = app_metrics.histogram('nrcs_method_seconds',
+                                            'NRCSService method latency (request + decode)')
+NRCS_WSDL_SECONDS = app_metrics.histogram('nrcs_wsdl_seconds',
+                                          'WSDL/schema document load time (cache or network)')
+NRCS_BYTES = app_metrics.counter('nrcs_response_bytes_total',
+                                 'bytes received from AWDB by kind (wsdl, data)')
+NRCS_ERRORS = app_metrics.counter('nrcs_errors_total',
+                                  'failed AWDB SOAP requests by operation')
+
+_metered_transport = None
+
+
+def decode_daily_data(station_data):
+    """
+    decode a single getData record into python lists
+        station_data --> one data record from a getData response
+        returns --> list of dates, and list of float values
+    """
+    start_date = datetime.strptime(station_data['beginDate'], '%Y-%m-%d %H:%M:%S')
+    end_date = datetime.strptime(station_data['endDate'], '%Y-%m-%d %H:%M:%S')
+    date_delta = end_date - start_date
+    date_list = []
+    for i in range(date_delta.days + 1):
+        date_list.append(start_date + timedelta(days=i))
+    data = station_data['values']
+    requested_data = []
+    for value in data:
+        if value is None:
+            requested_data.append(None)
+        else:
+            requested_data.append(float(value))
+    return date_list, requested_data
+
+
+def decode_hourly_data(station_data):
+    """
+    decode a single getHourlyData record into python lists
+        station_data --> one hourlyData record from a getHourlyData response
+        returns --> list of datetime timestamps, and list of float values
+    """
+    data = station_data['values']
+    timestamps = []
+    requested_data = []
+    for item in data:
+        if item['dateTime'] is None:
+            timestamps.append(None)
+        else:
+            timestamps.append(datetime.strptime(item['dateTime'], '%Y-%m-%d %H:%M'))
+        if item['value'] is None:
+            requested_data.append(None)
+        else:
+            requested_data.append(float(item['value']))
+    return timestamps, requested_data
+
+
+def decode_values(values):
+    """ convert a list of NRCS values to a float64 array (NaN if missing) """
+    values = np.array(values, dtype=object)
+    values[np.equal(values, None)] = np.nan
+    return values.astype(np.float64)
+
+
+def decode_daily_arrays(station_data):
+    """
+    vectorized version of decode_daily_data
+        station_data --> one data record from a getData response
+        returns --> datetime64[D] array of dates, and float64 array of values
+    """
+    start_date = np.datetime64(station_data['beginDate'][:10], 'D')
+    end_date = np.datetime64(station_data['endDate'][:10], 'D')
+    date_array = np.arange(start_date, end_date + 1, dtype='datetime64[D]')
+    return date_array, decode_values(station_data['values'])
+
+
+def decode_hourly_arrays(station_data):
+    """
+    vectorized version of decode_hourly_data
+        station_data --> one hourlyData record from a getHourlyData response
+        returns --> datetime64[ns] array of timestamps (NaT if missing), and
+                    float64 array of values (NaN if missing)
+    """
+    import pandas as pd
+    data = station_data['values']
+    timestamps = pd.to_datetime([item['dateTime'] for item in data],
+                                format='%Y-%m-%d %H:%M').values
+    return timestamps, decode_values([item['value'] for item in data])
+
+
+def decode_frame(array_decoder):
+    """ wrap an array decoder so it returns a date/value dataframe """
+    def decoder(station_data):
+        import pandas as pd
+        timestamps, values = array_decoder(station_data)
+        return pd.DataFrame({'date': timestamps, 'value': values})
+    return decoder
+
+
+def empty_arrays():
+    return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+
+
+def empty_frame():
+    import pandas as pd
+    timestamps, values = empty_arrays()
+    return pd.DataFrame({'date': timestamps, 'value': values})
+
+
+# record decoders and empty series for each output format
+DECODERS = {'lists': (decode_daily_data, decode_hourly_data, lambda: ([], [])),
+            'arrays': (decode_daily_arrays, decode_hourly_arrays, empty_arrays),
+            'frame': (decode_frame(decode_daily_arrays),
+                      decode_frame(decode_hourly_arrays), empty_frame)}
+
+
+def split_batch_response(station_data, station_triplets, element, decoder,
+                         empty_series=DECODERS['lists'][2]):
+    """
+    split a multi-station response back into per-station series
+        station_data --> list of records from a getData/getHourlyData call
+        station_triplets --> the triplets that were requested
+        element --> the element code that was requested
+        decoder --> record decoding function (i.e. decode_hourly_data)
+        empty_series --> function returning the series for a missing station
+        returns --> dict of (station triplet, element): decoded series
+    NOTE: stations with no data are left out of the NRCS response, so they
+          come back as empty series
+    """
+    results = {(triplet, element): empty_series() for triplet in station_triplets}
+    for record in station_data:
+        results[(record['stationTriplet'], element)] = decoder(record)
+    return results
+
+
+def metered_transport(**kwargs):
+    """
+    create a zeep transport that records WSDL load times and response sizes
+        kwargs --> zeep Transport arguments (session, cache, timeouts)
+    NOTE: the class is built on first use so zeep isn't imported until then
+    """
+    global _metered_transport
+    if _metered_transport is None:
+        from zeep.transports import Transport
+
+        class MeteredTransport(Transport):
+            def load(self, url):
+                with app_metrics.Timer(NRCS_WSDL_SECONDS):
+                    content = super().load(url)
+                NRCS_BYTES.inc(len(content), kind='wsdl')
+                return content
+
+            def post(self, address, message, headers):
+                response = super().post(address, message, headers)
+                NRCS_BYTES.inc(len(response.content), kind='data')
+                return response
+        _metered_transport = MeteredTransport
+    return _metered_transport(**kwargs)
+
+
+def create_wsdl_cache(cache_path=None, cache_ttl=WSDL_CACHE_TTL):
+    """
+    create a zeep cache for the WSDL and schema documents
+        cache_path --> sqlite file for the cache, None for zeep's default
+        cache_ttl --> seconds before a cached document is re-fetched
+    NOTE: falls back to an in-memory cache if sqlite is unavailable
+    """
+    from zeep.cache import SqliteCache, InMemoryCache
+    try:
+        return SqliteCache(path=cache_path, timeout=cache_ttl)
+    except Exception as caught_exception:
+        logging.exception(caught_exception)
+        return InMemoryCache(timeout=cache_ttl)
+
+
+@per_process
+def get_service(_logfile='powtracker.log', cache_path=None,
+                cache_ttl=WSDL_CACHE_TTL):
+    """
+    get the process-wide NRCS service, connecting it on first use
+        _logfile --> logfile used if the service has to be created
+        cache_path --> sqlite file for the WSDL cache
+        cache_ttl --> seconds before the cached WSDL is re-fetched
+        returns --> a shared NRCSService object
+    NOTE: forked worker processes get their own service, and a service that
+          failed to connect is reconnected on its next query
+    """
+    return NRCSService(_logfile, wsdl_cache=partial(create_wsdl_cache, cache_path, cache_ttl))
 
 
 class NRCSService:
     """ class to interface with NRCS station data """
-    def __init__(self, _logfile):
-        """ initialize an object of the NRCS service handler with a logfile"""
+    def __init__(self, _logfile, max_workers=4, wsdl_cache=None, transport=None,
+                 timeout=30, retry_policy=None, circuit_breaker=None):
+        """
+        initialize an object of the NRCS service handler with a logfile
+            max_workers --> limit on concurrent requests (and pooled
+                            connections) used by run_concurrent
+            wsdl_cache --> optional zeep cache for the WSDL/schema documents
+                           (see create_wsdl_cache), or a function creating
+                           one when the client connects
+            transport --> optional zeep transport to use instead of the
+                          default HTTP one (i.e. nrcs_fake_service)
+            timeout --> per-request timeout in seconds
+            retry_policy --> RetryPolicy for failed queries
+            circuit_breaker --> CircuitBreaker shared by every query
+        NOTE: the SOAP client (and the WSDL fetch) is only set up on the
+              first query, see client
+        """
         self._url = 'https://wcc.sc.egov.usda.gov/awdbWebService/services?WSDL'
         self._logfile = _logfile
         self._logger = None
+        self._client = None
+        self._max_workers = max_workers
+        self._wsdl_cache = wsdl_cache
+        self._transport = transport
+        self._timeout = timeout
+        self._retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self._breaker = CircuitBreaker() if circuit_breaker is None else circuit_breaker
+        self._last_good = OrderedDict()
+        self._last_good_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._connect_lock = threading.Lock()
+        self._connect_attempts = 0
+        self._connect_error = None
         self.create_logger()
-        self.connect_service()
 
     def connect_service(self):
         """ set up the connection session (no auth) """
         try:
-            _session = Session()
-            _session.verify = False
-            _transport = Transport(session=_session)
+            from zeep import Client
+            _transport = self._transport
+            if _transport is None:
+                import urllib3
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                # disable the annoying messages
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                _session = Session()
+                _session.verify = False
+                _adapter = HTTPAdapter(pool_connections=self._max_workers,
+                                       pool_maxsize=self._max_workers)
+                _session.mount('https://', _adapter)
+                _session.mount('http://', _adapter)
+                _cache = self._wsdl_cache
+                if callable(_cache):
+                    _cache = _cache()
+                _transport = metered_transport(session=_session, cache=_cache,
+                                               timeout=self._timeout,
+                                               operation_timeout=self._timeout)
             self._client = Client(self._url, transport=_transport)
+            self._connect_error = None
             self._logger.info('Connected to NRCS SOAP Service')
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._connect_error = caught_exception
+            self._logger.exception(caught_exception)
+
+    def is_connected(self):
+        """ check if the SOAP client was set up successfully """
+        return self._client is not None
+
+    @property
+    def client(self):
+        """
+        get the SOAP client, connecting on first use (or after a failure)
+        NOTE: raises ConnectError if the client can't be set up, which _call
+              retries with backoff and counts against the circuit breaker.
+              Threads that were waiting on a connect that just failed give up
+              rather than immediately trying again.
+        """
+        if self._client is None:
+            attempt = self._connect_attempts
+            with self._connect_lock:
+                if self._client is None and self._connect_attempts == attempt:
+                    self._connect_attempts += 1
+                    self.connect_service()
+                if self._client is None:
+                    raise ConnectError('could not connect to the NRCS SOAP service') \
+                        from self._connect_error
+        return self._client
+
+    @property
+    def max_workers(self):
+        return self._max_workers
 
     def create_logger(self):
         self._logger = attach_logger(self._logfile, 'NRCS_Query     ',
                                      logging.INFO)
 
+    def run_concurrent(self, function, items):
+        """
+        fan a query out over the service thread pool
+            function --> callable taking a single item (i.e. a service method)
+            items --> iterable of arguments, one call per item
+            returns --> list of results in the same order as items
+        NOTE: at most max_workers requests are in flight at once
+        """
+        return list(self._executor.map(function, items))
+
+    def _call(self, operation, **request_data):
+        """
+        run a SOAP operation through the retry and circuit breaker policies
+            operation --> AWDB operation name (i.e. 'getHourlyData')
+            request_data --> the operation arguments
+        NOTE: all of the AWDB queries are idempotent, so transient failures
+              are retried with backoff. If the service stays down (or the
+              circuit is open) the last good result for the same request is
+              returned, and if there isn't one the error is raised.
+        """
+        key = (operation, repr(sorted(request_data.items())))
+        if not self._breaker.allow():
+            NRCS_ERRORS.inc(operation=operation)
+            return self.last_good(key, CircuitOpenError('NRCS circuit is open'))
+        attempts = self._retry_policy.attempts
+        for attempt in range(attempts):
+            started = time.monotonic()
+            try:
+                with app_metrics.Timer(NRCS_REQUEST_SECONDS, operation=operation):
+                    result = self.client.service[operation](**request_data)
+            except Exception as caught_exception:
+                NRCS_ERRORS.inc(operation=operation)
+                if not is_retryable(caught_exception):
+                    from zeep.exceptions import Fault
+                    if isinstance(caught_exception, Fault):
+                        self._breaker.record_success()  # the server did answer
+                    else:
+                        self._breaker.release()  # a bad call, not a server problem
+                    raise
+                if attempt + 1 == attempts:
+                    self._breaker.record_failure()
+                    return self.last_good(key, caught_exception)
+                self._logger.warning('{} failed ({}), retrying'.format(operation, caught_exception))
+                time.sleep(self._retry_policy.delay(attempt))
+            else:
+                duration = time.monotonic() - started
+                self._logger.info('{} took {:.3f} s'.format(operation, duration),
+                                  extra={'operation': operation, 'duration': duration})
+                self._breaker.record_success()
+                with self._last_good_lock:
+                    self._last_good[key] = result
+                    self._last_good.move_to_end(key)
+                    if len(self._last_good) > LAST_GOOD_SIZE:
+                        self._last_good.popitem(last=False)
+                return result
+
+    def last_good(self, key, caught_exception):
+        """ get the last good result for a request, or raise the error """
+        with self._last_good_lock:
+            if key in self._last_good:
+                self._logger.warning('NRCS unavailable, serving last good result for {}'.format(key[0]))
+                return self._last_good[key]
+        raise caught_exception
+
     def get_methods_dict(self):
         """ get a dict of the available SOAP methods """
         try:
-            ops = self._client.service._operations
+            ops = self.client.service._operations
             return ops
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._logger.exception(caught_exception)
             return None
 
-    def get_stations(self, request_data):
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_stations')
+    def get_stations(self, request_data, catalog=None):
         """
         get NRCS stations satisfying search criteria
             request_data --> dict of search parameters,
                              must satisfy the required args in the NRCS API
                              (See the NRCS API docs)
+            catalog --> optional StationCatalog, metadata is then only
+                        fetched for stations it doesn't know yet
             returns a list of station dicts with metadata
         WARNING: Could be a massive query if not enough filter ops are added
         """
         try:
-            stations = self._client.service.getStations(**request_data)
-            station_metadata_list = []
+            stations = self._call('getStations', **request_data)
             self._logger.info('getting station metadata ...')
-            for station in stations:
-                request_data = {'stationTriplet': station}
-                metadata = self._client.service.getStationMetadata(**request_data)
-                station_metadata_list.append(metadata)
-            return station_metadata_list
+            if catalog is not None:
+                metadata = catalog.get_metadata(self, stations)
+                return [metadata.get(station) for station in stations]
+            return self.run_concurrent(self.get_station_metadata, stations)
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._logger.exception(caught_exception)
 
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_station_metadata')
     def get_station_metadata(self, station_triplet):
         """
         Get metadata given a station triplet
@@ -89,72 +428,128 @@ class NRCSService:
         try:
             self._logger.info('querying station metadata for {}'.format(station_triplet))
             request_data = {'stationTriplet': station_triplet}
-            meta = self._client.service.getStationMetadata(**request_data)
+            meta = self._call('getStationMetadata', **request_data)
             return meta
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._logger.exception(caught_exception)
 
-    def get_station_data(self, request_data):
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_multiple_station_metadata')
+    def get_multiple_station_metadata(self, station_triplets):
+        """
+        Get metadata for many stations in a single request
+            station_triplets --> list of station triplets
+            returns --> dict of station triplet: metadata
+        """
+        try:
+            self._logger.info('querying station metadata for {}'.format(station_triplets))
+            request_data = {'stationTriplets': list(station_triplets)}
+            metadata = self._call('getStationMetadataMultiple', **request_data)
+            return {meta['stationTriplet']: meta for meta in metadata}
+        except Exception as caught_exception:
+            self._logger.exception(caught_exception)
+
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_station_data')
+    def get_station_data(self, request_data, output='lists'):
         """
         getData query to get specific data from a site
             request_data --> dict of search params must meet reqs in getData
                              from the NRCS API doc.
+            output --> 'lists' (default), 'arrays' for numpy datetime64/float64
+                       arrays with NaN for missing values, or 'frame' for a
+                       dataframe with date and value columns
             returns --> list of dates, and list of float values
         """
         try:
             self._logger.info('querying station data for {}'.format(request_data['stationTriplets']))
-            station_data = self._client.service.getData(**request_data)
-            start_date = datetime.strptime(station_data[0]['beginDate'], '%Y-%m-%d %H:%M:%S')
-            end_date = datetime.strptime(station_data[0]['endDate'], '%Y-%m-%d %H:%M:%S')
-            date_delta = end_date - start_date
-            date_list = []
-            for i in range(date_delta.days + 1):
-                date_list.append(start_date + timedelta(days=i))
-            data = station_data[0]['values']
-            requested_data = []
-            for value in data:
-                if value is None:
-                    requested_data.append(None)
-                else:
-                    requested_data.append(float(value))
-            return date_list, requested_data
+            station_data = self._call('getData', **request_data)
+            return DECODERS[output][0](station_data[0])
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._logger.exception(caught_exception)
 
-    def get_station_hourly_data(self, request_data):
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_station_hourly_data')
+    def get_station_hourly_data(self, request_data, output='lists'):
         """
         getHourlyData query to get station hourly results
             request_data --> dict of search params must meet reqs in
                              getHourlyData from NRCS API doc.
+            output --> 'lists' (default), 'arrays' for numpy datetime64/float64
+                       arrays with NaN for missing values, or 'frame' for a
+                       dataframe with date and value columns
             returns --> list of datetime timestamps, and list of float values
         """
         try:
             self._logger.info('querying hourly station data for {}'.format(request_data['stationTriplets']))
-            station_data = self._client.service.getHourlyData(**request_data)
-            data = station_data[0]['values']
-            timestamps = []
-            requested_data = []
-            for item in data:
-                if item['dateTime'] is None:
-                    timestamps.append(None)
-                else:
-                    timestamps.append(datetime.strptime(item['dateTime'], '%Y-%m-%d %H:%M'))
-                if item['value'] is None:
-                    requested_data.append(None)
-                else:
-                    requested_data.append(float(item['value']))
-            return timestamps, requested_data
+            station_data = self._call('getHourlyData', **request_data)
+            return DECODERS[output][1](station_data[0])
+        except Exception as caught_exception:
+            self._logger.exception(caught_exception)
+
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_batch_station_data')
+    def get_batch_station_data(self, station_triplets, elements, request_data,
+                                output='lists'):
+        """
+        batched getData query over many stations and elements
+            station_triplets --> list of station triplets
+            elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+            request_data --> dict of the remaining getData params (ordinal,
+                             duration, dates, etc.) from the NRCS API doc.
+            output --> series format, see get_station_data
+            returns --> dict of (station triplet, element): (dates, values)
+        NOTE: getData takes a list of triplets but only one elementCd, so this
+              costs one request per element regardless of the station count.
+              The per-element requests run concurrently.
+        """
+        try:
+            self._logger.info('querying batch station data for {}'.format(station_triplets))
+            def query_element(element):
+                query = dict(request_data, stationTriplets=list(station_triplets),
+                             elementCd=element)
+                station_data = self._call('getData', **query)
+                return split_batch_response(station_data, station_triplets,
+                                            element, DECODERS[output][0],
+                                            DECODERS[output][2])
+            results = {}
+            for element_results in self.run_concurrent(query_element, elements):
+                results.update(element_results)
+            return results
+        except Exception as caught_exception:
+            self._logger.exception(caught_exception)
+
+    @app_metrics.timed(NRCS_METHOD_SECONDS, method='get_batch_station_hourly_data')
+    def get_batch_station_hourly_data(self, station_triplets, elements, request_data,
+                                       output='lists'):
+        """
+        batched getHourlyData query over many stations and elements
+            station_triplets --> list of station triplets
+            elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+            request_data --> dict of the remaining getHourlyData params
+                             (ordinal, dates, hours) from the NRCS API doc.
+            output --> series format, see get_station_hourly_data
+            returns --> dict of (station triplet, element): (timestamps, values)
+        """
+        try:
+            self._logger.info('querying batch hourly station data for {}'.format(station_triplets))
+            def query_element(element):
+                query = dict(request_data, stationTriplets=list(station_triplets),
+                             elementCd=element)
+                station_data = self._call('getHourlyData', **query)
+                return split_batch_response(station_data, station_triplets,
+                                            element, DECODERS[output][1],
+                                            DECODERS[output][2])
+            results = {}
+            for element_results in self.run_concurrent(query_element, elements):
+                results.update(element_results)
+            return results
         except Exception as caught_exception:
-            logging.exception(caught_exception)
+            self._logger.exception(caught_exception)
 
 
 if __name__ == '__main__':
     logpath = 'test.log'
     app_logger = AppLogger(logpath)
-    service = NRCSService(logpath)
+    service = get_service(logpath)
     request_data = {'stateCds': 'MT', 'networkCds': 'SNTL',
                     'minElevation': '6000', 'countyNames': 'Lincoln',
                     'logicalAnd': 'true'}
     stations = service.get_stations(request_data)
     meta = service.get_station_metadata('787:MT:SNTL')
-    
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+@brief local catalog of NRCS station metadata
+@author: Graham Riches
+@date: Sun Oct 18 10:41:45 2026
+@description
+    SQLite backed cache of getStationMetadata results. Station names and
+    locations practically never change, so entries are kept for a long time
+    and station searches (by state, network, county, elevation, bounding box
+    or distance) run locally instead of through the web service.
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+import numpy as np
+
+from process_singleton import per_process
+
+
+METADATA_TTL = 30 * 86400  # seconds
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_float(value):
+    return None if value is None else float(value)
+
+
+def field(meta, name):
+    """ get a metadata field, None if the record doesn't have it """
+    try:
+        return meta[name]
+    except KeyError:
+        return None
+
+
+class StationCatalog:
+    """ class to manage the local station metadata catalog """
+    def __init__(self, _dbpath='cache/stations.db', ttl=METADATA_TTL):
+        """
+        open (or create) a catalog at a database path
+            ttl --> seconds before a station's metadata is re-fetched
+        """
+        self._dbpath = _dbpath
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        if os.path.dirname(_dbpath):
+            os.makedirs(os.path.dirname(_dbpath), exist_ok=True)
+        self._conn = sqlite3.connect(_dbpath, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+        self._conn.row_factory = sqlite3.Row
+        self.create_tables()
+
+    def create_tables(self):
+        """ set up the station table and search indices """
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS stations ('
+                               'stationTriplet TEXT PRIMARY KEY, state TEXT, '
+                               'network TEXT, name TEXT, countyName TEXT, '
+                               'elevation REAL, latitude REAL, longitude REAL, '
+                               'huc TEXT, fetched REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS stations_state_network '
+                               'ON stations (state, network)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS stations_county '
+                               'ON stations (countyName)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS stations_elevation '
+                               'ON stations (elevation)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS stations_location '
+                               'ON stations (latitude, longitude)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS syncs ('
+                               'state TEXT, network TEXT, synced REAL, '
+                               'PRIMARY KEY (state, network))')
+
+    def close(self):
+        self._conn.close()
+
+    def add(self, metadata_list, fetched=None):
+        """
+        add (or refresh) station metadata
+            metadata_list --> list of NRCS stationMetaData records or dicts
+        """
+        fetched = time.time() if fetched is None else fetched
+        rows = []
+        for meta in metadata_list:
+            if meta is None:
+                continue
+            triplet = meta['stationTriplet']
+            station_id, state, network = triplet.split(':')
+            rows.append((triplet, state, network, field(meta, 'name'),
+                         field(meta, 'countyName'), to_float(field(meta, 'elevation')),
+                         to_float(field(meta, 'latitude')),
+                         to_float(field(meta, 'longitude')), field(meta, 'huc'), fetched))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO stations VALUES '
+                                   '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def query(self, where='', parameters=()):
+        """ run a station query, returning a list of metadata dicts """
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM stations ' + where,
+                                      parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def lookup(self, triplets):
+        """ get the stored metadata for a list of triplets as a dict """
+        triplets = list(triplets)
+        if not triplets:
+            return {}
+        where = 'WHERE stationTriplet IN ({})'.format(', '.join('?' * len(triplets)))
+        return {meta['stationTriplet']: meta for meta in self.query(where, triplets)}
+
+    def get_metadata(self, service, triplets):
+        """
+        get metadata for stations, only asking NRCS for unknown or stale ones
+            service --> NRCSService object
+            triplets --> list of station triplets
+            returns --> dict of station triplet: metadata dict
+        NOTE: stale entries are still served if the refresh fails
+        """
+        stored = self.lookup(triplets)
+        expired = time.time() - self._ttl
+        missing = [triplet for triplet in triplets
+                   if triplet not in stored or stored[triplet]['fetched'] < expired]
+        if missing:
+            fetched = service.get_multiple_station_metadata(missing)
+            if fetched:
+                self.add(fetched.values())
+                stored.update(self.lookup(fetched.keys()))
+            else:
+                logging.warning('could not refresh station metadata for {}'.format(missing))
+        return stored
+
+    def search(self, state=None, network=None, county=None, min_elevation=None,
+               max_elevation=None, bbox=None):
+        """
+        search the stored stations
+            state, network, county --> exact matches (i.e. 'MT', 'SNTL')
+            min_elevation, max_elevation --> elevation limits (ft)
+            bbox --> (min_lat, max_lat, min_lon, max_lon) bounding box
+            returns --> list of metadata dicts sorted by triplet
+        """
+        clauses = []
+        parameters = []
+        for column, value in (('state', state), ('network', network),
+                              ('countyName', county)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                parameters.append(value)
+        if min_elevation is not None:
+            clauses.append('elevation >= ?')
+            parameters.append(min_elevation)
+        if max_elevation is not None:
+            clauses.append('elevation <= ?')
+            parameters.append(max_elevation)
+        if bbox is not None:
+            clauses.append('latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?')
+            parameters.extend(bbox)
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return self.query(where + ' ORDER BY stationTriplet', parameters)
+
+    def nearest(self, latitude, longitude, count=5, **filters):
+        """
+        find the stations closest to a point
+            latitude, longitude --> point to search from (degrees)
+            count --> number of stations to return
+            filters --> any search() filters (i.e. network='SNTL')
+            returns --> list of (distance in km, metadata dict), closest first
+        """
+        stations = [meta for meta in self.search(**filters)
+                    if meta['latitude'] is not None and meta['longitude'] is not None]
+        if not stations:
+            return []
+        lat = np.radians([meta['latitude'] for meta in stations])
+        lon = np.radians([meta['longitude'] for meta in stations])
+        lat0, lon0 = np.radians(latitude), np.radians(longitude)
+        a = (np.sin((lat - lat0) / 2) ** 2
+             + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2)
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        order = np.argsort(distance)[:count]
+        return [(float(distance[idx]), stations[idx]) for idx in order]
+
+    def sync(self, service, request_data):
+        """
+        add every station matching a getStations search to the catalog
+            request_data --> getStations search params (see NRCSService)
+            returns --> list of metadata dicts for the matching stations
+        """
+        return service.get_stations(request_data, catalog=self)
+
+    def synced(self, state, network):
+        """ get when a state's network was last fully synced (epoch seconds), None if never """
+        with self._lock:
+            row = self._conn.execute('SELECT synced FROM syncs WHERE state = ? AND network = ?',
+                                     (state, network)).fetchone()
+        return None if row is None else row['synced']
+
+    def sync_state(self, service, state, network):
+        """
+        sync every station of a network in a state, unless that was done
+        within the ttl
+            state, network --> i.e. 'MT', 'SNTL'
+            returns --> True if the catalog holds the full station list
+        NOTE: a sync is only recorded if every station's metadata came back,
+              so a partial one is tried again on the next call
+        """
+        synced = self.synced(state, network)
+        if synced is not None and synced >= time.time() - self._ttl:
+            return True
+        stations = self.sync(service, {'stateCds': [state], 'networkCds': [network],
+                                       'logicalAnd': 'true'})
+        if stations is None or None in stations:
+            logging.warning('could not sync the {} {} stations'.format(state, network))
+            return False
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)',
+                               (state, network, time.time()))
+        return True
+
+
+@per_process
+def get_catalog(_dbpath='cache/stations.db'):
+    """ get the process-wide catalog, opening it on first use """
+    return StationCatalog(_dbpath)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+@brief local time-series store for SNOTEL data
+@author: Graham Riches
+@date: Sun Oct 18 10:34:12 2026
+@description
+    SQLite backed store of station data keyed by station triplet, element,
+    duration (DAILY/HOURLY) and timestamp. Each series keeps track of the
+    range it has already synced from NRCS, so a sync only asks the web
+    service for data outside of that range (normally just the data after the
+    last stored timestamp).
+"""
+
+import os
+import sqlite3
+import itertools
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+
+import app_metrics
+from process_singleton import per_process
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M'
+DAILY = 'DAILY'
+HOURLY = 'HOURLY'
+STEPS = {DAILY: timedelta(days=1), HOURLY: timedelta(hours=1)}
+# stations can report this late, missing values newer than this are asked for again
+REPORTING_LAG = timedelta(days=3)
+# longest range fetched in one request (~3.6k daily or ~1.4k hourly values)
+CHUNK_SIZES = {DAILY: timedelta(days=3650), HOURLY: timedelta(days=60)}
+
+STORE_LOOKUPS = app_metrics.counter('store_series_lookups_total',
+                                    'series synced from the store (hit) or the network (miss)')
+
+
+def to_datetime(value):
+    """ convert a date string ('2019-12-01') or datetime to a datetime """
+    if isinstance(value, datetime):
+        return value
+    if len(value) > 10:
+        return datetime.strptime(value[:16], TIMESTAMP_FORMAT)
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def iter_chunks(begin, end, duration, chunk_size=None):
+    """
+    split an inclusive [begin, end] range into consecutive chunks
+        chunk_size --> timedelta of each chunk, defaults to CHUNK_SIZES
+        yields --> (chunk begin, chunk end) datetimes, both inclusive
+    """
+    step = STEPS[duration]
+    chunk_size = CHUNK_SIZES[duration] if chunk_size is None else chunk_size
+    chunk_begin = begin
+    while chunk_begin <= end:
+        chunk_end = min(chunk_begin + chunk_size - step, end)
+        yield chunk_begin, chunk_end
+        chunk_begin = chunk_end + step
+
+
+def fetch_range(service, triplet, element, duration, begin, end, output='lists'):
+    """
+    query NRCS for one series over an inclusive datetime range
+        output --> series format, see NRCSService.get_station_data
+        returns --> (timestamps, values), or None if the query failed
+    """
+    if duration == DAILY:
+        request_data = {'stationTriplets': triplet, 'elementCd': element,
+                        'ordinal': '1', 'duration': DAILY,
+                        'getFlags': 'False',
+                        'beginDate': begin.strftime('%Y-%m-%d'),
+                        'endDate': end.strftime('%Y-%m-%d'),
+                        'alwaysReturnDailyFeb29': 'false'}
+        return service.get_station_data(request_data, output)
+    request_data = {'stationTriplets': triplet, 'elementCd': element,
+                    'ordinal': '1',
+                    'beginDate': begin.strftime('%Y-%m-%d'),
+                    'endDate': end.strftime('%Y-%m-%d'),
+                    'beginHour': begin.hour,
+                    'endHour': end.hour}
+    return service.get_station_hourly_data(request_data, output)
+
+
+def latest_complete(duration, now=None):
+    """
+    get the last timestamp for a duration that won't change on the server
+    (i.e. yesterday for daily data, the previous hour for hourly data)
+    """
+    now = datetime.now() if now is None else now
+    if duration == DAILY:
+        return datetime(now.year, now.month, now.day) - STEPS[DAILY]
+    return datetime(now.year, now.month, now.day, now.hour) - STEPS[HOURLY]
+
+
+def last_reported(timestamps, values):
+    """ get the datetime of the last value that isn't missing, None if there isn't one """
+    if isinstance(timestamps, np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        reported = timestamps[~np.isnan(values) & ~np.isnat(timestamps)]
+        return reported.max().astype('datetime64[us]').item() if len(reported) else None
+    reported = [stamp for stamp, value in zip(timestamps, values)
+                if stamp is not None and value is not None]
+    return max(reported) if reported else None
+
+
+class SnotelStore:
+    """ class to manage the local sqlite store of station data """
+    def __init__(self, _dbpath='cache/snotel.db'):
+        """ open (or create) a store at a database path """
+        self._dbpath = _dbpath
+        self._lock = threading.Lock()
+        if os.path.dirname(_dbpath):
+            os.makedirs(os.path.dirname(_dbpath), exist_ok=True)
+        self._conn = sqlite3.connect(_dbpath, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+        self.create_tables()
+
+    def create_tables(self):
+        """ set up the series and sync tracking tables """
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS series ('
+                               'triplet TEXT, element TEXT, duration TEXT, '
+                               'timestamp TEXT, value REAL, '
+                               'PRIMARY KEY (triplet, element, duration, timestamp))'
+                               ' WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS sync_state ('
+                               'triplet TEXT, element TEXT, duration TEXT, '
+                               'first TEXT, last TEXT, '
+                               'PRIMARY KEY (triplet, element, duration))')
+
+    def close(self):
+        self._conn.close()
+
+    def write_series(self, triplet, element, duration, timestamps, values):
+        """
+        write (or overwrite) values for a series
+            timestamps --> list of datetimes
+            values --> list of floats (None for missing values)
+        """
+        rows = [(triplet, element, duration, stamp.strftime(TIMESTAMP_FORMAT), value)
+                for stamp, value in zip(timestamps, values) if stamp is not None]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)',
+                                   rows)
+
+    def write_arrays(self, triplet, element, duration, timestamps, values):
+        """
+        write (or overwrite) values for a series from numpy arrays
+            timestamps --> datetime64 array (NaT entries are skipped)
+            values --> float array (NaN for missing values)
+        """
+        import pandas as pd
+        stamps = pd.DatetimeIndex(timestamps)
+        keep = ~stamps.isna()
+        values = np.asarray(values, dtype=np.float64)[keep].astype(object)
+        values[np.isnan(values.astype(np.float64))] = None
+        rows = zip(itertools.repeat(triplet), itertools.repeat(element),
+                   itertools.repeat(duration), stamps[keep].strftime(TIMESTAMP_FORMAT),
+                   values)
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)',
+                                   rows)
+
+    def read_series(self, triplet, element, duration, begin, end):
+        """
+        read a stored series between two datetimes (inclusive)
+            returns --> list of datetime timestamps, and list of float values
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT timestamp, value FROM series '
+                                      'WHERE triplet = ? AND element = ? AND duration = ? '
+                                      'AND timestamp BETWEEN ? AND ? ORDER BY timestamp',
+                                      (triplet, element, duration,
+                                       begin.strftime(TIMESTAMP_FORMAT),
+                                       end.strftime(TIMESTAMP_FORMAT))).fetchall()
+        timestamps = [datetime.strptime(row[0], TIMESTAMP_FORMAT) for row in rows]
+        values = [row[1] for row in rows]
+        return timestamps, values
+
+    def synced_range(self, triplet, element, duration):
+        """ get the (first, last) synced datetimes for a series, or None """
+        with self._lock:
+            row = self._conn.execute('SELECT first, last FROM sync_state '
+                                     'WHERE triplet = ? AND element = ? AND duration = ?',
+                                     (triplet, element, duration)).fetchone()
+        if row is None:
+            return None
+        return (datetime.strptime(row[0], TIMESTAMP_FORMAT),
+                datetime.strptime(row[1], TIMESTAMP_FORMAT))
+
+    def mark_synced(self, triplet, element, duration, first, last):
+        """ extend the synced range of a series """
+        synced = self.synced_range(triplet, element, duration)
+        if synced is not None:
+            first = min(first, synced[0])
+            last = max(last, synced[1])
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)',
+                               (triplet, element, duration,
+                                first.strftime(TIMESTAMP_FORMAT),
+                                last.strftime(TIMESTAMP_FORMAT)))
+
+    def missing_ranges(self, triplet, element, duration, begin, end):
+        """
+        get the (begin, end) ranges of a request that aren't in the store yet
+        NOTE: ranges always join up with the synced range, so the synced range
+              never has holes in it
+        """
+        synced = self.synced_range(triplet, element, duration)
+        if synced is None:
+            return [(begin, end)]
+        step = STEPS[duration]
+        ranges = []
+        if begin < synced[0]:
+            ranges.append((begin, synced[0] - step))
+        if end > synced[1]:
+            ranges.append((synced[1] + step, end))
+        return ranges
+
+    def missing_chunks(self, triplet, element, duration, begin, end, chunk_size=None):
+        """
+        split the missing ranges of a request into chunks
+            returns --> list of chunk lists, each in the order the chunks have
+                        to be marked synced for the synced range to grow
+                        without holes
+        """
+        synced = self.synced_range(triplet, element, duration)
+        runs = []
+        for fetch_begin, fetch_end in self.missing_ranges(triplet, element, duration,
+                                                          begin, end):
+            chunks = list(iter_chunks(fetch_begin, fetch_end, duration, chunk_size))
+            if synced is not None and fetch_end < synced[0]:
+                chunks.reverse()  # grows the synced range backwards
+            if chunks:
+                runs.append(chunks)
+        return runs
+
+    def write_chunk(self, triplet, element, duration, chunk, timestamps, values,
+                    complete=None):
+        """
+        write a fetched chunk and extend the synced range over it
+            returns --> True if the whole chunk was marked synced
+        NOTE: within REPORTING_LAG of complete the synced range only goes up
+              to the last value the station reported, so values that hadn't
+              come in yet are fetched again by the next sync
+        """
+        complete = latest_complete(duration) if complete is None else complete
+        if isinstance(timestamps, np.ndarray):
+            self.write_arrays(triplet, element, duration, timestamps, values)
+        else:
+            self.write_series(triplet, element, duration, timestamps, values)
+        synced_end = min(chunk[1], complete)
+        settled = complete - REPORTING_LAG
+        if synced_end > settled:
+            reported = last_reported(timestamps, values)
+            synced_end = min(synced_end, settled if reported is None else max(reported, settled))
+        if chunk[0] <= synced_end:
+            self.mark_synced(triplet, element, duration, chunk[0], synced_end)
+        return synced_end >= chunk[1]
+
+    def sync(self, service, triplet, elements, duration, begin, end, chunk_size=None):
+        """
+        fetch any data missing from the store for a station
+            service --> NRCSService object
+            triplet --> station triplet
+            elements --> list of element codes (i.e. ['SNWD', 'WTEQ'])
+            duration --> DAILY or HOURLY
+            begin, end --> datetimes of the range to make available
+            chunk_size --> timedelta of the longest single request (see
+                           CHUNK_SIZES)
+        """
+        end = min(end, latest_complete(duration) + STEPS[duration])
+        complete = latest_complete(duration)
+        runs = []
+        for element in elements:
+            element_runs = self.missing_chunks(triplet, element, duration, begin, end,
+                                               chunk_size)
+            STORE_LOOKUPS.inc(result='miss' if element_runs else 'hit')
+            runs.extend((element, chunks) for chunks in element_runs)
+        queries = [(element, chunk) for element, chunks in runs for chunk in chunks]
+        results = service.run_concurrent(
+            lambda query: fetch_range(service, triplet, query[0], duration, *query[1]),
+            queries)
+        results = dict(zip(queries, results))
+        for element, chunks in runs:
+            for chunk in chunks:
+                result = results[(element, chunk)]
+                if result is None:
+                    break  # failed query, the rest is fetched on the next sync
+                if not self.write_chunk(triplet, element, duration, chunk, *result,
+                                        complete=complete):
+                    break  # not all reported yet, later chunks would leave a hole
+
+    def get_series(self, service, triplet, element, duration, begin, end):
+        """
+        read a series from the store, filling any gaps from the network first
+            returns --> list of datetime timestamps, and list of float values
+        """
+        self.sync(service, triplet, [element], duration, begin, end)
+        return self.read_series(triplet, element, duration, begin, end)
+
+
+@per_process
+def get_store(_dbpath='cache/snotel.db'):
+    """ get the process-wide store, opening it on first use """
+    return SnotelStore(_dbpath)
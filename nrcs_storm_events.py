@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+@brief streaming storm event detection over hourly SNOTEL data
+@author: Graham Riches
+@date: Sun Oct 18 11:03:02 2026
+@description
+    Each station keeps a small rolling state (last accepted values, 24h/72h
+    rolling minimums of depth and SWE, current storm) that is updated one hour
+    at a time in amortized constant time, so a refresh only feeds the hours
+    observed since the last one. Detected events go to a sqlite event log:
+        storm_onset --> STORM_ONSET inches of new snow in 24 hours
+        storm_end --> STORM_QUIET_HOURS since the depth peaked, value is the
+                      storm total
+        new_snow_24h, new_snow_72h --> new snow crossed NEW_SNOW_ALERTS
+        swe_increment --> 24 hour SWE gain crossed SWE_ALERT
+        rain_on_snow --> SWE rising with snow on the ground above freezing
+        sensor_spike --> a jump too big to be real, the hour is skipped
+    The station states are saved in the same database, so any server process
+    can pick up where the last refresh left off.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+
+from process_singleton import per_process
+
+
+STORM_ELEMENTS = ['SNWD', 'WTEQ', 'TOBS']
+NEW_SNOW_WINDOWS = {'24h': 24, '72h': 72}  # hours
+NEW_SNOW_ALERTS = {'24h': 6.0, '72h': 12.0}  # inches
+SWE_WINDOW = 24  # hours
+SWE_ALERT = 0.5  # inches
+STORM_ONSET = 3.0  # inches in 24 hours, well above the hourly depth jitter
+STORM_QUIET_HOURS = 12
+FREEZING = 32.0  # deg F
+SPIKE_DEPTH = 10.0  # inches in one hour
+SPIKE_SWE = 2.0  # inches in one hour
+
+
+def hour_time(hour):
+    """ get the datetime64 for an hour_number """
+    return np.datetime64(int(hour), 'h')
+
+
+def hour_text(time):
+    """ format a datetime64 hour like the rest of the app (i.e. '2019-12-08 13:00') """
+    return str(np.datetime64(time, 'h')).replace('T', ' ') + ':00'
+
+
+def is_jump(change, limit):
+    return not np.isnan(change) and abs(change) > limit
+
+
+def hour_number(time):
+    return int(np.datetime64(time, 'h').astype(np.int64))
+
+
+class RollingMin:
+    """
+    minimum over a trailing number of hours
+    NOTE: a monotonic queue, so each push is amortized O(1) and the state
+          never holds more than one entry per hour of the window
+    """
+    def __init__(self, hours, entries=None):
+        self._hours = hours
+        self._entries = deque(tuple(entry) for entry in (entries or []))
+
+    def push(self, hour, value):
+        """ add an observation (hour --> hour_number, value --> not NaN) """
+        while self._entries and self._entries[-1][1] >= value:
+            self._entries.pop()
+        self._entries.append((hour, value))
+        while self._entries[0][0] <= hour - self._hours:
+            self._entries.popleft()
+
+    def minimum(self, hour):
+        """ get the minimum of the window ending at an hour, NaN if empty """
+        while self._entries and self._entries[0][0] <= hour - self._hours:
+            self._entries.popleft()
+        return self._entries[0][1] if self._entries else np.nan
+
+    def clear(self):
+        self._entries.clear()
+
+    def to_list(self):
+        return [list(entry) for entry in self._entries]
+
+
+class StationState:
+    """
+    rolling storm state for one station
+    NOTE: new snow over a window is the depth above the window's minimum
+          (the usual HN24 estimate), so sensor jitter doesn't add up the way
+          a sum of hourly increases would
+    """
+    def __init__(self, triplet, state=None):
+        """
+        create a state
+            state --> dict from to_dict() to resume from, None to start fresh
+        """
+        state = state or {}
+
+        def number(value):
+            return np.nan if value is None else value
+        self.triplet = triplet
+        self.last_time = state.get('last_time')
+        self.depth = number(state.get('depth'))
+        self.swe = number(state.get('swe'))
+        self.pending = state.get('pending')  # [depth, swe] of a rejected jump
+        minimums = state.get('minimums', {})
+        self.depth_min = {name: RollingMin(hours, minimums.get(name))
+                          for name, hours in NEW_SNOW_WINDOWS.items()}
+        self.swe_min = RollingMin(SWE_WINDOW, minimums.get('swe'))
+        self.onset_min = RollingMin(NEW_SNOW_WINDOWS['24h'], minimums.get('onset'))
+        self.storm = state.get('storm')
+        self.alerts = state.get('alerts', [])
+        self.raining = state.get('raining', False)
+
+    def event(self, hour, kind, value, detail=''):
+        return {'triplet': self.triplet, 'time': hour_text(hour_time(hour)),
+                'kind': kind, 'value': round(float(value), 2), 'detail': detail}
+
+    def new_snow(self, hour):
+        """ new snow (in) over each NEW_SNOW_WINDOWS window ending at an hour """
+        return {name: max(self.depth - rolling.minimum(hour), 0.0)
+                for name, rolling in self.depth_min.items()}
+
+    def update(self, time, depth, swe, temp):
+        """
+        add one hour of observations
+            time --> datetime64 of the hour
+            depth, swe, temp --> observed values, NaN if not reported
+            returns --> list of event dicts (usually empty)
+        NOTE: hours at or before the last update are ignored
+        """
+        hour = hour_number(time)
+        if self.last_time is not None and hour <= self.last_time:
+            return []
+        self.last_time = hour
+        if self.pending is not None and not (is_jump(depth - self.pending[0], SPIKE_DEPTH)
+                                             or is_jump(swe - self.pending[1], SPIKE_SWE)):
+            self.rebaseline()  # the jump stuck, the sensor was reset or moved
+        elif is_jump(depth - self.depth, SPIKE_DEPTH) or is_jump(swe - self.swe, SPIKE_SWE):
+            self.pending = [float(depth), float(swe)]
+            return [self.event(hour, 'sensor_spike', np.nan_to_num(depth - self.depth),
+                               'depth {} in, SWE {} in'.format(depth, swe))]
+        self.pending = None
+        swe_change = swe - self.swe
+        if not np.isnan(depth):
+            self.depth = float(depth)
+            for rolling in list(self.depth_min.values()) + [self.onset_min]:
+                rolling.push(hour, self.depth)
+        if not np.isnan(swe):
+            self.swe = float(swe)
+            self.swe_min.push(hour, self.swe)
+        return self.detect(hour, swe_change, temp)
+
+    def rebaseline(self):
+        """ restart the windows from the current reading after a step change """
+        for rolling in list(self.depth_min.values()) + [self.swe_min, self.onset_min]:
+            rolling.clear()
+        self.depth = self.swe = np.nan
+
+    def detect(self, hour, swe_change, temp):
+        """ check the updated state for events """
+        events = []
+        new_snow = self.new_snow(hour)
+        new_swe = max(self.swe - self.swe_min.minimum(hour), 0.0)
+        onset_snow = self.depth - self.onset_min.minimum(hour)
+        if self.storm is None and onset_snow >= STORM_ONSET:
+            self.storm = {'onset': hour, 'base': self.depth - onset_snow,
+                          'swe_base': self.swe - new_swe,
+                          'peak': self.depth, 'peak_hour': hour}
+            events.append(self.event(hour, 'storm_onset', onset_snow))
+        elif self.storm is not None:
+            if self.depth > self.storm['peak']:
+                self.storm['peak'], self.storm['peak_hour'] = self.depth, hour
+            elif hour - self.storm['peak_hour'] >= STORM_QUIET_HOURS:
+                events.append(self.event(hour, 'storm_end',
+                                         self.storm['peak'] - self.storm['base'],
+                                         'since {}, {:.1f} in SWE'.format(
+                                             hour_text(hour_time(self.storm['onset'])),
+                                             self.swe - self.storm['swe_base'])))
+                self.storm = None
+                self.onset_min.clear()  # the next storm starts from here
+                self.onset_min.push(hour, self.depth)
+        alerts = {'new_snow_' + name: (new_snow[name], threshold)
+                  for name, threshold in NEW_SNOW_ALERTS.items()}
+        alerts['swe_increment'] = (new_swe, SWE_ALERT)
+        for kind, (total, threshold) in alerts.items():
+            if total >= threshold and kind not in self.alerts:
+                self.alerts.append(kind)
+                events.append(self.event(hour, kind, total))
+            elif total < threshold and kind in self.alerts:
+                self.alerts.remove(kind)
+        raining = bool(temp > FREEZING and swe_change > 0 and self.depth > 0)
+        if raining and not self.raining:
+            events.append(self.event(hour, 'rain_on_snow', swe_change, '{} F'.format(temp)))
+        self.raining = raining
+        return events
+
+    def to_dict(self):
+        """ get the state as a JSON serializable dict """
+        def number(value):
+            return None if np.isnan(value) else value
+        minimums = {name: rolling.to_list() for name, rolling in self.depth_min.items()}
+        minimums.update(swe=self.swe_min.to_list(), onset=self.onset_min.to_list())
+        return {'last_time': self.last_time, 'depth': number(self.depth),
+                'swe': number(self.swe), 'pending': self.pending, 'minimums': minimums,
+                'storm': self.storm, 'alerts': self.alerts, 'raining': self.raining}
+
+
+class EventLog:
+    """ class to manage the sqlite storm event log and station states """
+    def __init__(self, _dbpath='cache/events.db'):
+        """ open (or create) an event log at a database path """
+        self._dbpath = _dbpath
+        self._lock = threading.Lock()
+        if os.path.dirname(_dbpath):
+            os.makedirs(os.path.dirname(_dbpath), exist_ok=True)
+        self._conn = sqlite3.connect(_dbpath, check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+        self._conn.row_factory = sqlite3.Row
+        self.create_tables()
+
+    def create_tables(self):
+        """ set up the event and station state tables """
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS events ('
+                               'triplet TEXT, time TEXT, kind TEXT, value REAL, '
+                               'detail TEXT, PRIMARY KEY (triplet, time, kind))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS events_time ON events (time)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS states ('
+                               'triplet TEXT PRIMARY KEY, state TEXT)')
+
+    def close(self):
+        self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        hold the write lock for a load, update, save cycle
+        NOTE: BEGIN IMMEDIATE also keeps other processes out until commit
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def load_states(self, triplets, conn=None):
+        """ get the saved StationState for each triplet (new ones if unknown) """
+        triplets = list(triplets)
+        where = 'WHERE triplet IN ({})'.format(', '.join('?' * len(triplets)))
+        if conn is None:
+            with self._lock:
+                rows = self._conn.execute('SELECT * FROM states ' + where, triplets).fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM states ' + where, triplets).fetchall()
+        saved = {row['triplet']: json.loads(row['state']) for row in rows}
+        return {triplet: StationState(triplet, saved.get(triplet)) for triplet in triplets}
+
+    def query(self, triplets=None, since=None, kinds=None, limit=100):
+        """
+        get logged events, newest first
+            triplets, kinds --> only these stations / event kinds
+            since --> datetime of the oldest event to return
+            returns --> list of event dicts
+        """
+        clauses = []
+        parameters = []
+        for column, values in (('triplet', triplets), ('kind', kinds)):
+            if values is not None:
+                values = list(values)
+                clauses.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+                parameters.extend(values)
+        if since is not None:
+            clauses.append('time >= ?')
+            parameters.append(since.strftime('%Y-%m-%d %H:%M'))
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM events {} ORDER BY time DESC, triplet '
+                                      'LIMIT ?'.format(where), parameters + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+
+def hourly_rows(window, triplet, after=None):
+    """
+    line up a station's hourly window series by hour
+        window --> HourlyWindow holding STORM_ELEMENTS
+        after --> datetime64 hour, only later hours are returned
+        returns --> (datetime64[h] hours, depth, swe, temp arrays)
+    """
+    series = [window.series(triplet, element) for element in STORM_ELEMENTS]
+    hours = np.unique(np.concatenate([timestamps.astype('datetime64[h]')
+                                      for timestamps, values in series]))
+    if after is not None:
+        hours = hours[hours > after]
+    columns = []
+    for timestamps, values in series:
+        timestamps = timestamps.astype('datetime64[h]')
+        idx = np.searchsorted(timestamps, hours)
+        found = idx < len(timestamps)
+        found[found] = timestamps[idx[found]] == hours[found]
+        column = np.full(len(hours), np.nan)
+        column[found] = values[idx[found]]
+        columns.append(column)
+    return (hours, *columns)
+
+
+class StormEngine:
+    """ feeds new hourly observations through the station states """
+    def __init__(self, event_log):
+        self._log = event_log
+
+    def ingest_window(self, window, triplets):
+        """
+        process the hours each station hasn't seen yet
+            window --> refreshed HourlyWindow with SNWD, WTEQ and TOBS
+            triplets --> stations to process
+            returns --> list of new event dicts
+        """
+        events = []
+        with self._log.transaction() as conn:
+            states = self._log.load_states(triplets, conn)
+            for triplet, state in states.items():
+                after = None if state.last_time is None else hour_time(state.last_time)
+                for hour, depth, swe, temp in zip(*hourly_rows(window, triplet, after)):
+                    events.extend(state.update(hour, depth, swe, temp))
+            conn.executemany('INSERT OR REPLACE INTO states VALUES (?, ?)',
+                             [(triplet, json.dumps(state.to_dict()))
+                              for triplet, state in states.items()])
+            conn.executemany('INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?)',
+                             [(event['triplet'], event['time'], event['kind'],
+                               event['value'], event['detail']) for event in events])
+        return events
+
+
+@per_process
+def get_event_log(_dbpath='cache/events.db'):
+    """ get the process-wide event log, opening it on first use """
+    return EventLog(_dbpath)
@@ -8,21 +8,64 @@
 
 import unittest
 import logging
-from datetime import datetime
-from nrcs_service import NRCSService
+import os
+import shutil
+import tempfile
+import sys
+import json
+import time
+import subprocess
+from unittest import mock
+from datetime import datetime, timedelta
+import numpy as np
+import app_metrics
+import pandas as pd
+import nrcs_logging_utilities
+from nrcs_service import NRCSService, get_service, split_batch_response, decode_hourly_data
+from nrcs_service import decode_daily_arrays, decode_hourly_arrays
+from nrcs_store import SnotelStore, DAILY, latest_complete
+from nrcs_backfill import backfill, stream_series
+from nrcs_hourly_window import HourlyWindow
+from nrcs_downsample import downsample, downsample_range, visible_range
+from nrcs_region import region_stations, build_region_frame, build_region_map, query_page
+from nrcs_storm_events import StationState, EventLog, StormEngine
+from nrcs_qc import qc_series, QC_RANGE, QC_RATE, QC_SPIKE, QC_MISSING, QC_FILLED
+from nrcs_seasons import load_seasons, season_dates, SEASON_DAYS, SeasonData
+from nrcs_climatology import Climatology, load_climatology, storm_metrics
+from web_scraper import ForecastCache
+from forecast_products import ForecastProducts, parse_product
+from nrcs_fake_service import FakeAWDBTransport
+from nrcs_station_catalog import StationCatalog
+from nrcs_resilience import RetryPolicy, CircuitBreaker
+from refresh_scheduler import RefreshScheduler
+from snapshot_store import SnapshotStore
+from shared_cache import FileBackend, RedisBackend
+from process_singleton import per_process
 
 
 class NRCSTests(unittest.TestCase):
     def setUp(self):
         """ setup method """
-        self._service = NRCSService('test.log')
+        self._service = get_service('test.log')
 
     def test_get_station_query(self):
         pass
 
+    def test_shared_service(self):
+        """ the service is only built once per process """
+        self.assertIs(get_service('test.log'), self._service)
+
     def test_init_logger(self):
         self.assertIsInstance(self._service._logger, logging.Logger)
 
+    def test_run_concurrent_order(self):
+        """ results come back in input order """
+        def slow_square(value):
+            time.sleep(0.01 * (5 - value))
+            return value * value
+        results = self._service.run_concurrent(slow_square, range(5))
+        self.assertEqual(results, [0, 1, 4, 9, 16])
+
     def test_get_api_methods(self):
         """ returns a dict """
         ops = self._service.get_methods_dict()
@@ -61,5 +104,934 @@ class NRCSTests(unittest.TestCase):
         self.assertIsInstance(station_data, list)
         self.assertIsInstance(station_data[0], float)
 
+    def test_get_multiple_station_metadata(self):
+        """ should return a dict of metadata keyed by triplet """
+        meta = self._service.get_multiple_station_metadata(['787:MT:SNTL', '932:MT:SNTL'])
+        self.assertIsInstance(meta['787:MT:SNTL']['name'], str)
+        self.assertIsInstance(meta['932:MT:SNTL']['name'], str)
+
+    def test_get_batch_station_hourly_data(self):
+        """ should return a series for every station/element pair """
+        sites = ['787:MT:SNTL', '932:MT:SNTL']
+        elements = ['SNWD', 'WTEQ']
+        request_data = {'ordinal': '1', 'beginDate': '2019-12-06',
+                        'endDate': '2019-12-08'}
+        results = self._service.get_batch_station_hourly_data(sites, elements, request_data)
+        self.assertEqual(len(results), 4)
+        timestamps, station_data = results[('787:MT:SNTL', 'SNWD')]
+        self.assertIsInstance(timestamps, list)
+        self.assertIsInstance(station_data[0], float)
+
+
+class PerProcessTests(unittest.TestCase):
+    def test_per_process(self):
+        """ one object per process, rebuilt after a fork or a reset """
+        shared = per_process(lambda value: [value])
+        first = shared(1)
+        self.assertIs(shared(2), first)
+        with mock.patch('os.getpid', return_value=-1):  # a forked child
+            child = shared(3)
+        self.assertEqual(child, [3])
+        self.assertIsNone(shared.reset())  # the child's, not this process's
+        first = shared(4)
+        self.assertIs(shared.reset(), first)
+        self.assertIsNot(shared(5), first)
+
+
+class StartupTests(unittest.TestCase):
+    def test_lazy_imports(self):
+        """ heavy dependencies aren't imported until they're needed """
+        script = ('import sys, nrcs_service, nrcs_store, web_scraper\n'
+                  'service = nrcs_service.NRCSService("test.log")\n'
+                  'print(service.is_connected(), sorted(module for module in '
+                  '("zeep", "requests", "bs4", "pandas", "plotly") if module in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         universal_newlines=True)
+        self.assertEqual(output.strip(), 'False []')
+
+
+class NRCSOfflineTests(unittest.TestCase):
+    """ the live tests again, against the offline AWDB stand-in """
+    def setUp(self):
+        self._transport = FakeAWDBTransport(missing_every=5)
+        self._service = NRCSService('test.log', transport=self._transport)
+
+    def test_get_stations(self):
+        request_data = {'stateCds': 'MT', 'networkCds': 'SNTL',
+                        'minElevation': '4500', 'countyNames': 'Lincoln',
+                        'logicalAnd': 'true'}
+        stations = self._service.get_stations(request_data)
+        self.assertEqual(len(stations), self._transport.station_count)
+        self.assertIsInstance(stations[0]['name'], str)
+
+    def test_get_station_data(self):
+        request_data = {'stationTriplets': '787:MT:SNTL', 'elementCd': 'SNWD',
+                        'ordinal': '1', 'duration': 'DAILY',
+                        'getFlags': 'False', 'beginDate': '2019-12-01',
+                        'endDate': '2019-12-08',
+                        'alwaysReturnDailyFeb29': 'true'}
+        dates, station_data = self._service.get_station_data(request_data)
+        self.assertEqual(len(dates), 8)
+        self.assertIsNone(station_data[0])
+        self.assertIsInstance(station_data[1], float)
+
+    def test_get_batch_station_hourly_data(self):
+        request_data = {'ordinal': '1', 'beginDate': '2019-12-06',
+                        'endDate': '2019-12-08'}
+        results = self._service.get_batch_station_hourly_data(
+            ['787:MT:SNTL', '932:MT:SNTL'], ['SNWD', 'TOBS'], request_data, 'arrays')
+        timestamps, station_data = results[('932:MT:SNTL', 'TOBS')]
+        self.assertEqual(len(timestamps), 72)
+        self.assertEqual(station_data.dtype, np.float64)
+        operations = [operation for operation, arguments in self._transport.requests]
+        self.assertEqual(operations, ['getHourlyData', 'getHourlyData'])
+
+
+class StationCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self._transport = FakeAWDBTransport(station_count=200)
+        self._service = NRCSService('test.log', transport=self._transport)
+        self._catalog = StationCatalog(':memory:')
+
+    def test_metadata_is_cached(self):
+        """ known stations don't go back to NRCS """
+        for _ in range(2):
+            meta = self._catalog.get_metadata(self._service, ['787:MT:SNTL', '932:MT:SNTL'])
+        self.assertEqual(meta['787:MT:SNTL']['name'], 'Fake Site 787')
+        self.assertEqual(len(self._transport.requests), 1)
+
+    def test_local_search(self):
+        """ a synced search can be answered locally """
+        stations = self._catalog.sync(self._service, {'stateCds': 'MT', 'networkCds': 'SNTL',
+                                                      'logicalAnd': 'true'})
+        self.assertEqual(len(stations), 200)
+        self.assertEqual(len(self._transport.requests), 2)
+        high = self._catalog.search(state='MT', min_elevation=7000)
+        self.assertTrue(all(meta['elevation'] >= 7000 for meta in high))
+        distance, closest = self._catalog.nearest(stations[10]['latitude'],
+                                                  stations[10]['longitude'], count=1)[0]
+        self.assertAlmostEqual(distance, 0.0)
+
+    def test_sync_state(self):
+        """ known stations don't stop a state from being synced, once per ttl """
+        self._catalog.get_metadata(self._service, ['787:MT:SNTL'])
+        self.assertIsNone(self._catalog.synced('MT', 'SNTL'))
+        for _ in range(2):
+            self.assertTrue(self._catalog.sync_state(self._service, 'MT', 'SNTL'))
+        self.assertEqual(len(self._transport.requests), 3)
+        self.assertEqual(len(self._catalog.search(state='MT', network='SNTL')), 201)
+
+
+class NRCSResilienceTests(unittest.TestCase):
+    def setUp(self):
+        self._transport = FakeAWDBTransport()
+        self._breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self._service = NRCSService('test.log', transport=self._transport,
+                                    retry_policy=RetryPolicy(attempts=3, base_delay=0),
+                                    circuit_breaker=self._breaker)
+
+    def test_retry_transient_failure(self):
+        """ a couple of dropped connections are retried """
+        self._transport.fail_requests = 2
+        meta = self._service.get_station_metadata('787:MT:SNTL')
+        self.assertEqual(meta['name'], 'Fake Site 787')
+        self.assertEqual(len(self._transport.requests), 3)
+
+    def test_circuit_breaker_serves_last_good(self):
+        """ an open circuit fails fast, serving the last good result """
+        self._service.get_station_metadata('787:MT:SNTL')
+        self._transport.fail_requests = 100
+        for _ in range(2):
+            meta = self._service.get_station_metadata('787:MT:SNTL')
+            self.assertEqual(meta['name'], 'Fake Site 787')
+        self.assertEqual(self._breaker.state, CircuitBreaker.OPEN)
+        requests = len(self._transport.requests)
+        self.assertEqual(self._service.get_station_metadata('787:MT:SNTL')['name'],
+                         'Fake Site 787')
+        self.assertIsNone(self._service.get_station_metadata('932:MT:SNTL'))
+        self.assertEqual(len(self._transport.requests), requests)
+
+    def test_connect_failure_opens_circuit(self):
+        """ an unreachable WSDL is retried, then the circuit fails fast """
+        self._transport.fail_loads = 100
+        for _ in range(4):
+            self.assertIsNone(self._service.get_station_metadata('787:MT:SNTL'))
+        self.assertEqual(self._breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self._transport.loads, 6)  # two calls of three attempts
+        self.assertFalse(self._service.is_connected())
+
+    def test_local_error_leaves_circuit(self):
+        """ a bad call is raised without counting against the service """
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                self._service._call('noSuchOperation')
+        self.assertEqual(self._breaker.state, CircuitBreaker.CLOSED)
+        self._breaker._opened = time.monotonic() - 61  # reset_timeout passed
+        with self.assertRaises(Exception):
+            self._service._call('noSuchOperation')  # the trial call
+        self.assertTrue(self._breaker.allow())  # the next caller still gets a trial
+
+
+class NRCSDecodeTests(unittest.TestCase):
+    def test_split_batch_response(self):
+        """ missing stations should come back as empty series """
+        station_data = [{'stationTriplet': '787:MT:SNTL',
+                         'values': [{'dateTime': '2019-12-06 01:00', 'value': 12},
+                                    {'dateTime': '2019-12-06 02:00', 'value': None}]}]
+        results = split_batch_response(station_data, ['787:MT:SNTL', '932:MT:SNTL'],
+                                       'SNWD', decode_hourly_data)
+        timestamps, station_data = results[('787:MT:SNTL', 'SNWD')]
+        self.assertEqual(timestamps[1], datetime(2019, 12, 6, 2))
+        self.assertEqual(station_data, [12.0, None])
+        self.assertEqual(results[('932:MT:SNTL', 'SNWD')], ([], []))
+
+    def test_decode_arrays(self):
+        """ array decoding should match list decoding, with NaN gaps """
+        record = {'beginDate': '2016-02-28 00:00:00', 'endDate': '2016-03-01 00:00:00',
+                  'values': [10, None, 12]}
+        dates, values = decode_daily_arrays(record)
+        self.assertEqual(dates.dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(len(dates), 3)
+        self.assertTrue(np.isnan(values[1]))
+        record = {'values': [{'dateTime': '2019-12-06 01:00', 'value': 12},
+                             {'dateTime': '2019-12-06 02:00', 'value': None}]}
+        timestamps, values = decode_hourly_arrays(record)
+        self.assertEqual(list(timestamps), [np.datetime64(stamp) for stamp
+                                            in decode_hourly_data(record)[0]])
+        self.assertEqual(values.dtype, np.float64)
+
+
+class RecordingService:
+    """ stand-in for NRCSService that makes up daily data and records calls """
+    def __init__(self):
+        self.requests = []
+        self.unreported = 0  # newest values the station hasn't reported yet
+
+    def run_concurrent(self, function, items):
+        return [function(item) for item in items]
+
+    def get_station_data(self, request_data, output='lists'):
+        self.requests.append(request_data)
+        begin = datetime.strptime(request_data['beginDate'], '%Y-%m-%d')
+        end = datetime.strptime(request_data['endDate'], '%Y-%m-%d')
+        dates = [begin + timedelta(days=i) for i in range((end - begin).days + 1)]
+        values = [float(date.day) for date in dates]
+        for idx in range(max(len(values) - self.unreported, 0), len(values)):
+            values[idx] = None
+        return dates, values
+
+
+class SnotelStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._store = SnotelStore(':memory:')
+        self._service = RecordingService()
+
+    def test_sync_only_fetches_new_data(self):
+        """ a second sync should only ask for data after the stored range """
+        self._store.sync(self._service, '787:MT:SNTL', ['SNWD'], DAILY,
+                         datetime(2018, 11, 1), datetime(2018, 11, 30))
+        self._store.sync(self._service, '787:MT:SNTL', ['SNWD'], DAILY,
+                         datetime(2018, 11, 1), datetime(2018, 12, 10))
+        self.assertEqual(len(self._service.requests), 2)
+        self.assertEqual(self._service.requests[1]['beginDate'], '2018-12-01')
+        dates, values = self._store.read_series('787:MT:SNTL', 'SNWD', DAILY,
+                                                datetime(2018, 11, 1),
+                                                datetime(2018, 12, 10))
+        self.assertEqual(len(dates), 40)
+        self.assertEqual(values[-1], 10.0)
+
+    def test_sync_refetches_unreported_values(self):
+        """ recent values that came back missing are asked for again """
+        end = latest_complete(DAILY)
+        begin = end - timedelta(days=9)
+        self._service.unreported = 2
+        self._store.sync(self._service, '787:MT:SNTL', ['SNWD'], DAILY, begin, end)
+        self.assertEqual(self._store.synced_range('787:MT:SNTL', 'SNWD', DAILY),
+                         (begin, end - timedelta(days=2)))
+        self._service.unreported = 0
+        self._store.sync(self._service, '787:MT:SNTL', ['SNWD'], DAILY, begin, end)
+        self.assertEqual(self._service.requests[1]['beginDate'],
+                         (end - timedelta(days=1)).strftime('%Y-%m-%d'))
+        dates, values = self._store.read_series('787:MT:SNTL', 'SNWD', DAILY, begin, end)
+        self.assertEqual(len(dates), 10)
+        self.assertNotIn(None, values)
+        self.assertEqual(self._store.synced_range('787:MT:SNTL', 'SNWD', DAILY),
+                         (begin, end))
+
+    def test_synced_range_is_cached(self):
+        """ a range that is already stored doesn't hit the network """
+        for _ in range(2):
+            self._store.get_series(self._service, '787:MT:SNTL', 'WTEQ', DAILY,
+                                   datetime(2018, 11, 1), datetime(2018, 11, 30))
+        self.assertEqual(len(self._service.requests), 1)
+
+
+class BackfillTests(unittest.TestCase):
+    def setUp(self):
+        self._transport = FakeAWDBTransport()
+        self._service = NRCSService('test.log', transport=self._transport,
+                                    retry_policy=RetryPolicy(attempts=1))
+        self._store = SnotelStore(':memory:')
+
+    def test_stream_series(self):
+        """ a long range comes back as consecutive chunks """
+        chunks = list(stream_series(self._service, '787:MT:SNTL', 'SNWD', DAILY,
+                                    datetime(2010, 1, 1), datetime(2010, 12, 31),
+                                    timedelta(days=100), concurrent=True))
+        self.assertEqual([len(chunk[2]) for chunk in chunks], [100, 100, 100, 65])
+        self.assertEqual(chunks[-1][1], datetime(2010, 12, 31))
+        self.assertEqual(len(self._transport.requests), 4)
+
+    def test_backfill_resumes(self):
+        """ an interrupted backfill picks up after the last written chunk """
+        written = []
+        write_chunk = self._store.write_chunk
+
+        def interrupt(*args, **kwargs):
+            write_chunk(*args, **kwargs)
+            written.append(args[3])
+            if len(written) == 3:
+                self._transport.fail_requests = 100
+
+        with mock.patch.object(self._store, 'write_chunk', side_effect=interrupt):
+            with self.assertRaises(IOError):
+                backfill(self._service, self._store, '787:MT:SNTL', ['SNWD'], DAILY,
+                         datetime(2010, 1, 1), datetime(2010, 12, 31), timedelta(days=30))
+        self.assertEqual(self._store.synced_range('787:MT:SNTL', 'SNWD', DAILY),
+                         (datetime(2010, 1, 1), written[-1][1]))
+        self._transport.fail_requests = 0
+        requests = len(self._transport.requests)
+        chunks = backfill(self._service, self._store, '787:MT:SNTL', ['SNWD'], DAILY,
+                          datetime(2010, 1, 1), datetime(2010, 12, 31), timedelta(days=30))
+        self.assertEqual(chunks, 10)
+        self.assertEqual(len(self._transport.requests), requests + 10)
+        dates, values = self._store.read_series('787:MT:SNTL', 'SNWD', DAILY,
+                                                datetime(2010, 1, 1), datetime(2010, 12, 31))
+        self.assertEqual(len(dates), 365)
+
+
+class HourlyWindowTests(unittest.TestCase):
+    def setUp(self):
+        self._transport = FakeAWDBTransport()
+        self._service = NRCSService('test.log', transport=self._transport)
+        self._window = HourlyWindow()
+        self._sites = ['787:MT:SNTL', '932:MT:SNTL']
+
+    def test_delta_refresh(self):
+        """ later refreshes only ask for the hours after the last observation """
+        self.assertTrue(self._window.refresh(self._service, self._sites, ['SNWD', 'TOBS'],
+                                             datetime(2019, 12, 8, 23, 30)))
+        timestamps, values = self._window.series('932:MT:SNTL', 'TOBS')
+        self.assertEqual(len(timestamps), 25)
+        self._transport.requests.clear()
+        self.assertTrue(self._window.refresh(self._service, self._sites, ['SNWD', 'TOBS'],
+                                             datetime(2019, 12, 9, 0, 10)))
+        arguments = self._transport.requests[0][1]
+        self.assertEqual((arguments['beginDate'][0][:10], arguments['beginHour'][0]),
+                         ('2019-12-09', '0'))
+        self.assertEqual(self._window.last_observed('787:MT:SNTL', 'SNWD'),
+                         datetime(2019, 12, 9))
+        self.assertEqual(len(self._window.series('932:MT:SNTL', 'TOBS')[0]), 25)
+
+    def test_failed_refresh_keeps_values(self):
+        """ the last observations carry over a failed refresh """
+        self._window.refresh(self._service, self._sites, ['SNWD'], datetime(2019, 12, 8, 12))
+        latest = self._window.latest('787:MT:SNTL', 'SNWD')
+        self._transport.fail_requests = 100
+        self.assertFalse(self._window.refresh(self._service, self._sites, ['SNWD'],
+                                              datetime(2019, 12, 8, 13)))
+        self.assertEqual(self._window.latest('787:MT:SNTL', 'SNWD'), latest)
+
+
+class DownsampleTests(unittest.TestCase):
+    def setUp(self):
+        self._x = np.arange('2010-01-01', '2020-01-01', dtype='datetime64[h]').astype('datetime64[ns]')
+        self._y = np.sin(np.arange(len(self._x)) / 500.0)
+        self._y[::97] = np.nan
+        self._y[12345] = 50.0  # a spike that has to survive
+
+    def test_methods_keep_peaks(self):
+        for method in ('minmax', 'lttb'):
+            x, y = downsample(self._x, self._y, 2000, method)
+            self.assertLessEqual(len(x), 2002)
+            self.assertEqual(np.nanmax(y), 50.0)
+            self.assertTrue(np.all(np.diff(x) > np.timedelta64(0)))
+
+    def test_zoomed_range(self):
+        """ a zoomed in window is cut out before downsampling """
+        x_range = visible_range({'xaxis.range[0]': '2015-01-01 00:00',
+                                 'xaxis.range[1]': '2015-01-03'})
+        x, y = downsample_range(self._x, self._y, x_range)
+        self.assertEqual(len(x), 51)  # full resolution, plus a point either side
+        self.assertIsNone(visible_range({'xaxis.autorange': True}))
+
+
+class RegionTests(unittest.TestCase):
+    def setUp(self):
+        self._transport = FakeAWDBTransport(station_count=100)
+        self._service = NRCSService('test.log', transport=self._transport)
+        self._catalog = StationCatalog(':memory:')
+
+    def test_region_snapshot(self):
+        """ a whole region is fetched in one batch and stored column by column """
+        now = datetime(2019, 12, 8, 12)
+        stations = region_stations(self._catalog, self._service, ['MT'], ['SNTL'])
+        self.assertEqual(len(region_stations(self._catalog, self._service, ['MT'], ['SNTL'])),
+                         100)  # the second search is answered by the catalog
+        self.assertEqual(len(self._transport.requests), 2)
+        self.assertEqual(len(region_stations(self._catalog, self._service, ['MT', 'ID'],
+                                             ['SNTL'])), 200)  # only ID is fetched
+        self.assertEqual(len(self._transport.requests), 4)
+        window = HourlyWindow()
+        window.refresh(self._service, [meta['stationTriplet'] for meta in stations],
+                       ['SNWD', 'WTEQ', 'TOBS'], now)
+        df = build_region_frame(stations, window, now)
+        self.assertEqual(len(df), 100)
+        self.assertEqual(df['depth'].dtype, np.float64)
+        figure = build_region_map(df, {'date': '2019-12-08 12:00:00'})
+        self.assertEqual(len(figure['data'][0]['lat']), 100)
+
+    def test_query_page(self):
+        """ the table only gets one page, after filtering and sorting the whole frame """
+        count = 2000
+        df = pd.DataFrame({'name': ['Site {}'.format(idx) for idx in range(count)],
+                           'state': ['MT', 'ID'] * (count // 2),
+                           'depth': np.where(np.arange(count) % 10 == 0, np.nan,
+                                             np.arange(count, dtype=np.float64))})
+        records, page_count = query_page(df, 0, 25)
+        self.assertEqual((len(records), page_count), (25, 80))
+        self.assertIsNone(records[0]['depth'])
+        records, page_count = query_page(df, 1, 25, [{'column_id': 'depth', 'direction': 'desc'}],
+                                         '{state} = ID && {depth} >= 1000')
+        self.assertEqual(page_count, 20)
+        self.assertEqual([row['depth'] for row in records[:2]], [1949.0, 1947.0])
+        records, page_count = query_page(df, 0, 25, None, '{name} contains "site 199"')
+        self.assertEqual(len(records), 11)
+        records, page_count = query_page(df, 0, 25, [], '{name} > 5')  # text column
+        self.assertEqual(page_count, 80)
+        records, page_count = query_page(df, 0, 25, [], '{name} <= "Site 1"')
+        self.assertEqual([row['name'] for row in records], ['Site 0', 'Site 1'])
+
+
+class QCTests(unittest.TestCase):
+    def test_qc_series(self):
+        """ duplicates, out of order rows, bad values and gaps come out cleaned and flagged """
+        timestamps = np.arange('2019-12-01T00', '2019-12-02T00',
+                               dtype='datetime64[h]').astype('datetime64[ns]')
+        values = 40 + np.arange(24) * 0.2
+        values[5] = 90.0  # depth sensor spike
+        values[8:10] = np.nan  # short gap
+        values[12:20] = np.nan  # long gap
+        values[21] = -5.0
+        timestamps = np.concatenate([timestamps[::-1], timestamps[3:4], [np.datetime64('NaT')]])
+        values = np.concatenate([values[::-1], [np.nan], [1.0]])
+        grid, cleaned, flags = qc_series(timestamps, values, 'SNWD')
+        self.assertEqual(len(grid), 24)
+        self.assertTrue(np.all(np.diff(grid) == np.timedelta64(1, 'h')))
+        self.assertEqual(cleaned[3], 40.6)  # the reported duplicate wins
+        self.assertEqual(flags[5], QC_SPIKE | QC_FILLED)
+        self.assertAlmostEqual(cleaned[5], 41.0)
+        self.assertEqual(flags[21], QC_RANGE | QC_FILLED)
+        self.assertEqual(list(flags[8:10]), [QC_FILLED] * 2)
+        self.assertTrue(np.all(flags[12:20] == QC_MISSING))
+        self.assertTrue(np.all(np.isnan(cleaned[12:20])))
+        self.assertEqual(flags[0], 0)
+
+    def test_step_change(self):
+        """ a jump that sticks is flagged once, not every sample after it """
+        timestamps = np.arange('2019-12-01T00', '2019-12-01T12', dtype='datetime64[h]')
+        values = np.where(np.arange(12) < 6, 20.0, 5.0)
+        grid, cleaned, flags = qc_series(timestamps, values, 'WTEQ', max_gap=0)
+        self.assertEqual(list(np.flatnonzero(flags)), [6])
+        self.assertEqual(flags[6], QC_RATE | QC_MISSING)
+
+
+class StormEventTests(unittest.TestCase):
+    def test_storm_cycle(self):
+        """ onset, alerts, rain on snow, end and a rejected spike from a synthetic storm """
+        state = StationState('787:MT:SNTL')
+        start = np.datetime64('2019-12-01T00', 'h')
+        depth = ([40.0] * 6 + [40.0 + idx for idx in range(1, 9)] + [48.0] * 14
+                 + [80.0] + [48.0] * 2)
+        swe = [10.0] * 6 + [10.0 + 0.1 * idx for idx in range(1, 9)] + [10.8] * 17
+        temp = [20.0] * 10 + [34.0] + [20.0] * 20
+        events = []
+        for hour in range(len(depth)):
+            events.extend((hour, event['kind'], event['value']) for event in
+                          state.update(start + hour, depth[hour], swe[hour], temp[hour]))
+        self.assertEqual(events, [(8, 'storm_onset', 3.0), (10, 'swe_increment', 0.5),
+                                  (10, 'rain_on_snow', 0.1), (11, 'new_snow_24h', 6.0),
+                                  (25, 'storm_end', 8.0), (28, 'sensor_spike', 32.0)])
+        self.assertEqual(state.update(start + 5, 50.0, 11.0, 20.0), [])  # already seen
+        resumed = StationState('787:MT:SNTL', json.loads(json.dumps(state.to_dict())))
+        self.assertEqual(resumed.new_snow(resumed.last_time), {'24h': 6.0, '72h': 8.0})
+        self.assertAlmostEqual(resumed.swe - resumed.swe_min.minimum(resumed.last_time), 0.6)
+        self.assertIsNone(resumed.storm)
+
+    def test_incremental_ingest(self):
+        """ a refresh only feeds the hours each station hasn't seen """
+        service = NRCSService('test.log', transport=FakeAWDBTransport())
+        sites = ['787:MT:SNTL', '932:MT:SNTL']
+        window = HourlyWindow()
+        engine = StormEngine(EventLog(':memory:'))
+        window.refresh(service, sites, ['SNWD', 'WTEQ', 'TOBS'], datetime(2019, 12, 8, 12))
+        engine.ingest_window(window, sites)
+        self.assertEqual(engine.ingest_window(window, sites), [])
+        with mock.patch.object(StationState, 'update', autospec=True,
+                               return_value=[]) as update:
+            window.refresh(service, sites, ['SNWD', 'WTEQ', 'TOBS'],
+                           datetime(2019, 12, 8, 13))
+            engine.ingest_window(window, sites)
+        self.assertEqual(update.call_count, 2)  # one new hour per station
+
+
+class SeasonDataTests(unittest.TestCase):
+    def setUp(self):
+        self._service = RecordingService()
+        self._cache_dir = tempfile.mkdtemp()
+        patches = [mock.patch('nrcs_get_data.get_service', return_value=self._service),
+                   mock.patch('nrcs_get_data.get_store', return_value=SnotelStore(':memory:'))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(shutil.rmtree, self._cache_dir)
+
+    def test_season_dates_skip_leap_day(self):
+        """ leap and non-leap seasons should line up """
+        self.assertEqual(len(season_dates(2016)), SEASON_DAYS)
+        self.assertEqual(len(season_dates(2017)), SEASON_DAYS)
+        self.assertEqual(season_dates(2016)[120], np.datetime64('2016-03-01'))
+
+    def test_load_seasons(self):
+        """ seasons are aligned and memoized on disk """
+        seasons = load_seasons('787:MT:SNTL', [2016, 2017], ['SNWD'], self._cache_dir)
+        self.assertEqual(seasons['SNWD'].shape, (2, SEASON_DAYS))
+        self.assertEqual(seasons['SNWD'].dtype, np.float32)
+        self.assertEqual(seasons['SNWD'][0, 120], 1.0)  # Mar 1 in a leap year
+        requests = len(self._service.requests)
+        seasons = load_seasons('787:MT:SNTL', [2016, 2017], ['SNWD'], self._cache_dir)
+        self.assertEqual(len(self._service.requests), requests)
+        self.assertEqual(len(seasons.to_frame()), 2 * SEASON_DAYS)
+
+
+class ClimatologyTests(unittest.TestCase):
+    def test_season_statistics(self):
+        swe = np.tile(np.arange(SEASON_DAYS, dtype=np.float32), (3, 1))
+        swe[1] *= 2
+        swe[2, :] = np.nan
+        seasons = SeasonData('787:MT:SNTL', [2017, 2018, 2019], {'WTEQ': swe})
+        climatology = Climatology.from_seasons(seasons)
+        self.assertEqual(climatology.median('WTEQ')[10], 15.0)
+        self.assertEqual(climatology.percent_of_median('WTEQ', 30.0, datetime(2020, 11, 11)),
+                         200.0)
+        self.assertIsNone(climatology.percent_of_median('WTEQ', 30.0, datetime(2020, 7, 1)))
+        self.assertEqual(list(climatology['peak_day']), [SEASON_DAYS - 1] * 2 + [-1])
+        self.assertEqual(climatology.median_peak_date(), 'May 15')
+
+    def test_storm_metrics(self):
+        """ depth gains are new snow, depth losses without melt are settlement """
+        depth = np.array([10.0, 14.0, 20.0, 18.0, 15.0])
+        swe = np.array([2.0, 2.5, 3.0, 3.0, 2.5])
+        metrics = storm_metrics(depth, swe, {'24h': 1, '48h': 2})
+        np.testing.assert_array_equal(metrics['new_48h'], [np.nan, np.nan, 10.0, 6.0, 0.0])
+        np.testing.assert_array_equal(metrics['settlement_24h'], [np.nan, 0.0, 0.0, 2.0, 0.0])
+
+    def test_artifact_is_reused(self):
+        """ the climatology is only rebuilt when another season completes """
+        service = RecordingService()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch('nrcs_get_data.get_service', return_value=service), \
+                mock.patch('nrcs_get_data.get_store', return_value=SnotelStore(':memory:')):
+            for _ in range(2):
+                climatology = load_climatology('787:MT:SNTL', ['WTEQ'], 2, cache_dir,
+                                               today=datetime(2019, 6, 1))
+            self.assertEqual(list(climatology.years), [2018, 2019])
+            self.assertEqual(len(service.requests), 2)
+            climatology = load_climatology('787:MT:SNTL', ['WTEQ'], 2, cache_dir,
+                                           today=datetime(2020, 6, 1))
+            self.assertEqual(list(climatology.years), [2019, 2020])
+            self.assertEqual(len(service.requests), 3)
+
+    def test_current_season(self):
+        """ the season in progress is folded in once a day, the history isn't rebuilt """
+        service = RecordingService()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with mock.patch('nrcs_get_data.get_service', return_value=service), \
+                mock.patch('nrcs_get_data.get_store', return_value=SnotelStore(':memory:')):
+            climatology = load_climatology('787:MT:SNTL', ['SNWD', 'WTEQ'], 2, cache_dir,
+                                           today=datetime(2020, 1, 10))
+            self.assertEqual((climatology.current('year'), climatology.current('day')),
+                             (2020, 70))
+            self.assertEqual(len(climatology['max_settlement_7d']), 2)
+            self.assertIsNotNone(climatology.current('max_settlement_7d'))
+            requests = len(service.requests)
+            load_climatology('787:MT:SNTL', ['SNWD', 'WTEQ'], 2, cache_dir,
+                             today=datetime(2020, 1, 10))
+            self.assertEqual(len(service.requests), requests)
+            climatology = load_climatology('787:MT:SNTL', ['SNWD', 'WTEQ'], 2, cache_dir,
+                                           today=datetime(2020, 1, 11))
+            self.assertEqual(climatology.current('day'), 71)
+            self.assertEqual(list(climatology.years), [2018, 2019])
+            self.assertEqual(climatology.current('max_new_24h'), 1.0)
+
+
+class StubPage:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+
+class ForecastCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._cache = ForecastCache(ttl=0)
+        self._cache._session = mock.Mock()
+
+    def test_conditional_refresh(self):
+        """ an unchanged page is re-checked but not re-parsed """
+        page = StubPage(200, b'<html><p>hi</p><pre>forecast</pre></html>', {'ETag': '"v1"'})
+        self._cache._session.get.return_value = page
+        first = self._cache.get('http://forecast')
+        self.assertEqual(first.text, 'forecast')
+        self._cache._session.get.return_value = StubPage(304)
+        second = self._cache.get('http://forecast')
+        self.assertIs(second, first)
+        headers = self._cache._session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+
+
+TABULAR_PRODUCT = """
+AVALANCHE WEATHER GUIDANCE
+NATIONAL WEATHER SERVICE MISSOULA MT
+330 PM MST SAT DEC 21 2019
+
+                      TONIGHT    SUN        SUN NIGHT
+CLOUD COVER           OVC        OVC        MCLDY
+SNOW LEVEL            3500       4000       3000
+WIND 1 MILE           SW 25G40   W 20       NW 10
+MID SLOPE (6000 FT)
+  MAX/MIN TEMP        22         30         18
+  SNOW AMOUNT         4-6        2-4        0-1
+"""
+NARRATIVE_PRODUCT = """
+ZONE FORECAST PRODUCT
+NATIONAL WEATHER SERVICE MISSOULA MT
+915 AM MST MON DEC 23 2019
+
+.TODAY...Snow. Snow level 3500 feet. New snow accumulation of 3 to
+5 inches. Highs in the 20s. Southwest winds 10 to 20 mph.
+.TONIGHT...Mostly cloudy. Lows around 10.
+$$
+"""
+
+
+class ForecastProductTests(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+        self._zones = [{'id': 'whitefish', 'name': 'Whitefish Forecast', 'url': 'http://wht'}]
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    def test_tabular(self):
+        """ each column of a guidance table becomes a period """
+        product = parse_product(TABULAR_PRODUCT)
+        self.assertEqual(product['issued'], '330 PM MST SAT DEC 21 2019')
+        self.assertEqual(product['issued_at'], '2019-12-21T15:30:00')
+        self.assertEqual(product['title'], 'AVALANCHE WEATHER GUIDANCE')
+        self.assertEqual([period['name'] for period in product['periods']],
+                         ['TONIGHT', 'SUN', 'SUN NIGHT'])
+        tonight, sun, night = product['periods']
+        self.assertEqual(tonight['snow_level'], '3500')
+        self.assertEqual(tonight['wind'], 'SW 25G40')
+        self.assertEqual(sun['accumulation'], '2-4')
+        self.assertEqual(night['temps'], '18')
+        self.assertEqual(night['values']['MID SLOPE (6000 FT) SNOW AMOUNT'], '0-1')
+
+    def test_narrative(self):
+        """ snow level, snow and wind are picked out of each paragraph """
+        today, tonight = parse_product(NARRATIVE_PRODUCT)['periods']
+        self.assertEqual(today['name'], 'TODAY')
+        self.assertEqual(today['snow_level'], '3500 feet')
+        self.assertEqual(today['accumulation'], 'New snow accumulation of 3 to 5 inches')
+        self.assertEqual(today['wind'], 'Southwest winds 10 to 20 mph')
+        self.assertEqual(today['temps'], 'Highs in the 20s')
+        self.assertIsNone(tonight['snow_level'])
+        self.assertEqual(tonight['temps'], 'Lows around 10')
+
+    def test_parsed_once_per_issuance(self):
+        """ a product is parsed and shared once per issuance """
+        backend = FileBackend(os.path.join(self._cache_dir, 'shared'))
+        products = ForecastProducts(self._zones, backend, self._cache_dir)
+        page = mock.Mock()
+        page.get_text.return_value = TABULAR_PRODUCT
+        with mock.patch('forecast_products.get_forecast', return_value=page), \
+                mock.patch('forecast_products.parse_product',
+                           side_effect=parse_product) as parse:
+            first = products.refresh('whitefish')
+            self.assertIs(products.refresh('whitefish'), first)
+            self.assertEqual(parse.call_count, 1)
+            # another process picks up the shared copy without parsing
+            other = ForecastProducts(self._zones, backend, None)
+            self.assertEqual(other.version('whitefish'), '330 PM MST SAT DEC 21 2019')
+            self.assertEqual(other.refresh('whitefish')['periods'], first['periods'])
+            self.assertEqual(parse.call_count, 1)
+            page.get_text.return_value = TABULAR_PRODUCT.replace('330 PM', '400 AM')
+            self.assertEqual(products.refresh('whitefish')['issued'],
+                             '400 AM MST SAT DEC 21 2019')
+            self.assertEqual(parse.call_count, 2)
+        with open(os.path.join(self._cache_dir, 'whitefish.json')) as product_file:
+            self.assertEqual(json.load(product_file)['issued'], '400 AM MST SAT DEC 21 2019')
+
+    def test_version_polls(self):
+        """ version only reads the version key until the product changes """
+        backend = FileBackend(os.path.join(self._cache_dir, 'shared'))
+        products = ForecastProducts(self._zones, backend, None)
+        other = ForecastProducts(self._zones, backend, None)
+        page = mock.Mock()
+        text = NARRATIVE_PRODUCT.replace('915 AM MST MON DEC 23 2019\n', '')  # no issuance line
+        page.get_text.return_value = text
+        with mock.patch('forecast_products.get_forecast', return_value=page):
+            products.refresh('whitefish')
+            version = other.version('whitefish')
+            self.assertIsNone(other.latest('whitefish')['issued'])
+            self.assertIsNotNone(version)
+            with mock.patch.object(backend, 'get', wraps=backend.get) as get:
+                self.assertEqual(other.version('whitefish'), version)
+            self.assertEqual([call[0][0] for call in get.call_args_list],
+                             ['forecast-product:whitefish:version'])
+            page.get_text.return_value = text.replace('around 10', 'around 5')
+            products.refresh('whitefish')
+            self.assertNotEqual(other.version('whitefish'), version)
+            self.assertEqual(other.latest('whitefish')['periods'][1]['temps'], 'Lows around 5')
+
+
+class VersionsEndpointTests(unittest.TestCase):
+    def get_versions(self, etag=None):
+        import pow_app
+        headers = {} if etag is None else {'If-None-Match': etag}
+        with pow_app.server.test_request_context('/versions', headers=headers):
+            return pow_app.versions()
+
+    def test_not_modified(self):
+        """ a client with the current versions gets an empty 304 """
+        import pow_app
+        versions = {'summary': 1}
+        pow_app.register_version('test', lambda: versions['summary'])
+        response = self.get_versions()
+        self.assertEqual(response.get_json()['test'], 1)
+        etag = response.headers['ETag']
+        response = self.get_versions(etag)
+        self.assertEqual(response.status_code, 304)  # werkzeug sends no body
+        versions['summary'] = 2
+        self.assertEqual(self.get_versions(etag).get_json()['test'], 2)
+
+
+class RefreshSchedulerTests(unittest.TestCase):
+    def test_single_refresh_thread(self):
+        """ starting twice runs one job, immediately and then every period """
+        runs = []
+        scheduler = RefreshScheduler('test_refresh', 0.05, lambda: runs.append(1))
+        scheduler.start()
+        scheduler.start()
+        time.sleep(0.12)
+        scheduler.stop()
+        self.assertIn(len(runs), (2, 3))
+
+
+class SnapshotStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._backup_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._backup_dir)
+        self._backup = os.path.join(self._backup_dir, 'snapshot.json')
+
+    def test_publish_and_recover(self):
+        """ versions increase and survive a restart """
+        def build_figure(data, info):
+            return {'rows': len(data), 'title': info['date']}
+        store = SnapshotStore(build_figure, self._backup)
+        self.assertIsNone(store.latest())
+        store.publish(pd.DataFrame({'depth': [10.0]}), {'date': 'a'})
+        snapshot = store.publish(pd.DataFrame({'depth': [10.0, 12.0]}), {'date': 'b'})
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(snapshot.figure, {'rows': 2, 'title': 'b'})
+        recovered = SnapshotStore(build_figure, self._backup).latest()
+        self.assertEqual(recovered.version, 2)
+        self.assertEqual(list(recovered.data['depth']), [10.0, 12.0])
+
+
+class FakeRedis:
+    """ in-memory stand-in for the parts of redis.Redis the backend uses """
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key):
+        value, expires = self._values.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, px=None, nx=False, xx=False):
+        exists = self.get(key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        expires = None if px is None else time.time() + px / 1000.0
+        self._values[key] = (value if isinstance(value, bytes) else str(value).encode(), expires)
+        return True
+
+    def delete(self, key):
+        self._values.pop(key, None)
+
+
+class SharedCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._cache_dir)
+        self._backends = [FileBackend(self._cache_dir), RedisBackend(FakeRedis())]
+
+    def test_values_expire(self):
+        for backend in self._backends:
+            backend.set('forecast:a', b'snow', ttl=60)
+            backend.set('forecast:b', b'rain', ttl=0.01)
+            time.sleep(0.02)
+            self.assertEqual(backend.get('forecast:a'), b'snow')
+            self.assertIsNone(backend.get('forecast:b'))
+
+    def test_one_process_holds_a_lease(self):
+        """ a lease can be renewed by its holder but not taken by another process """
+        for backend in self._backends:
+            self.assertTrue(backend.acquire_lease('refresh', 60))
+            self.assertTrue(backend.acquire_lease('refresh', 60))
+            with mock.patch('shared_cache.owner_id', return_value=b'other:1'):
+                self.assertFalse(backend.acquire_lease('refresh', 60))
+                self.assertTrue(backend.acquire_lease('other_refresh', 60))
+
+    def test_one_scheduler_runs(self):
+        runs = []
+        leader = RefreshScheduler('shared_refresh', 60, lambda: runs.append(1),
+                                  self._backends[0])
+        follower = RefreshScheduler('shared_refresh', 60, lambda: runs.append(2),
+                                    FileBackend(self._cache_dir))
+        leader.tick()
+        with mock.patch('shared_cache.owner_id', return_value=b'other:1'):
+            follower.tick()
+        self.assertEqual(runs, [1])
+
+    def test_shared_snapshot(self):
+        """ a snapshot published by one process is served by the others """
+        def build_figure(data, info):
+            return {'rows': len(data)}
+        for backend in self._backends:
+            first = SnapshotStore(build_figure, backend=backend, key='summary')
+            second = SnapshotStore(build_figure, backend=backend, key='summary')
+            first.publish(pd.DataFrame({'depth': [10.0]}), {'date': 'a'})
+            self.assertEqual(second.latest().version, 1)
+            second.publish(pd.DataFrame({'depth': [10.0, 12.0]}), {'date': 'b'})
+            self.assertEqual(first.latest().version, 2)
+            self.assertEqual(first.latest().figure, {'rows': 2})
+
+    def test_shared_forecast(self):
+        """ only one process downloads a page per ttl """
+        caches = [ForecastCache(backend=self._backends[1]) for _ in range(2)]
+        for cache in caches:
+            cache._session = mock.Mock()
+        caches[0]._session.get.return_value = StubPage(200, b'<pre>forecast</pre>')
+        self.assertEqual(caches[0].get('http://forecast').text, 'forecast')
+        self.assertEqual(caches[1].get('http://forecast').text, 'forecast')
+        caches[1]._session.get.assert_not_called()
+
+
+class LoggingTests(unittest.TestCase):
+    def setUp(self):
+        self._log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._log_dir)
+
+    def test_async_json_records(self):
+        """ queued records are written by the writer thread with their extras """
+        nrcs_logging_utilities.configure(async_mode=True, json_format=True)
+        self.addCleanup(nrcs_logging_utilities.configure, json_format=False)
+        logfile = os.path.join(self._log_dir, 'async.log')
+        logger = nrcs_logging_utilities.attach_logger(logfile, 'async_test', logging.INFO)
+        logger.info('getData took %.3f s', 0.25, extra={'operation': 'getData',
+                                                        'duration': 0.25})
+        try:
+            raise ValueError('bad value')
+        except ValueError as caught_exception:
+            logger.exception(caught_exception)
+        nrcs_logging_utilities.stop_logging()
+        with open(logfile) as log:
+            record, failure = [json.loads(line) for line in log]
+        self.assertEqual(record['message'], 'getData took 0.250 s')
+        self.assertEqual((record['operation'], record['duration']), ('getData', 0.25))
+        self.assertIn('ValueError: bad value', failure['exception'])
+
+    def test_root_logger(self):
+        """ root logger records go through the rate limit, once each """
+        nrcs_logging_utilities.configure(async_mode=False)
+        self.addCleanup(nrcs_logging_utilities.configure, async_mode=True)
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        self.addCleanup(setattr, root, 'handlers', handlers)
+        self.addCleanup(root.setLevel, level)
+        self.addCleanup(setattr, nrcs_logging_utilities, '_root_attached', False)
+        nrcs_logging_utilities._root_attached = False
+        logfile = os.path.join(self._log_dir, 'root.log')
+        nrcs_logging_utilities.attach_root_logger(logfile)
+        named = nrcs_logging_utilities.attach_logger(logfile, 'root_test', logging.INFO)
+        named.info('named record')
+        for _ in range(10):
+            try:
+                raise ValueError('flapping upstream')
+            except ValueError as caught_exception:
+                logging.exception(caught_exception)
+        nrcs_logging_utilities.file_handler(logfile, logging.INFO).flush()
+        with open(logfile) as log:
+            text = log.read()
+        self.assertEqual(text.count('named record'), 1)
+        self.assertEqual(text.count('Traceback'), nrcs_logging_utilities.EXCEPTION_BURST)
+
+    def test_rate_limited_exceptions(self):
+        """ repeats of an exception past the burst are dropped and counted """
+        rate_limit = nrcs_logging_utilities.RateLimitFilter(burst=2, period=60)
+        records = []
+        for _ in range(4):
+            try:
+                raise ValueError('bad value')
+            except ValueError:
+                record = logging.LogRecord('test', logging.ERROR, __file__, 1, 'failed',
+                                           None, sys.exc_info())
+                records.append(rate_limit.filter(record))
+        self.assertEqual(records, [True, True, False, False])
+        rate_limit._windows = {key: (started - 60, count, dropped) for key, (started, count, dropped)
+                               in rate_limit._windows.items()}
+        self.assertTrue(rate_limit.filter(record))
+        self.assertIn('2 similar exceptions suppressed', record.msg)
+
+
+class MetricsTests(unittest.TestCase):
+    def test_render_prometheus(self):
+        """ histograms render cumulative buckets, +Inf, sum and count """
+        histogram = app_metrics.Histogram('test_seconds', 'test latency', buckets=(0.1, 1.0))
+        histogram.observe(0.05, operation='getData')
+        histogram.observe(5.0, operation='getData')
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{operation="getData",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{operation="getData",le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count{operation="getData"} 2', lines)
+
+    def test_disabled(self):
+        """ nothing is recorded while metrics are off """
+        counter = app_metrics.Counter('test_total', 'test counter')
+        app_metrics.disable()
+        self.addCleanup(app_metrics.enable)
+        counter.inc()
+        self.assertEqual(counter.value(), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+@brief app layout for the regional snowpack page
+@author: Graham Riches
+@date: Sun Oct 18 10:57:34 2026
+@description
+    Every station in the configured region on a map, plus a table that is
+    filtered, sorted and paged on the server. The map is built once per
+    snapshot and only sent when the snapshot changes, and the table only ever
+    sends one page, so callback payloads stay the same size however many
+    stations the region covers.
+"""
+
+import json
+import logging
+import dash_core_components as dcc
+import dash_html_components as html
+import dash_bootstrap_components as dbc
+import dash_table
+from dash import Patch
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+from datetime import datetime
+
+from pow_app import app, register_version
+from nrcs_service import get_service
+from nrcs_station_catalog import get_catalog
+from nrcs_hourly_window import HourlyWindow
+from nrcs_storm_events import StormEngine, get_event_log
+from nrcs_region import (REGION_ELEMENTS, region_stations, build_region_frame,
+                         build_region_map, query_page)
+from refresh_scheduler import get_scheduler
+from snapshot_store import SnapshotStore
+from shared_cache import get_backend
+import app_metrics
+
+REFRESH_PERIOD = 120  # seconds, matches the page update interval
+PAGE_SIZE = 25
+REFRESH_SECONDS = app_metrics.histogram('region_refresh_seconds',
+                                        'region refresh (run_region_query) duration')
+TABLE_COLUMNS = [{'name': 'Site', 'id': 'name'},
+                 {'name': 'State', 'id': 'state'},
+                 {'name': 'Elevation', 'id': 'elevation', 'type': 'numeric'},
+                 {'name': 'Snow Depth', 'id': 'depth', 'type': 'numeric'},
+                 {'name': 'SWE', 'id': 'swe', 'type': 'numeric'},
+                 {'name': 'SWE % Median', 'id': 'swe_pct', 'type': 'numeric'},
+                 {'name': 'Temperature', 'id': 'temp', 'type': 'numeric'},
+                 {'name': 'Observed', 'id': 'observed'}]
+
+layout = html.Div(children=[
+         html.Div(dbc.Row([
+                 dbc.Col(html.Img(src='/static/logo.png', height="70px")),
+                 dbc.Col(dbc.NavbarSimple(children=[
+                         dbc.NavItem(dbc.NavLink('Summary', href='/summary')),
+                         dbc.NavItem(dbc.NavLink('Region', href='/region')),
+                         ],
+                        brand='Montana Powder Tracker',
+                        brand_href='#',
+                        color='dark',
+                        dark=True))
+                         ])),
+        html.Div([
+                  html.H1('Region',
+                          style={'width': '100%', 'display': 'inline-block',
+                                 'text-align': 'center', 'padding': 10})
+                 ]),
+        html.Div(
+                 dcc.Graph(id='region-map', style={'margin': 5}),
+                 style={'width': '100%', 'border-radius': 10, 'padding': 5}
+                ),
+        html.Div(
+                 dash_table.DataTable(
+                         id='region-table',
+                         columns=TABLE_COLUMNS,
+                         page_current=0,
+                         page_size=PAGE_SIZE,
+                         page_action='custom',
+                         sort_action='custom',
+                         sort_mode='multi',
+                         sort_by=[],
+                         filter_action='custom',
+                         filter_query=''),
+                 style={'width': '100%', 'border-radius': 10, 'padding': 5}
+                ),
+        html.Div(
+                dcc.Interval(
+                        id='region-interval',
+                        interval=120000,  # update every two minutes
+                        n_intervals=0)
+                ),
+        dcc.Store(id='region-version'),
+        dcc.Store(id='region-polled', data=['region']),
+        dcc.Store(id='region-available')
+        ])
+
+
+region_snapshots = SnapshotStore(build_region_map, 'cache/region_snapshot.json',
+                                 backend=get_backend(), key='region')
+region_window = HourlyWindow()
+
+
+register_version('region', lambda: getattr(region_snapshots.latest(), 'version', None))
+
+app.clientside_callback(
+    ClientsideFunction(namespace='pow', function_name='poll_versions'),
+    [Output('region-available', 'data')],
+    [Input(component_id='region-interval', component_property='n_intervals')],
+    [State('region-polled', 'data'), State('region-available', 'data')])
+
+
+def patch_region_map(figure):
+    """ only send the parts of the map that change between snapshots """
+    trace = figure['data'][0]
+    patched = Patch()
+    for name in ('lat', 'lon', 'text'):
+        patched['data'][0][name] = trace[name]
+    patched['data'][0]['marker']['color'] = trace['marker']['color']
+    patched['layout']['title'] = figure['layout']['title']
+    return patched
+
+
+@app.callback([Output('region-map', 'figure'), Output('region-version', 'data')],
+              [Input('region-available', 'data')],
+              [State('region-version', 'data')])
+def get_region_map(available, version):
+    snapshot = region_snapshots.latest()
+    if snapshot is None or snapshot.version == version:
+        raise PreventUpdate  # nothing new for this client
+    if version is None:
+        return snapshot.figure, snapshot.version  # first load, send it all
+    return patch_region_map(snapshot.figure), snapshot.version
+
+
+@app.callback([Output('region-table', 'data'), Output('region-table', 'page_count')],
+              [Input('region-table', 'page_current'),
+               Input('region-table', 'page_size'),
+               Input('region-table', 'sort_by'),
+               Input('region-table', 'filter_query'),
+               Input('region-version', 'data')])
+def get_region_table(page_current, page_size, sort_by, filter_query, version):
+    """ serve one page of the latest snapshot """
+    snapshot = region_snapshots.latest()
+    if snapshot is None:
+        raise PreventUpdate
+    return query_page(snapshot.data, page_current or 0, page_size or PAGE_SIZE,
+                      sort_by, filter_query)
+
+
+@app_metrics.timed(REFRESH_SECONDS)
+def run_region_query():
+    """
+    Query the latest data for every station in the region, run periodically
+    by the background scheduler
+    """
+    with open('config.json') as config_file:
+        region = json.load(config_file)['region']
+    nrcs_service = get_service('powtracker.log')
+    today = datetime.now()
+    stations = region_stations(get_catalog(), nrcs_service, region['states'],
+                               region['networks'])
+    if not stations:
+        logging.warning('no stations found for region {}'.format(region))
+        return
+    triplets = [meta['stationTriplet'] for meta in stations]
+    if not region_window.refresh(nrcs_service, triplets, REGION_ELEMENTS, today):
+        logging.warning('NRCS query failed, keeping the last region snapshot')
+        return
+    try:
+        StormEngine(get_event_log()).ingest_window(region_window, triplets)
+    except Exception as caught_exception:
+        logging.exception(caught_exception)
+    df = build_region_frame(stations, region_window, today)
+    latest = {'date': datetime.strftime(today, '%Y-%m-%d %H:%M:%S'),
+              'stations': len(df)}
+    region_snapshots.publish(df, latest)
+
+
+@app.server.before_request
+def start_refresh():
+    """ make sure the region refresh is running in this server process """
+    get_scheduler('region_refresh', REFRESH_PERIOD, run_region_query, get_backend()).start()
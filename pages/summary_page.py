@@ -8,27 +8,86 @@
 
 import os
 import json
+import logging
+import functools
 import flask
-import pandas as pd
-import numpy as np
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+import dash_table
+from dash import Patch
+from dash.dependencies import Input, Output, State, ClientsideFunction, MATCH
+from dash.exceptions import PreventUpdate
 from datetime import datetime, timedelta
 
-from pow_app import app
-from nrcs_service import NRCSService
-from web_scraper import WebScraper
+from pow_app import app, register_version
+from nrcs_service import get_service
+from nrcs_station_catalog import get_catalog
+from nrcs_hourly_window import HourlyWindow
+from nrcs_get_data import get_hourly_snotel_temps
+from nrcs_downsample import downsample_range, visible_range
+from nrcs_climatology import load_climatology, read_climatology
+from nrcs_storm_events import StormEngine, get_event_log
+from forecast_products import load_zones, get_products
+from refresh_scheduler import get_scheduler
+from snapshot_store import SnapshotStore
+from shared_cache import get_backend
+import app_metrics
 
 STATIC_PATH = os.path.join(os.getcwd(), 'static')
+REFRESH_PERIOD = 120  # seconds, matches the page update interval
+REFRESH_SECONDS = app_metrics.histogram('summary_refresh_seconds',
+                                        'summary refresh (run_query) duration')
+TEMP_HISTORY_DAYS = 90
+TEMP_REFRESH_PERIOD = 3600  # seconds, the temperatures are hourly
+CLIMATOLOGY_PERIOD = 86400  # seconds, climatologies only change once a season
+FORECAST_ZONES = load_zones()
+POLLED_VERSIONS = (['summary', 'temperature']
+                   + ['forecast:' + zone['id'] for zone in FORECAST_ZONES])
+# one store per POLLED_VERSIONS entry
+POLLED_STORES = (['summary-available', 'temperature-available']
+                 + [{'type': 'forecast-available', 'zone': zone['id']} for zone in FORECAST_ZONES])
+FORECAST_FIELDS = [('Period', 'name'), ('Snow Level', 'snow_level'),
+                   ('Snow', 'accumulation'), ('Wind', 'wind'), ('Temperature', 'temps')]
+EVENT_DAYS = 7
+EVENT_COLUMNS = [{'name': 'Site', 'id': 'name'}, {'name': 'Time', 'id': 'time'},
+                 {'name': 'Event', 'id': 'kind'}, {'name': 'Value', 'id': 'value'},
+                 {'name': 'Detail', 'id': 'detail'}]
+
+
+
+def forecast_panel(zone, zones):
+    """
+    build the layout for one forecast zone
+        zone --> zone dict from the 'forecasts' config (id, name, url)
+        zones --> number of zones sharing the row
+    """
+    return html.Div([html.Div(html.H2(zone['name'], style={'width': '100%'}),
+                              style={'width': '100%', 'display': 'inline-block', 'padding': 0,
+                                     'text-align': 'center', 'backgroundColor': '#343a40'},),
+                     html.Div(html.Div(id={'type': 'forecast', 'zone': zone['id']},
+                                       style={'width': '98%',
+                                              'height': '98%',
+                                              'backgroundColor': 'white',
+                                              'margin': 'auto',
+                                              'padding': 5,
+                                              'border-radius': 5}),
+                              style={'width': '100%', 'display': 'inline-block', 'padding': 5,
+                                     'text-align': 'center',
+                                     'backgroundColor': 'rgba(9, 99, 159, 0.5)',
+                                     'margin': 'auto'})],
+                    style={'width': '{}%'.format(98 // max(zones, 1)), 'display': 'table-cell',
+                           'border-radius': 10, 'padding': 5,
+                           'text-align': 'center', 'backgroundColor': '#343a40',
+                           'vertical-align': 'top'})
+
 
 layout = html.Div(children=[
          html.Div(dbc.Row([
                  dbc.Col(html.Img(src='/static/logo.png', height="70px")),
                  dbc.Col(dbc.NavbarSimple(children=[
                          dbc.NavItem(dbc.NavLink('Summary', href='/summary')),
+                         dbc.NavItem(dbc.NavLink('Region', href='/region')),
                          ],
                         brand='Montana Powder Tracker',
                         brand_href='#',
@@ -50,70 +109,36 @@ layout = html.Div(children=[
                  style={'width': '49%', 'display': 'inline-block',
                         'border-radius': 10, 'padding': 5, 'vertical-align': 'top'}
                 ),
-        html.Div([
-        html.Div([html.Div(html.H2('Whitefish Forecast', style={'width': '100%'}),
-                          style={'width': '100%', 'display': 'inline-block', 'padding': 0,
-                         'text-align': 'center', 'backgroundColor': '#343a40'},),
-                 html.Div(html.Div(html.Pre(id='whitefish',
-                                            style={'width': '98%',
-                                                   'height': '98%',
-                                                   'backgroundColor': 'white',
-                                                   'margin': 'auto',
-                                                   'padding': 5,
-                                                   'border-radius': 5})),
-                          style={'width': '100%', 'display': 'inline-block', 'padding': 5,
-                         'text-align': 'center', 'backgroundColor': 'rgba(9, 99, 159, 0.5)',
-                         'margin': 'auto'})],
-                 style={'width': '49%', 'display': 'table-cell',
-                        'border-radius': 10, 'padding': 5,
-                        'text-align': 'center', 'backgroundColor': '#343a40',
-                        'vertical-align': 'top'}
-                ),
-        html.Div([html.Div(html.H2('Kootenai Forecast', style={'width': '100%'}),
-                          style={'width': '100%', 'display': 'inline-block', 'padding': 0,
-                         'text-align': 'center', 'backgroundColor': '#343a40'},),
-                 html.Div(html.Div(html.Pre(id='kootenai',
-                                            style={'width': '98%',
-                                                   'height': '98%',
-                                                   'backgroundColor': 'white',
-                                                   'margin': 'auto',
-                                                   'padding': 5,
-                                                   'border-radius': 5})),
-                          style={'width': '100%', 'display': 'inline-block', 'padding': 5,
-                         'text-align': 'center', 'backgroundColor': 'rgba(9, 99, 159, 0.5)',
-                         'margin': 'auto'})],
-                 style={'width': '49%', 'display': 'table-cell',
-                        'border-radius': 10, 'padding': 5,
-                        'text-align': 'center', 'backgroundColor': '#343a40',
-                        'vertical-align': 'top'}
-                ),], style={'display': 'table', 'width': '100%', 'height': '100%'}),
+        html.Div([forecast_panel(zone, len(FORECAST_ZONES)) for zone in FORECAST_ZONES],
+                 style={'display': 'table', 'width': '100%', 'height': '100%'}),
+        html.Div([html.H2('Storm Events', style={'text-align': 'center'}),
+                  dash_table.DataTable(id='storm-events', columns=EVENT_COLUMNS,
+                                       page_size=10)],
+                 style={'width': '100%', 'border-radius': 10, 'padding': 5}),
         html.Div(
                 dcc.Interval(
                         id='interval-component',
                         interval=120000,  # update every two minutes
                         n_intervals=0)
                 ),
-        html.P(id='placeholder')
+        dcc.Store(id='summary-version'),
+        dcc.Store(id='summary-polled', data=POLLED_VERSIONS),
+        html.Div([dcc.Store(id=store) for store in POLLED_STORES])
         ])
 
-# html.Pre(id='whitefish', style={'backgroundColor': 'white'})
-
-@app.callback(Output('current', 'figure'),
-              [Input(component_id='interval-component', component_property='n_intervals')])
-def get_overnight_stats(n):
-    df = pd.read_csv('cache/summary_data.csv')
-    with open('cache/latest.json') as latest_query:
-        query_info = json.load(latest_query)
-
-    return {'data': [go.Table(header=dict(values=['<b>Site</b>', '<b>Elevation</b>', '<b>Snow Depth</b>', '<b>SWE</b>', '<b>Temperature</b>'],
+def build_summary_figure(df, query_info):
+    """ build the current measurements table figure for a snapshot """
+    import plotly.graph_objects as go
+    swe_pct = df['swe_pct'] if 'swe_pct' in df else ['NA'] * len(df)  # older backups
+    return {'data': [go.Table(header=dict(values=['<b>Site</b>', '<b>Elevation</b>', '<b>Snow Depth</b>', '<b>SWE</b>', '<b>SWE % Median</b>', '<b>Temperature</b>'],
                                           line_color='black', fill_color='black',
                                           align='center',
                                           font=dict(color='white', size=16),
                                           height=40),
-                              cells=dict(values=[df['name'], df['elev'], df['depth'], df['swe'], df['temp']],
+                              cells=dict(values=[df['name'], df['elev'], df['depth'], df['swe'], swe_pct, df['temp']],
                                          height=25, font=dict(color='black', size=12)),
-                              columnorder=[1, 2, 3, 4, 5],
-                              columnwidth=[80, 80, 80, 80, 80])],
+                              columnorder=[1, 2, 3, 4, 5, 6],
+                              columnwidth=[80, 80, 80, 80, 80, 80]).to_plotly_json()],
             'layout': dict(height=400,
                            title='Current Measurements - {}'.format(query_info['date']),
                            margin=dict(left=20, right=20, top=60, bottom=20),
@@ -122,66 +147,270 @@ def get_overnight_stats(n):
             }
 
 
-@app.callback(Output('whitefish', 'children'),
-              [Input(component_id='interval-component', component_property='n_intervals')])
-def get_whitefish_forecast(n):
-    scraper = WebScraper('https://www.wrh.noaa.gov/mso/avalanche/sagwht.php')
-    data = scraper.query_by_field('pre')
-    with open('cache/whitefish.txt', 'w') as forecast:
-        forecast.write(str(data))
-    return str(data)
+summary_snapshots = SnapshotStore(build_summary_figure, 'cache/summary_snapshot.json',
+                                  backend=get_backend(), key='summary')
+hourly_window = HourlyWindow()
+
+
+register_version('summary', lambda: getattr(summary_snapshots.latest(), 'version', None))
+for zone in FORECAST_ZONES:
+    register_version('forecast:' + zone['id'],
+                     functools.partial(get_products().version, zone['id']))
+
+# each interval tick only polls /versions from the browser, the server
+# callbacks below run when one of the *-available stores changes
+app.clientside_callback(
+    ClientsideFunction(namespace='pow', function_name='poll_versions'),
+    [Output(store, 'data') for store in POLLED_STORES],
+    [Input(component_id='interval-component', component_property='n_intervals')],
+    [State('summary-polled', 'data')]
+    + [State(store, 'data') for store in POLLED_STORES])
+
+
+def patch_summary_figure(figure):
+    """ only send the parts of the summary figure that change between snapshots """
+    patched = Patch()
+    patched['data'][0]['cells']['values'] = figure['data'][0]['cells']['values']
+    patched['layout']['title'] = figure['layout']['title']
+    return patched
+
+
+@app.callback([Output('current', 'figure'), Output('summary-version', 'data')],
+              [Input('summary-available', 'data')],
+              [State('summary-version', 'data')])
+def get_overnight_stats(available, version):
+    snapshot = summary_snapshots.latest()
+    if snapshot is None or snapshot.version == version:
+        raise PreventUpdate  # nothing new for this client
+    if version is None:
+        return snapshot.figure, snapshot.version  # first load, send it all
+    return patch_summary_figure(snapshot.figure), snapshot.version
+
+
+@app.callback(Output('storm-events', 'data'),
+              [Input('summary-version', 'data')])
+def get_storm_events(version):
+    """ recent events for the configured sites, read from the event log """
+    with open('config.json') as config_file:
+        sites = json.load(config_file)['sites']
+    since = datetime.now() - timedelta(days=EVENT_DAYS)
+    site_metadata = get_catalog().lookup(sites)
+    events = get_event_log().query(sites, since)
+    for event in events:
+        metadata = site_metadata.get(event['triplet'])
+        event['name'] = event['triplet'] if metadata is None else metadata['name']
+    return events
+
+
+def temperature_history(data):
+    """
+    split a published temperature frame into per-site arrays
+        data --> dataframe of name, time (epoch milliseconds) and TOBS
+        returns --> dict of name: (timestamps, temperatures)
+    """
+    import numpy as np
+    import pandas as pd
+    names = data['name'].to_numpy()
+    timestamps = data['time'].to_numpy(dtype=np.int64).astype('datetime64[ms]')
+    temps = data['TOBS'].to_numpy(dtype=float)
+    return {name: (timestamps[names == name], temps[names == name])
+            for name in pd.unique(names)}
+
+
+def build_temperature_figure(data, info, x_range=None):
+    """
+    build the hourly temperature figure, downsampled to a time range
+        x_range --> (start, end) of the zoomed view, None for the full history
+    """
+    import plotly.graph_objects as go
+    traces = []
+    for name, (timestamps, temps) in temperature_history(data).items():
+        x, y = downsample_range(timestamps, temps, x_range)
+        traces.append(go.Scatter(x=x, y=y, mode='lines', name=name).to_plotly_json())
+    layout = dict(height=400, title='Hourly Temperature',
+                  margin=dict(left=20, right=20, top=60, bottom=20),
+                  paper_bgcolor='rgba(9, 99, 159, 0.5)',
+                  font=dict(color='white', size=18),
+                  uirevision='temp')  # keep the zoom when the figure changes
+    if x_range is not None:
+        layout['xaxis'] = dict(range=list(x_range))
+    return {'data': traces, 'layout': layout}
+
+
+temperature_snapshots = SnapshotStore(build_temperature_figure,
+                                      'cache/temperature_snapshot.json',
+                                      backend=get_backend(), key='temperature')
+register_version('temperature', lambda: getattr(temperature_snapshots.latest(), 'version', None))
+
+
+@app.callback(Output('temp', 'figure'),
+              [Input('temperature-available', 'data'),
+               Input(component_id='temp', component_property='relayoutData')])
+def get_temperature_history(available, relayout_data):
+    """
+    hourly temperature plot, downsampled to the zoomed range
+    NOTE: only reads the snapshot published by refresh_temperatures, the
+          full history figure is prebuilt and zooming re-samples in memory.
+          A new snapshot reaches open pages through the version poll, and
+          keeps the current zoom.
+    """
+    snapshot = temperature_snapshots.latest()
+    if snapshot is None:
+        raise PreventUpdate  # the first refresh hasn't finished yet
+    x_range = visible_range(relayout_data)
+    if x_range is None:
+        return snapshot.figure
+    return build_temperature_figure(snapshot.data, snapshot.info, x_range)
+
+
+def forecast_children(product):
+    """ render a parsed forecast product (see forecast_products.parse_product) """
+    periods = [period for period in product['periods']
+               if any(period.get(field) for label, field in FORECAST_FIELDS[1:])]
+    children = [html.H5(product['title'] or product['name']),
+                html.P('Issued {}'.format(product['issued'] or 'NA'))]
+    if periods:
+        children.append(dash_table.DataTable(
+                columns=[{'name': label, 'id': field} for label, field in FORECAST_FIELDS],
+                data=[{field: period.get(field) or '' for label, field in FORECAST_FIELDS}
+                      for period in periods],
+                style_cell={'textAlign': 'left', 'whiteSpace': 'normal'}))
+    children.append(html.Details([html.Summary('Full forecast'),
+                                  html.Pre(product['text'], style={'text-align': 'left'})],
+                                 open=not periods))
+    return children
+
 
+@app.callback(Output({'type': 'forecast', 'zone': MATCH}, 'children'),
+              [Input({'type': 'forecast-available', 'zone': MATCH}, 'data')],
+              [State({'type': 'forecast', 'zone': MATCH}, 'id')])
+def get_zone_forecast(available, component_id):
+    """ render a zone's latest product, only runs for the zone that changed """
+    product = get_products().latest(component_id['zone'])
+    if product is None:
+        return html.P('Forecast unavailable')
+    return forecast_children(product)
 
-@app.callback(Output('kootenai', 'children'),
-              [Input(component_id='interval-component', component_property='n_intervals')])
-def get_kootenai_forecast(n):
-    scraper = WebScraper('https://www.wrh.noaa.gov/mso/avalanche/sagktn.php')
-    data = scraper.query_by_field('pre')
-    with open('cache/kootenai.txt', 'w') as forecast:
-        forecast.write(str(data))
-    return str(data)
 
 @app.server.route('/static/<resource>')
 def serve_static(resource):
     return flask.send_from_directory(STATIC_PATH, resource)
 
 
-@app.callback(Output('placeholder', 'children'),
-              [Input('interval-component', 'n_intervals')])
-def run_query(n):
+@app_metrics.timed(REFRESH_SECONDS)
+def run_query():
     """
-    Query the data periodically using an app callback
+    Query the latest site data, run periodically by the background scheduler
     """
+    import numpy as np
+    import pandas as pd
     with open('config.json') as config_file:
         site_list = json.load(config_file)
     elevation = []
     site_data = []
     site_name = []
-    nrcs_service = NRCSService('powtracker.log')
+    nrcs_service = get_service('powtracker.log')
     today = datetime.now()
-    for site in site_list['sites']:
-        metadata = nrcs_service.get_station_metadata(site)
-        site_name.append(metadata['name'])
-        elevation.append(int(metadata['elevation']))
-        queries = ['SNWD', 'WTEQ', 'TOBS']
+    sites = site_list['sites']
+    queries = ['SNWD', 'WTEQ', 'TOBS']
+    site_metadata = get_catalog().get_metadata(nrcs_service, sites)
+    if not hourly_window.refresh(nrcs_service, sites, queries, today):
+        logging.warning('NRCS query failed, keeping the last summary')
+        return
+    try:
+        StormEngine(get_event_log()).ingest_window(hourly_window, sites)
+    except Exception as caught_exception:
+        logging.exception(caught_exception)
+    for site in sites:
+        metadata = site_metadata.get(site)
+        if metadata is None:
+            site_name.append(site)
+            elevation.append('NA')
+        else:
+            site_name.append(metadata['name'])
+            elevation.append(int(metadata['elevation']))
         data_row = []
-        for idx, query in enumerate(queries):
-            date = '{}-{}-{}'.format(today.year, today.month, today.day)
-            request_data = {'stationTriplets': site, 'elementCd': query,
-                            'ordinal': '1', 'beginDate': date,
-                            'endDate': date, 'beginHour': 0,
-                            'endHour': int(today.hour)}
-            ts, data = nrcs_service.get_station_hourly_data(request_data)
-            if len(data):
-                data_row.append(data[-1])  # append the last value
-            else:
-                data_row.append('NA')
+        for query in queries:
+            value = hourly_window.latest(site, query)
+            data_row.append('NA' if value is None else value)
+        climatology = read_climatology(site)
+        percent = None if climatology is None else climatology.percent_of_median(
+            'WTEQ', hourly_window.latest(site, 'WTEQ'), today)
+        data_row.append('NA' if percent is None else '{:.0f}%'.format(percent))
         site_data.append(data_row)
     site_data = np.asarray(site_data)
     df = pd.DataFrame(data=[site_name, elevation, site_data[:, 0],
-                            site_data[:, 1], site_data[:, 2]]).transpose()
-    df.columns = ['name', 'elev', 'depth', 'swe', 'temp']
-    df.to_csv('cache/summary_data.csv')
+                            site_data[:, 1], site_data[:, 2], site_data[:, 3]]).transpose()
+    df.columns = ['name', 'elev', 'depth', 'swe', 'temp', 'swe_pct']
     latest = {'date': datetime.strftime(today, '%Y-%m-%d %H:%M:%S')}
-    with open('cache/latest.json', 'w') as latest_query:
-        json.dump(latest, latest_query)
+    summary_snapshots.publish(df, latest)
+
+
+def refresh_forecasts():
+    """
+    re-check the forecasts, run periodically by the background scheduler
+    NOTE: the pages only read the parsed products, so a slow NWS server never
+          holds up a browser's callback, and each issuance is parsed once
+    """
+    get_products().refresh_all()
+
+
+def refresh_temperatures():
+    """
+    sync the hourly temperatures for the configured sites and publish them,
+    run hourly by the background scheduler
+    NOTE: the store sync goes to the NRCS server, so it's kept off the Dash
+          callbacks, which only read the published snapshot
+    """
+    import numpy as np
+    import pandas as pd
+    with open('config.json') as config_file:
+        sites = json.load(config_file)['sites']
+    end = datetime.now()
+    start = end - timedelta(days=TEMP_HISTORY_DAYS)
+    site_metadata = get_catalog().lookup(sites)
+    frames = []
+    for site in sites:
+        df = get_hourly_snotel_temps(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'),
+                                     site)
+        name = site_metadata[site]['name'] if site in site_metadata else site
+        times = pd.to_datetime(df['date']).to_numpy().astype('datetime64[ms]')
+        frames.append(pd.DataFrame({'name': name, 'time': times.astype(np.int64),
+                                    'TOBS': df['TOBS'].to_numpy(dtype=float)}))
+    if not frames:
+        return
+    temperature_snapshots.publish(pd.concat(frames, ignore_index=True),
+                                  {'date': end.strftime('%Y-%m-%d %H:%M:%S')})
+
+
+def refresh_climatology():
+    """
+    build (or update) the climatology for every site, run daily by the
+    background scheduler
+    NOTE: building a site's first climatology downloads its whole history,
+          so it runs separately from the summary refresh, which only reads
+          the saved artifacts
+    """
+    with open('config.json') as config_file:
+        site_list = json.load(config_file)
+    for site in site_list['sites']:
+        try:
+            load_climatology(site)
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+
+
+@app.server.before_request
+def start_refresh():
+    """
+    make sure the summary refresh is running in this server process
+    NOTE: started on request rather than at import so the debug reloader's
+          parent process doesn't run a second copy
+    """
+    get_scheduler('summary_refresh', REFRESH_PERIOD, run_query, get_backend()).start()
+    get_scheduler('forecast_refresh', REFRESH_PERIOD, refresh_forecasts,
+                  get_backend()).start()
+    get_scheduler('climatology_refresh', CLIMATOLOGY_PERIOD, refresh_climatology,
+                  get_backend()).start()
+    get_scheduler('temperature_refresh', TEMP_REFRESH_PERIOD, refresh_temperatures,
+                  get_backend()).start()
@@ -5,11 +5,68 @@
 @date: Sat Dec 21 08:30:52 2019
 @description
     Main dash application launching point.
+
+    Pages register a version function for each component that refreshes in
+    the background. Browsers poll /versions (a small JSON object with an ETag)
+    from a clientside callback, and only call back to the server for the
+    components whose version changed.
 """
 
+import json
+import hashlib
+import logging
 import dash
+import flask
 import dash_bootstrap_components as dbc
 
+from app_metrics import render_metrics
+from nrcs_logging_utilities import attach_root_logger
+
+# errors logged through the root logger (pages, scheduler jobs, caches) get the
+# same rate limit and background writer as the NRCS query logger
+attach_root_logger('powtracker.log')
+
 app = dash.Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.config['suppress_callback_exceptions'] = True
 server = app.server
+
+
+@server.route('/metrics')
+def metrics():
+    """ Prometheus scrape endpoint """
+    return flask.Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+_version_sources = {}
+
+
+def register_version(name, function):
+    """
+    add a component to the /versions endpoint
+        name --> key in the versions object (i.e. 'summary')
+        function --> returns the component's current version (anything JSON
+                     serializable), None if there is nothing to show yet
+    """
+    _version_sources[name] = function
+
+
+def current_versions():
+    """ get the current version of every registered component """
+    versions = {}
+    for name, function in _version_sources.items():
+        try:
+            versions[name] = function()
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+            versions[name] = None
+    return versions
+
+
+@server.route('/versions')
+def versions():
+    """ component versions, answered with 304 if the client's copy is current """
+    body = json.dumps(current_versions(), sort_keys=True, default=str)
+    response = flask.Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate
+    return response.make_conditional(flask.request)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+@brief one shared object per process
+@author: Graham Riches
+@date: Sun Oct 18 10:33:03 2026
+@description
+    Decorator for the get_x factories (get_service, get_store, ...) that hand
+    out one object per process. The object is created on first use, and a
+    forked worker process creates its own instead of sharing the parent's
+    connections, threads and file handles.
+"""
+
+import os
+import threading
+import functools
+
+
+def per_process(factory):
+    """
+    make a factory return the same object for every call in a process
+        factory --> function creating the object
+        returns --> the shared getter, with a reset() that forgets this
+                    process's object and returns it (None if there wasn't one)
+    NOTE: only the first call's arguments are used, later calls get the
+          existing object whatever they pass
+    """
+    lock = threading.Lock()
+    created = [None, None]  # pid, object
+
+    @functools.wraps(factory)
+    def shared(*args, **kwargs):
+        with lock:
+            if created[0] != os.getpid():
+                created[1] = factory(*args, **kwargs)
+                created[0] = os.getpid()
+            return created[1]
+
+    def reset():
+        with lock:
+            pid, value = created
+            created[0] = created[1] = None
+            return value if pid == os.getpid() else None
+
+    shared.reset = reset
+    return shared
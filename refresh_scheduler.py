@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+@brief background refresh scheduler
+@author: Graham Riches
+@date: Sun Oct 18 10:36:52 2026
+@description
+    Runs periodic jobs (i.e. the NRCS summary query) on one background thread
+    per job in the server process, so the work happens once per period no
+    matter how many browsers are connected. With a shared cache backend the
+    job only runs in the one server process holding its lease each period.
+"""
+
+import time
+import logging
+import threading
+
+
+class RefreshScheduler:
+    """ class to run a function periodically on a daemon thread """
+    def __init__(self, name, period, function, backend=None):
+        """
+        create a scheduler
+            name --> name of the job (used for the thread and logs)
+            period --> seconds between the start of each run
+            function --> callable run with no arguments
+            backend --> shared cache backend (see shared_cache) used to pick
+                        one process to run the job, None to always run it
+        """
+        self._name = name
+        self._period = period
+        self._function = function
+        self._backend = backend
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._logger = logging.getLogger(name)
+
+    def start(self):
+        """ start the job if it isn't running yet (safe to call repeatedly) """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name=self._name,
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ stop the job after the current run """
+        self._stop.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_leader(self):
+        """ check if this process should run the job this period """
+        if self._backend is None:
+            return True
+        try:
+            return self._backend.acquire_lease(self._name, self._period)
+        except Exception as caught_exception:
+            self._logger.exception(caught_exception)
+            return False
+
+    def tick(self):
+        """ run the job once, if this process holds the lease """
+        if not self.is_leader():
+            return
+        try:
+            self._function()
+        except Exception as caught_exception:
+            self._logger.exception(caught_exception)
+
+    def run(self):
+        """ run the job immediately and then once every period """
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.tick()
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(self._period - elapsed, 0))
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name, period, function, backend=None):
+    """ get the process-wide scheduler for a job, creating it on first use """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = RefreshScheduler(name, period, function, backend)
+        return _schedulers[name]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+@brief cache and lock backends shared between server processes
+@author: Graham Riches
+@date: Sun Oct 18 10:51:31 2026
+@description
+    When the app runs under several worker processes (i.e. gunicorn -w 4
+    pow_app:server) the snapshots, forecasts and refresh leases have to be
+    shared so exactly one worker refreshes each period and every worker
+    serves the same data. Two backends with the same interface:
+        FileBackend --> files under cache/shared, read through mmap and
+                        guarded by flock (the default)
+        RedisBackend --> any Redis-compatible client (get, set, delete)
+    The backend is picked with the POW_CACHE_URL environment variable: a
+    directory for the file backend, or a redis:// URL.
+"""
+
+import os
+import re
+import time
+import mmap
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from snapshot_store import write_atomic
+from process_singleton import per_process
+
+try:
+    import fcntl
+except ImportError:  # windows, only single process locking
+    fcntl = None
+
+
+DEFAULT_CACHE_PATH = 'cache/shared'
+LOCK_TIMEOUT = 30.0  # seconds a redis lock is held before it expires
+
+
+def owner_id():
+    """ identify this process (leases are held per process) """
+    return '{}:{}'.format(socket.gethostname(), os.getpid()).encode('utf-8')
+
+
+class FileBackend:
+    """ shared cache backed by one file per key """
+    def __init__(self, directory=DEFAULT_CACHE_PATH):
+        self._directory = directory
+        self._thread_locks = {}
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        """ get a safe file name for a key """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self._directory,
+                            '{}-{}'.format(re.sub(r'[^\w.-]', '_', key), digest))
+
+    def get(self, key):
+        """ get a value (bytes), None if missing or expired """
+        try:
+            with open(self.path(key), 'rb') as cache_file:
+                if os.fstat(cache_file.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    header = mapped.find(b'\n')
+                    expires = float(mapped[:header])
+                    if expires and expires < time.time():
+                        return None
+                    return mapped[header + 1:]
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value, ttl=None):
+        """
+        store a value
+            value --> bytes
+            ttl --> seconds before the value expires, None to keep it
+        """
+        expires = 0 if ttl is None else time.time() + ttl
+        os.makedirs(self._directory, exist_ok=True)
+
+        def write(cache_file):
+            cache_file.write('{!r}\n'.format(expires).encode('utf-8'))
+            cache_file.write(value)
+        write_atomic(self.path(key), write, mode='wb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self, name):
+        """ hold an exclusive lock across processes """
+        if fcntl is None:
+            with self._lock:
+                thread_lock = self._thread_locks.setdefault(name, threading.Lock())
+            with thread_lock:
+                yield
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        with open(self.path(name) + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def acquire_lease(self, name, seconds):
+        """
+        try to take (or renew) a named lease for this process
+            seconds --> how long the lease is held
+            returns --> True if this process holds the lease
+        """
+        key = 'lease:' + name
+        with self.lock(key):
+            holder = self.get(key)
+            if holder is not None and holder != owner_id():
+                return False
+            self.set(key, owner_id(), seconds)
+            return True
+
+
+class RedisBackend:
+    """ shared cache backed by a Redis-compatible client """
+    def __init__(self, client, prefix='pow:'):
+        """
+        create a backend
+            client --> redis.Redis (or compatible) client
+            prefix --> prefix for every key, so several apps can share a server
+        """
+        self._client = client
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value, ttl=None):
+        px = None if ttl is None else max(int(ttl * 1000), 1)
+        self._client.set(self._prefix + key, value, px=px)
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+    @contextmanager
+    def lock(self, name):
+        """
+        hold an exclusive lock across processes
+        NOTE: the lock expires after LOCK_TIMEOUT in case the holder dies
+        """
+        key = self._prefix + 'lock:' + name
+        token = owner_id() + ':{}'.format(threading.get_ident()).encode('utf-8')
+        while not self._client.set(key, token, nx=True, px=int(LOCK_TIMEOUT * 1000)):
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if self._client.get(key) == token:
+                self._client.delete(key)
+
+    def acquire_lease(self, name, seconds):
+        """ see FileBackend.acquire_lease """
+        key = self._prefix + 'lease:' + name
+        px = max(int(seconds * 1000), 1)
+        if self._client.set(key, owner_id(), nx=True, px=px):
+            return True
+        if self._client.get(key) == owner_id():
+            return bool(self._client.set(key, owner_id(), xx=True, px=px))
+        return False
+
+
+def create_backend(url=None):
+    """
+    create a backend from a location
+        url --> redis:// (or rediss://) URL, or a directory for the file
+                backend, defaults to POW_CACHE_URL or cache/shared
+    """
+    url = url or os.environ.get('POW_CACHE_URL') or DEFAULT_CACHE_PATH
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis  # optional, only needed for the redis backend
+        return RedisBackend(redis.Redis.from_url(url))
+    return FileBackend(url)
+
+
+@per_process
+def get_backend():
+    """ get the process-wide shared cache backend, creating it on first use """
+    return create_backend()
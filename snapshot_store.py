@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+@brief in-memory store of the latest dashboard data snapshot
+@author: Graham Riches
+@date: Sun Oct 18 10:37:27 2026
+@description
+    Holds the latest published data (plus a figure payload built once at
+    publish time) behind a version number, so callbacks can hand out the
+    cached figure or skip the update entirely when a client already has the
+    latest version. Disk is only used to recover the last snapshot after a
+    restart. With a shared cache backend, snapshots published by one server
+    process are picked up by the others.
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import namedtuple
+
+
+Snapshot = namedtuple('Snapshot', ['version', 'data', 'info', 'figure'])
+
+
+def write_atomic(path, write, mode='w'):
+    """
+    atomically replace a file so readers never see a partial write
+        path --> file to replace
+        write --> function that writes the new contents to an open file
+        mode --> file mode ('w' or 'wb')
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(temp_path, mode) as temp_file:
+        write(temp_file)
+    os.replace(temp_path, path)
+
+
+class SnapshotStore:
+    """ class to publish and serve versioned data snapshots """
+    def __init__(self, build_figure, backup_path=None, backend=None, key='snapshot'):
+        """
+        create a store
+            build_figure --> function(data, info) returning the figure payload
+            backup_path --> json file used for crash recovery (None for no
+                            backup)
+            backend --> shared cache backend (see shared_cache) so every server
+                        process serves the same snapshot, None to keep
+                        snapshots in this process only
+            key --> name of the snapshot in the backend
+        """
+        self._build_figure = build_figure
+        self._backup_path = backup_path
+        self._backend = backend
+        self._key = key
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.recover()
+
+    def latest(self):
+        """ get the latest snapshot, or None if nothing is published yet """
+        if self._backend is not None:
+            self.sync()
+        return self._snapshot
+
+    def publish(self, data, info):
+        """
+        publish new data
+            data --> dataframe of the new data
+            info --> dict of info about the data (i.e. query date)
+            returns --> the new snapshot
+        """
+        figure = self._build_figure(data, info)
+        if self._backend is None:
+            with self._lock:
+                version = 1 if self._snapshot is None else self._snapshot.version + 1
+                self._snapshot = Snapshot(version, data, info, figure)
+        else:
+            with self._backend.lock(self._key), self._lock:
+                version = 0 if self._snapshot is None else self._snapshot.version
+                shared = self._backend.get(self._key + ':version')
+                version = max(version, 0 if shared is None else int(shared)) + 1
+                self._snapshot = Snapshot(version, data, info, figure)
+                self._backend.set(self._key, json.dumps(self.to_payload(self._snapshot),
+                                                        default=str).encode('utf-8'))
+                self._backend.set(self._key + ':version', str(version).encode('utf-8'))
+        self.backup(self._snapshot)
+        return self._snapshot
+
+    def sync(self):
+        """ pick up a newer snapshot published by another process """
+        try:
+            shared = self._backend.get(self._key + ':version')
+            if shared is None or (self._snapshot is not None
+                                  and int(shared) <= self._snapshot.version):
+                return
+            snapshot = self.from_payload(json.loads(self._backend.get(self._key)))
+            with self._lock:
+                if self._snapshot is None or snapshot.version > self._snapshot.version:
+                    self._snapshot = snapshot
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+
+    def to_payload(self, snapshot):
+        return {'version': snapshot.version, 'info': snapshot.info,
+                'data': snapshot.data.to_dict(orient='list')}
+
+    def from_payload(self, payload):
+        """ rebuild a snapshot (and its figure) from a saved payload """
+        import pandas as pd
+        data = pd.DataFrame(payload['data'])
+        return Snapshot(payload['version'], data, payload['info'],
+                        self._build_figure(data, payload['info']))
+
+    def backup(self, snapshot):
+        """ save a snapshot for crash recovery """
+        if self._backup_path is None:
+            return
+        payload = self.to_payload(snapshot)
+        try:
+            write_atomic(self._backup_path,
+                         lambda backup: json.dump(payload, backup, default=str))
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+
+    def recover(self):
+        """ load the last backed up snapshot, if there is one """
+        if self._backup_path is None or not os.path.exists(self._backup_path):
+            return
+        try:
+            with open(self._backup_path) as backup:
+                self._snapshot = self.from_payload(json.load(backup))
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
@@ -6,16 +6,45 @@
 @description
 """
 
-import requests
-from bs4 import BeautifulSoup
+import json
+import time
+import logging
+import threading
+import app_metrics
+from shared_cache import get_backend
+
+
+SCRAPER_REQUEST_SECONDS = app_metrics.histogram('scraper_request_seconds',
+                                                'page fetch latency')
+SCRAPER_BYTES = app_metrics.counter('scraper_response_bytes_total',
+                                    'bytes received from scraped pages')
+SCRAPER_ERRORS = app_metrics.counter('scraper_errors_total', 'failed page fetches')
+FORECAST_CACHE = app_metrics.counter('forecast_cache_total',
+                                     'forecast cache lookups by result (hit, not_modified, miss, error)')
+
+
+def parse_page(content, field=None):
+    """
+    parse page content, optionally only keeping tags of one type
+        field --> html tag to keep (i.e. 'pre'), None parses the whole page
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    parse_only = None if field is None else SoupStrainer(field)
+    return BeautifulSoup(content, 'lxml', parse_only=parse_only)
 
 
 class WebScraper:
-    def __init__(self, _url):
-        """ initialize a scraper for a specific URL """
+    def __init__(self, _url, field=None):
+        """
+        initialize a scraper for a specific URL
+            field --> only parse tags of this type (much faster on big pages)
+        """
+        import requests
         self._url = _url
-        self.page = requests.get(self._url)
-        self.page_data = BeautifulSoup(self.page.content, 'html.parser')
+        with app_metrics.Timer(SCRAPER_REQUEST_SECONDS):
+            self.page = requests.get(self._url)
+        SCRAPER_BYTES.inc(len(self.page.content))
+        self.page_data = parse_page(self.page.content, field)
 
     def query_by_field(self, field):
         """ query a url by html field """
@@ -28,8 +57,151 @@ class WebScraper:
         return data
 
 
+class ForecastCache:
+    """
+    shared cache of scraped page fields with TTL expiry
+    NOTE: concurrent refreshes of the same URL are collapsed into one request,
+          and expired entries are re-checked with a conditional GET so an
+          unchanged page is never downloaded or parsed again
+    """
+    def __init__(self, ttl=300, timeout=30, backend=None):
+        """
+        create a cache
+            ttl --> seconds before an entry is checked for changes
+            timeout --> request timeout in seconds
+            backend --> shared cache backend (see shared_cache) so only one
+                        server process re-checks each page per ttl, None to
+                        keep entries in this process only
+        """
+        self._ttl = ttl
+        self._timeout = timeout
+        self._backend = backend
+        self._entries = {}
+        self._url_locks = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self):
+        """ get the HTTP session, created on first use """
+        if self._session is None:
+            import requests
+            with self._lock:
+                if self._session is None:
+                    self._session = requests.Session()
+        return self._session
+
+    def url_lock(self, url):
+        """ get the refresh lock for a URL """
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry['checked'] < self._ttl
+
+    def get(self, url, field='pre'):
+        """
+        get the first tag of a type from a page
+            url --> page to scrape
+            field --> html tag to return (i.e. 'pre')
+            returns --> the parsed tag, or the last good copy if the page
+                        can't be reached right now
+        """
+        key = (url, field)
+        entry = self._entries.get(key)
+        if self.is_fresh(entry):
+            FORECAST_CACHE.inc(result='hit')
+            return entry['data']
+        with self.url_lock(url):
+            entry = self._entries.get(key)
+            if self._backend is not None:
+                entry = self.load_shared(key, entry)
+            if self.is_fresh(entry):
+                FORECAST_CACHE.inc(result='hit')
+                return entry['data']  # another thread (or process) just refreshed it
+            if (self._backend is not None and entry is not None
+                    and not self._backend.acquire_lease(self.shared_key(key), self._ttl)):
+                FORECAST_CACHE.inc(result='hit')
+                return entry['data']  # another process is refreshing it
+            return self.refresh(key, entry)
+
+    def shared_key(self, key):
+        return 'forecast:{}:{}'.format(*key)
+
+    def load_shared(self, key, entry):
+        """ pick up a newer copy of an entry from the shared backend """
+        try:
+            shared = self._backend.get(self.shared_key(key))
+            if shared is None:
+                return entry
+            shared = json.loads(shared)
+            if entry is not None and shared['checked'] <= entry['checked']:
+                return entry
+            if entry is None or shared['html'] != str(entry['data']):
+                data = parse_page(shared['html'], key[1]).find(name=key[1])
+            else:
+                data = entry['data']  # unchanged, keep the parsed copy
+            entry = dict(shared, data=data)
+            del entry['html']
+            self._entries[key] = entry
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+        return entry
+
+    def save_shared(self, key, entry):
+        """ publish an entry to the other server processes """
+        try:
+            shared = {'html': str(entry['data']), 'checked': entry['checked'],
+                      'etag': entry['etag'], 'modified': entry['modified']}
+            self._backend.set(self.shared_key(key), json.dumps(shared).encode('utf-8'))
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+
+    def refresh(self, key, entry):
+        """ re-check a page, only parsing it if it changed """
+        url, field = key
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                headers['If-Modified-Since'] = entry['modified']
+        try:
+            with app_metrics.Timer(SCRAPER_REQUEST_SECONDS):
+                page = self.session.get(url, headers=headers, timeout=self._timeout)
+            if page.status_code == 304 and entry is not None:
+                FORECAST_CACHE.inc(result='not_modified')
+                entry['checked'] = time.time()
+                if self._backend is not None:
+                    self.save_shared(key, entry)
+                return entry['data']
+            page.raise_for_status()
+        except Exception as caught_exception:
+            logging.exception(caught_exception)
+            SCRAPER_ERRORS.inc()
+            FORECAST_CACHE.inc(result='error')
+            return None if entry is None else entry['data']
+        FORECAST_CACHE.inc(result='miss')
+        SCRAPER_BYTES.inc(len(page.content))
+        data = parse_page(page.content, field).find(name=field)
+        self._entries[key] = {'data': data, 'checked': time.time(),
+                              'etag': page.headers.get('ETag'),
+                              'modified': page.headers.get('Last-Modified')}
+        if self._backend is not None:
+            self.save_shared(key, self._entries[key])
+        return data
+
+
+_forecast_cache = ForecastCache(backend=get_backend())
+
+
+def get_forecast(url, field='pre'):
+    """ get a page field through the process-wide forecast cache """
+    return _forecast_cache.get(url, field)
+
+
 if __name__ == '__main__':
     url = 'https://www.wrh.noaa.gov/mso/avalanche/sagktn.php'
-    scraper = WebScraper(url)
+    scraper = WebScraper(url, 'pre')
     forecast = scraper.query_by_field('pre')
     print(forecast)